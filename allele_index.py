@@ -0,0 +1,198 @@
+"""Inverted allele index for top-k donor retrieval.
+
+For a recipient only the few best donors are often needed, not a dense
+recipients x donors matrix. The index keeps, per locus, posting lists of
+donors keyed by exact allele, by two-field allele (locus, first two fields)
+and by allele group (locus, first field), built from the `encoding` codes.
+
+A `pair_score` for one recipient allele decomposes along these nested sets:
+every donor typed at the locus gets `locus_only_points`, donors in the allele
+group posting move to `serotype_points`, donors in the two-field posting to
+`two_field_points` and donors in the exact posting to `full_match_points`
+(all times the locus weight). A query starts from the locus-only baseline,
+which only depends on which loci a donor is typed at, then walks the postings
+of the recipient's alleles adding the differences. The best candidates are
+re-scored exactly with the score tables, so similarities equal
+`build_similarity_matrix`.
+"""
+
+from typing import List
+import numpy as np
+
+from encoding import new_vocabulary, encode_donors, encode_queries
+from matrix_builder import recipient_max_scores, score_encoded, normalize_scores
+from score_tables import DEFAULT_PARAMS
+
+
+def _postings(codes: np.ndarray, size: int) -> tuple:
+    """CSR posting lists of donors per code (codes -1 are skipped)."""
+    donors = np.flatnonzero(codes >= 0)
+    order = donors[np.argsort(codes[donors], kind='stable')]
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes[donors], minlength=size), out=indptr[1:])
+    return indptr, order
+
+
+def build_index(donors) -> dict:
+    """
+    Build the inverted index of a donor pool.
+
+    Args:
+        donors: List of lists of allele strings, or a pool_cache.load_pool pool.
+
+    Returns:
+        dict: ``'vocab'``, ``'allele'`` ((M, L) donor codes), ``'typed'``
+        (unique typed-loci patterns, (G, L) bool), ``'typed_index'`` (pattern
+        per donor), ``'groups'`` (donors per pattern) and ``'postings'``, per
+        locus a dict of CSR posting lists
+        ``'allele'`` / ``'two'`` / ``'first'`` as (indptr, donors).
+    """
+    if isinstance(donors, dict):
+        vocab, alleles = donors['vocab'], np.asarray(donors['allele'])
+    else:
+        vocab = new_vocabulary()
+        alleles = encode_donors(donors, vocab)['allele']
+    typed, typed_index = np.unique(alleles >= 0, axis=0, return_inverse=True)
+    typed_index = typed_index.reshape(-1)
+    # Donors of every typed-loci pattern, in donor order
+    members = np.argsort(typed_index, kind='stable')
+    groups = np.split(members, np.cumsum(np.bincount(typed_index, minlength=len(typed)))[:-1])
+    postings = []
+    for locus_id in range(alleles.shape[1]):
+        codes = alleles[:, locus_id]
+        lists = {'allele': _postings(codes, len(vocab['alleles'][locus_id]))}
+        for level, ids in (('two', 'two_ids'), ('first', 'first_ids')):
+            # Allele code -> two-field / group code, -1 stays -1
+            lookup = np.array(vocab[level][locus_id] + [-1], dtype=np.int64)
+            lists[level] = _postings(lookup[codes], len(vocab[ids][locus_id]))
+        postings.append(lists)
+    return {'vocab': vocab, 'allele': alleles, 'typed': typed, 'typed_index': typed_index,
+            'groups': groups, 'postings': postings}
+
+
+def _posting(lists: dict, level: str, code: int) -> np.ndarray:
+    indptr, donors = lists[level]
+    if code < 0 or code + 1 >= len(indptr):
+        return donors[:0]
+    return donors[indptr[code]:indptr[code + 1]]
+
+
+def approximate_scores(index: dict, alleles: List[str], params: tuple = DEFAULT_PARAMS) -> tuple:
+    """
+    Raw pair scores of one recipient against every donor, from the postings.
+
+    Sums are accumulated in a different order than the score tables, so they
+    can differ from the exact score in the last bits. The recipient is encoded
+    with encoding.encode_queries, so the index (and a pool it was built from)
+    keeps its vocabulary.
+
+    Returns:
+        tuple: (scores (M,) float64, (M,) mask of donors found in any
+        posting, recipient codes as encoding.encode_recipients, the
+        vocabulary of those codes).
+    """
+    full, two_pts, sero, locus_only, weights = params
+    weights = dict(weights)
+    rec, vocab = encode_queries([list(alleles)], index['vocab'])
+    n_loci = index['allele'].shape[1]
+    codes = zip(rec['locus'][0].tolist(), rec['allele'][0].tolist())
+
+    baseline = np.zeros(len(index['typed']))
+    slots = []
+    for locus_id, allele_id in codes:
+        # Empty alleles and loci no donor is typed at never score
+        if allele_id < 0 or locus_id >= n_loci:
+            continue
+        weight = float(weights.get(vocab['names'][locus_id], 0.8))
+        baseline += locus_only * weight * index['typed'][:, locus_id]
+        slots.append((locus_id, allele_id, weight))
+
+    scores = baseline[index['typed_index']]
+    touched = np.zeros(len(scores), dtype=bool)
+    for locus_id, allele_id, weight in slots:
+        lists = index['postings'][locus_id]
+        first = vocab['first'][locus_id][allele_id]
+        two = vocab['two'][locus_id][allele_id]
+        level = locus_only
+        # Nested postings: exact allele within two-field within allele group
+        for name, code, points in (('first', first, sero), ('two', two, two_pts),
+                                   ('allele', allele_id, full)):
+            if code < 0:
+                continue
+            donors = _posting(lists, name, code)
+            if len(donors):
+                scores[donors] += (points - level) * weight
+                touched[donors] = True
+            level = points
+    return scores, touched, rec, vocab
+
+
+def _first_untouched(group: np.ndarray, touched: np.ndarray, k: int) -> np.ndarray:
+    """First k donors of a group outside every posting, growing the scanned prefix."""
+    size = 4 * k
+    while True:
+        head = group[:size]
+        free = head[~touched[head]]
+        if len(free) >= k or size >= len(group):
+            return free[:k]
+        size *= 4
+
+
+def _candidates(index: dict, scores: np.ndarray, touched: np.ndarray, k: int) -> np.ndarray:
+    """Donors that can be among the best k, a small superset of them.
+
+    Donors outside every posting score their pattern baseline, so only the
+    first k of each pattern (lowest index wins ties) are kept. Posted donors
+    below the k-th best of those cannot make it either. `scores` must already
+    be capped where similarities clamp at 1.0, so that every donor tying at
+    the k-th similarity is kept.
+    """
+    rest = [_first_untouched(group, touched, k) for group in index['groups']]
+    rest = np.concatenate(rest) if rest else np.empty(0, dtype=np.int64)
+    bound = -np.inf
+    if len(rest) >= k:
+        bound = np.partition(scores[rest], len(rest) - k)[len(rest) - k]
+    touched = np.flatnonzero(touched)
+    pool = np.concatenate([rest, touched[scores[touched] >= bound - 1e-9]])
+    if len(pool) <= k:
+        return np.sort(pool)
+    kth = np.partition(scores[pool], len(pool) - k)[len(pool) - k]
+    # Margin for rounding differences, ties are resolved by the exact scores
+    return np.sort(pool[scores[pool] >= kth - 1e-9])
+
+
+def top_k(index: dict, alleles: List[str], k: int = 10, params: tuple = DEFAULT_PARAMS) -> list:
+    """
+    Best k donors of one recipient.
+
+    Args:
+        index: Inverted index from build_index.
+        alleles: Recipient allele strings.
+        k: Number of donors returned.
+        params: Scoring parameters, see score_tables.scoring_params.
+
+    Returns:
+        list: (donor index, similarity) pairs, best first; equal similarities
+        are ordered by donor index (also donors clamped to 1.0 when partial
+        match points exceed full_match_points). Similarities equal
+        build_similarity_matrix.
+
+    >>> index = build_index([['A*01:01', 'B*08:01'], ['A*01:02', 'B*08:01'], ['A*02:01']])
+    >>> top_k(index, ['A*01:01', 'B*08:01'], k=2)
+    [(0, 1.0), (1, 0.6875)]
+    """
+    m = len(index['allele'])
+    if k <= 0 or m == 0:
+        return []
+    scores, touched, rec, vocab = approximate_scores(index, alleles, params)
+    max_s = np.array(recipient_max_scores([list(alleles)], params))[:, None]
+    if k < m:
+        # Rank as the clamped similarities do: scores above the maximum all tie
+        capped = np.clip(scores, 0.0, max_s[0, 0]) if max_s[0, 0] > 0 else np.zeros(m)
+        candidates = _candidates(index, capped, touched, k)
+    else:
+        candidates = np.arange(m)
+    exact = score_encoded(rec, {'allele': index['allele'][candidates]}, vocab, params)
+    sim = normalize_scores(exact, max_s)[0]
+    order = np.lexsort((candidates, -sim))[:k]
+    return [(int(candidates[i]), float(sim[i])) for i in order]
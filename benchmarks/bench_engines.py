@@ -0,0 +1,51 @@
+'''
+Timing of matching engines on a random thresholded cost matrix
+
+python -m benchmarks.bench_engines --size 2000 --engines numpy hungarian
+'''
+import argparse
+import random
+import time
+from matching import convert_similarity, remove_not_accepted, match, ENGINES
+
+
+def random_cost(size: int, min_accept: int, seed: int) -> list:
+    '''
+    Random square cost matrix built the same way main.py does it
+    '''
+    rng = random.Random(seed)
+    sim = [[rng.random() for _ in range(size)] for _ in range(size)]
+    return remove_not_accepted(convert_similarity(sim), min_accept=min_accept)
+
+
+def main(argv=None):
+    '''
+    Runs every requested engine on the same matrix and prints timings
+    '''
+    p = argparse.ArgumentParser(description='Matching engine benchmark')
+    p.add_argument('--size', type=int, default=2000)
+    p.add_argument('--min-accept', type=int, default=60)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    args = p.parse_args(argv)
+
+    cost = random_cost(args.size, args.min_accept, args.seed)
+    timings = {}
+    results = {}
+    for engine in args.engines:
+        t0 = time.perf_counter()
+        results[engine] = match(cost, engine=engine)
+        timings[engine] = time.perf_counter() - t0
+        print(f'{engine:<10} {args.size}x{args.size}  {timings[engine]:.3f}s')
+
+    base = timings.get('hungarian')
+    if base:
+        for engine, elapsed in timings.items():
+            if engine != 'hungarian':
+                print(f'{engine} speedup over hungarian: {base / elapsed:.1f}x')
+    if 'hungarian' in results and 'numpy' in results:
+        print('numpy == hungarian:', results['numpy'] == results['hungarian'])
+
+
+if __name__ == '__main__':
+    main()
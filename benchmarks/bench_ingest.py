@@ -0,0 +1,115 @@
+'''
+Throughput and peak RSS of CSV ingest
+
+python -m benchmarks.bench_ingest --donors 1000000
+
+Every reader runs in a fresh interpreter so peak RSS is measured per reader.
+'compile' writes the compiled pool (pool_cache) next to the CSV and 'pool'
+is a warm start from it.
+'''
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+LOCI = ('A', 'B', 'C', 'DRB1', 'DQB1')
+
+
+ALLELES = {locus: [f'{locus}*{g:02d}:{s:02d}' for g in range(1, 40) for s in range(1, 6)]
+           for locus in LOCI}
+
+
+def random_typing(rng: random.Random) -> list:
+    '''
+    Two random alleles per locus
+    '''
+    return [rng.choice(ALLELES[l]) for l in LOCI for _ in range(2)]
+
+
+def write_pool(path: str, count: int, seed: int = 0):
+    '''
+    Writes a donor CSV in the examples/ layout (id + 10 allele columns)
+    '''
+    rng = random.Random(seed)
+    with open(path, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(['Donors'] + [f'HLA-{l}_Allele{k}' for l in LOCI for k in (1, 2)])
+        for i in range(count):
+            writer.writerow([f'D{i}'] + random_typing(rng))
+
+
+def peak_rss_mb() -> float:
+    '''
+    Peak resident set size of this process in MiB
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_child(mode: str, path: str) -> dict:
+    '''
+    Runs one reader in this process and returns its measurements
+    '''
+    # Imported here so the noop baseline pays for the same imports
+    from main import read_people # pylint: disable=import-outside-toplevel
+    from ingest import read_people_columnar # pylint: disable=import-outside-toplevel
+    from pool_cache import load_pool # pylint: disable=import-outside-toplevel
+    t0 = time.perf_counter()
+    if mode == 'lists':
+        rows = len(read_people(path)[0])
+    elif mode == 'columnar':
+        rows = len(read_people_columnar(path)['ids'])
+    elif mode == 'compile':
+        rows = len(load_pool(path, rebuild=True)['ids'])
+    elif mode == 'pool':
+        rows = len(load_pool(path)['ids'])
+    else:
+        rows = 0
+    return {'mode': mode, 'rows': rows, 'seconds': time.perf_counter() - t0,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def main(argv=None):
+    '''
+    Generates (or reuses) a donor file and measures every reader on it
+    '''
+    p = argparse.ArgumentParser(description='CSV ingest benchmark')
+    p.add_argument('--donors', type=int, default=1_000_000)
+    p.add_argument('--path', help='Existing CSV to read instead of a generated one')
+    p.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(*args.child)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.path
+        if not path:
+            path = os.path.join(tmp, 'donors.csv')
+            write_pool(path, args.donors)
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f'{path}: {size_mb:.1f} MiB')
+        # The parent stays small: Linux children inherit its peak RSS
+        for mode in ('noop', 'lists', 'columnar', 'compile', 'pool'):
+            out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_ingest',
+                                  '--child', mode, path],
+                                 check=True, capture_output=True, text=True).stdout
+            res = json.loads(out)
+            if mode == 'noop':
+                print(f"interpreter + imports peak RSS {res['peak_rss_mb']:.0f} MiB")
+                continue
+            rate = res['rows'] / res['seconds'] if res['seconds'] else 0
+            print(f"{mode:<9} rows={res['rows']:<8} {res['seconds']:.2f}s "
+                  f"{rate:,.0f} rows/s {size_mb / max(res['seconds'], 1e-9):.1f} MiB/s "
+                  f"peak RSS {res['peak_rss_mb']:.0f} MiB")
+
+
+if __name__ == '__main__':
+    main()
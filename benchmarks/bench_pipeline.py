@@ -0,0 +1,211 @@
+'''
+Stage timings of the CLI pipeline on synthetic populations, saved as JSON
+
+python -m benchmarks.bench_pipeline --sizes 50x500 200x2000 --out bench.json
+python -m benchmarks.bench_pipeline --sizes 50x500 --compare bench.json
+
+For every recipients x donors size a seeded population (benchmarks.population)
+is written to CSV and every stage of main.py is timed: read_people,
+build_similarity_matrix, convert_similarity + remove_not_accepted, match and
+the output writers. The assignment is checked against
+scipy.optimize.linear_sum_assignment on the same cost matrix, which is timed
+as well. --compare reports the ratio to an earlier result file and exits with
+status 1 when a stage got slower than --tolerance.
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.population import generate_population, write_people, load_frequencies
+from main import read_people, write_matrix_csv, write_matrix_html, \
+    generate_assignment_csv_string
+from matching import convert_similarity, remove_not_accepted, match, INF, ENGINES
+from matrix_builder import build_similarity_matrix
+
+FORMAT = 1
+# Stages faster than this are too noisy to flag as regressions
+MIN_SECONDS = 0.005
+
+
+def parse_size(text: str) -> tuple:
+    '''
+    'RxD' -> (recipients, donors)
+
+    >>> parse_size('50x500')
+    (50, 500)
+    '''
+    rec, _, don = text.lower().partition('x')
+    return int(rec), int(don)
+
+
+def timed(repeat: int, func, *args, **kwargs) -> tuple:
+    '''
+    (last result, best wall time of `repeat` calls)
+    '''
+    best = None
+    result = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def assignment_cost(cost: list, result: list) -> tuple:
+    '''
+    (number of assigned rows, their total cost), unassigned rows count INF
+    like in linear_sum_assignment on the INF cost matrix
+
+    >>> assignment_cost([[10, INF], [INF, INF]], [0, -1])
+    (1, 100010)
+    '''
+    assigned = [(i, j) for i, j in enumerate(result) if j != -1]
+    total = sum(cost[i][j] for i, j in assigned) + INF * (len(result) - len(assigned))
+    return len(assigned), total
+
+
+def scipy_check(cost: list, result: list) -> dict:
+    '''
+    Optimal total cost from scipy on the same matrix, compared with result
+    '''
+    from scipy.optimize import linear_sum_assignment # pylint: disable=import-outside-toplevel
+    arr = np.array(cost, dtype=np.float64)
+    t0 = time.perf_counter()
+    rows, cols = linear_sum_assignment(arr)
+    elapsed = time.perf_counter() - t0
+    expected = int(arr[rows, cols].sum()) + INF * (len(cost) - len(rows))
+    assigned, total = assignment_cost(cost, result)
+    return {'scipy_seconds': elapsed, 'total_cost': total, 'scipy_total_cost': expected,
+            'assigned': assigned, 'optimal': total == expected}
+
+
+def run_size(n_rec: int, n_don: int, args, frequencies: dict) -> dict:
+    '''
+    Times every pipeline stage for one population size
+    '''
+    rec_ids, recs = generate_population(n_rec, args.seed, frequencies, args.untyped_rate, 'R')
+    don_ids, dons = generate_population(n_don, args.seed + 1, frequencies,
+                                        args.untyped_rate, 'D')
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        rec_path = os.path.join(tmp, 'recipients.csv')
+        don_path = os.path.join(tmp, 'donors.csv')
+        write_people(rec_path, rec_ids, recs, 'Recipient')
+        write_people(don_path, don_ids, dons, 'Donors')
+        (_, recs), stages['read_recipients'] = timed(args.repeat, read_people, rec_path)
+        (don_ids, dons), stages['read_donors'] = timed(args.repeat, read_people, don_path)
+
+        sim, stages['build_similarity'] = timed(args.repeat, build_similarity_matrix, recs, dons)
+        cost, stages['convert_threshold'] = timed(
+            args.repeat, lambda: remove_not_accepted(convert_similarity(sim), args.min_accept))
+        results = {}
+        for engine in args.engines:
+            results[engine], stages[f'match_{engine}'] = timed(args.repeat, match, cost, engine)
+        result = results[args.engines[0]]
+
+        for fmt, writer in (('csv', write_matrix_csv), ('html', write_matrix_html)):
+            path = os.path.join(tmp, f'out.{fmt}')
+            _, stages[f'write_{fmt}'] = timed(args.repeat, writer, path, rec_ids, don_ids,
+                                              sim, result, args.min_accept)
+        _, stages['write_assignment'] = timed(args.repeat, generate_assignment_csv_string,
+                                              rec_ids, don_ids, sim, result, args.min_accept)
+
+    run = {'recipients': n_rec, 'donors': n_don, 'stages': stages,
+           'engines_agree': all(assignment_cost(cost, r) == assignment_cost(cost, result)
+                                for r in results.values())}
+    if not args.no_scipy:
+        run['check'] = scipy_check(cost, result)
+    return run
+
+
+def compare(runs: list, previous: dict, tolerance: float) -> list:
+    '''
+    Stages slower than tolerance x the previous run of the same size,
+    as (size, stage, previous seconds, seconds)
+    '''
+    before = {(r['recipients'], r['donors']): r['stages'] for r in previous.get('runs', [])}
+    slower = []
+    for run in runs:
+        old = before.get((run['recipients'], run['donors']))
+        if not old:
+            continue
+        size = f"{run['recipients']}x{run['donors']}"
+        for stage, seconds in run['stages'].items():
+            if stage not in old:
+                continue
+            ratio = seconds / old[stage] if old[stage] else float('inf')
+            print(f'{size:>12} {stage:<18} {old[stage]:.4f}s -> {seconds:.4f}s  x{ratio:.2f}')
+            if ratio > tolerance and seconds - old[stage] > MIN_SECONDS:
+                slower.append((size, stage, old[stage], seconds))
+    return slower
+
+
+def main(argv=None):
+    '''
+    Runs the pipeline benchmark for every size, writes and compares JSON results
+    '''
+    p = argparse.ArgumentParser(description='Pipeline benchmark on synthetic HLA populations')
+    p.add_argument('--sizes', nargs='+', type=parse_size,
+                   default=[(10, 100), (50, 500), (200, 2000)],
+                   help='recipients x donors, e.g. 50x500 (default: 10x100 50x500 200x2000)')
+    p.add_argument('--min-accept', type=int, default=60)
+    p.add_argument('--engines', nargs='+', choices=ENGINES, default=['jv'],
+                   help='Matching engines to time, the first one is checked (default: jv)')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--frequencies', help='JSON allele-frequency tables per locus')
+    p.add_argument('--untyped-rate', type=float, default=0.0)
+    p.add_argument('--repeat', type=int, default=3, help='Best of N runs per stage')
+    p.add_argument('--no-scipy', action='store_true', help='Skip the scipy check')
+    p.add_argument('--out', help='Write results to this JSON file')
+    p.add_argument('--compare', help='Earlier JSON results to compare with')
+    p.add_argument('--tolerance', type=float, default=1.25,
+                   help='Slowdown ratio reported as a regression (default: 1.25)')
+    args = p.parse_args(argv)
+
+    frequencies = load_frequencies(args.frequencies)
+    runs = []
+    failed = False
+    for n_rec, n_don in args.sizes:
+        run = run_size(n_rec, n_don, args, frequencies)
+        runs.append(run)
+        total = sum(run['stages'].values())
+        line = f'{n_rec}x{n_don}: {total:.3f}s  ' + \
+            '  '.join(f'{k} {v:.4f}' for k, v in run['stages'].items())
+        check = run.get('check')
+        if check:
+            line += f"  scipy {check['scipy_seconds']:.4f}s optimal={check['optimal']}"
+            failed = failed or not check['optimal']
+        failed = failed or not run['engines_agree']
+        print(line)
+
+    report = {'format': FORMAT,
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'platform': platform.platform(),
+              'machine': platform.machine(),
+              'args': {'min_accept': args.min_accept, 'engines': args.engines,
+                       'seed': args.seed, 'repeat': args.repeat,
+                       'frequencies': args.frequencies, 'untyped_rate': args.untyped_rate},
+              'runs': runs}
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fh:
+            slower = compare(runs, json.load(fh), args.tolerance)
+        for size, stage, old, new in slower:
+            print(f'Regression: {size} {stage} {old:.4f}s -> {new:.4f}s', file=sys.stderr)
+        failed = failed or bool(slower)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
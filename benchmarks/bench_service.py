@@ -0,0 +1,128 @@
+'''
+Load generator for the matching service
+
+python -m benchmarks.bench_service --donors 100000 --clients 16 --requests 400
+
+Starts service.py on a generated donor pool, then keeps --clients concurrent
+keep-alive connections busy with /match requests and reports latency
+percentiles and requests per second.
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_ingest import write_pool, random_typing
+
+
+async def post(reader, writer, body: bytes) -> dict:
+    '''
+    One keep-alive POST /match round trip
+    '''
+    writer.write(b'POST /match HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n'
+                 + f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+    await writer.drain()
+    status = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    payload = json.loads(await reader.readexactly(length))
+    if b' 200 ' not in status:
+        raise RuntimeError(f'{status!r}: {payload}')
+    return payload
+
+
+async def client(host: str, port: int, bodies: list, latencies: list):
+    '''
+    Sends its share of requests sequentially over one connection
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for body in bodies:
+            t0 = time.perf_counter()
+            await post(reader, writer, body)
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        writer.close()
+
+
+async def run_load(host: str, port: int, bodies: list, clients: int) -> tuple:
+    '''
+    Spreads bodies over concurrent clients, returns (latencies, wall time)
+    '''
+    latencies = []
+    shares = [bodies[k::clients] for k in range(clients)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(host, port, share, latencies) for share in shares if share))
+    return latencies, time.perf_counter() - t0
+
+
+def percentile(values: list, q: float) -> float:
+    '''
+    Nearest-rank percentile
+
+    >>> percentile([4, 1, 3, 2], 50), percentile([4, 1, 3, 2], 99)
+    (2, 4)
+    '''
+    ordered = sorted(values)
+    rank = int(-(-len(ordered) * q // 100))
+    return ordered[max(0, rank - 1)]
+
+
+def main(argv=None):
+    '''
+    Generates a pool, starts the service and measures it under load
+    '''
+    p = argparse.ArgumentParser(description='Matching service load generator')
+    p.add_argument('--donors', type=int, default=100_000)
+    p.add_argument('--clients', type=int, default=16, help='Concurrent connections')
+    p.add_argument('--requests', type=int, default=400, help='Total requests')
+    p.add_argument('--batch', type=int, default=4, help='Recipients per request')
+    p.add_argument('--min-accept', type=float, default=60.0)
+    p.add_argument('--workers', type=int, default=None, help='Service solver processes')
+    p.add_argument('--seed', type=int, default=1)
+    args = p.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    bodies = [json.dumps({'min_accept': args.min_accept,
+                          'recipients': [{'id': f'R{r}-{k}', 'alleles': random_typing(rng)}
+                                         for k in range(args.batch)]}).encode()
+              for r in range(args.requests)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'donors.csv')
+        write_pool(path, args.donors)
+        cmd = [sys.executable, 'service.py', path, '--port', '0']
+        if args.workers is not None:
+            cmd += ['--workers', str(args.workers)]
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        server = subprocess.Popen(cmd, cwd=root, stdout=subprocess.PIPE, text=True)
+        try:
+            line = server.stdout.readline()
+            print(line.strip())
+            host, port = line.split('http://')[1].split()[0].rsplit(':', 1)
+            # Warm-up request: score tables and worker processes
+            asyncio.run(run_load(host, int(port), bodies[:1], 1))
+            latencies, wall = asyncio.run(run_load(host, int(port), bodies, args.clients))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f'{len(latencies)} requests x {args.batch} recipients, {args.clients} clients')
+    print(f'p50 {percentile(latencies, 50) * 1000:.1f} ms  '
+          f'p99 {percentile(latencies, 99) * 1000:.1f} ms  '
+          f'{len(latencies) / wall:.1f} req/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+'''
+Seeded synthetic HLA population generator
+
+Genotypes are sampled per locus from allele-frequency tables, two independent
+draws per locus (Hardy-Weinberg), for the loci of scoring.DEFAULT_LOCI_WEIGHTS.
+The built-in tables hold common alleles with rounded published population
+frequencies; whatever frequency a table leaves is spread over a long tail of
+rare alleles, so pools have many near matches and few identical typings, as
+real registries do.
+
+python -m benchmarks.population --count 1000 --out donors.csv
+python -m benchmarks.population --count 50 --frequencies freqs.json --recipients
+
+A frequency file is JSON: {"A": {"A*02:01": 0.28, ...}, ...}; loci it omits
+keep the built-in table.
+'''
+import argparse
+import bisect
+import csv
+import itertools
+import json
+import random
+import sys
+
+from scoring import DEFAULT_LOCI_WEIGHTS
+
+FREQUENCIES = {
+    'A': {'A*02:01': 0.28, 'A*01:01': 0.15, 'A*03:01': 0.14, 'A*24:02': 0.09,
+          'A*11:01': 0.06, 'A*29:02': 0.03, 'A*32:01': 0.03, 'A*26:01': 0.03,
+          'A*68:01': 0.03, 'A*31:01': 0.025, 'A*23:01': 0.02, 'A*25:01': 0.02,
+          'A*30:01': 0.015, 'A*33:01': 0.01, 'A*02:05': 0.01},
+    'B': {'B*07:02': 0.12, 'B*08:01': 0.10, 'B*44:02': 0.08, 'B*35:01': 0.06,
+          'B*15:01': 0.06, 'B*44:03': 0.05, 'B*51:01': 0.05, 'B*40:01': 0.05,
+          'B*18:01': 0.045, 'B*57:01': 0.035, 'B*14:02': 0.03, 'B*27:05': 0.03,
+          'B*13:02': 0.025, 'B*38:01': 0.02, 'B*35:03': 0.02, 'B*49:01': 0.015},
+    'C': {'C*07:01': 0.15, 'C*07:02': 0.13, 'C*04:01': 0.11, 'C*06:02': 0.09,
+          'C*05:01': 0.08, 'C*03:04': 0.07, 'C*12:03': 0.06, 'C*01:02': 0.04,
+          'C*02:02': 0.04, 'C*08:02': 0.035, 'C*03:03': 0.035, 'C*15:02': 0.03,
+          'C*16:01': 0.03, 'C*14:02': 0.015},
+    'DRB1': {'DRB1*15:01': 0.14, 'DRB1*03:01': 0.12, 'DRB1*07:01': 0.12,
+             'DRB1*01:01': 0.09, 'DRB1*04:01': 0.08, 'DRB1*13:01': 0.06,
+             'DRB1*11:01': 0.05, 'DRB1*13:02': 0.04, 'DRB1*04:04': 0.035,
+             'DRB1*08:01': 0.025, 'DRB1*12:01': 0.02, 'DRB1*16:01': 0.015,
+             'DRB1*14:01': 0.015, 'DRB1*11:04': 0.015},
+    'DQB1': {'DQB1*03:01': 0.19, 'DQB1*02:01': 0.13, 'DQB1*06:02': 0.13,
+             'DQB1*05:01': 0.12, 'DQB1*03:02': 0.10, 'DQB1*02:02': 0.08,
+             'DQB1*06:03': 0.06, 'DQB1*06:04': 0.04, 'DQB1*03:03': 0.04,
+             'DQB1*04:02': 0.025, 'DQB1*05:03': 0.02, 'DQB1*05:02': 0.015},
+}
+
+# Rare alleles per locus sharing the frequency a table leaves over
+TAIL_SIZE = 60
+
+
+def load_frequencies(path: str = None) -> dict:
+    '''
+    Built-in frequency tables, with the loci of a JSON file replacing them
+    '''
+    tables = {locus: dict(FREQUENCIES.get(locus, {})) for locus in DEFAULT_LOCI_WEIGHTS}
+    if path:
+        with open(path, encoding='utf-8') as fh:
+            tables.update({locus: dict(table) for locus, table in json.load(fh).items()})
+    return tables
+
+
+def sampler(locus: str, table: dict, tail: int = TAIL_SIZE) -> tuple:
+    '''
+    (alleles, cumulative weights) of one locus, the remainder of the table
+    spread over `tail` rare alleles with 1/rank weights
+
+    >>> alleles, cum = sampler('A', {'A*02:01': 0.5})
+    >>> alleles[0], cum[0], round(cum[-1], 9)
+    ('A*02:01', 0.5, 1.0)
+    '''
+    alleles = list(table)
+    weights = [float(table[a]) for a in alleles]
+    rest = 1.0 - sum(weights)
+    if rest > 1e-9 and tail > 0:
+        known = set(alleles)
+        # Fields that do not clash with the table, group 90+ is not a real one
+        names = (f'{locus}*{g:02d}:{s:02d}' for g in range(90, 100) for s in range(1, 100))
+        rare = list(itertools.islice((a for a in names if a not in known), tail))
+        harmonic = sum(1 / r for r in range(1, len(rare) + 1))
+        alleles += rare
+        weights += [rest / (r * harmonic) for r in range(1, len(rare) + 1)]
+    return alleles, list(itertools.accumulate(weights))
+
+
+def generate_population(count: int, seed: int = 0, frequencies: dict = None,
+                        untyped_rate: float = 0.0, prefix: str = 'D') -> tuple:
+    '''
+    Seeded genotypes, two alleles per locus
+
+    :param count: number of people
+    :type count: int
+    :param seed: random seed, equal seeds give equal populations
+    :type seed: int
+    :param frequencies: per-locus allele frequency tables, see load_frequencies
+    :type frequencies: dict
+    :param untyped_rate: probability that a locus is not typed at all
+    :type untyped_rate: float
+    :param prefix: id prefix
+    :type prefix: str
+    :return: (ids, allele lists) as main.read_people
+    :rtype: tuple
+
+    >>> generate_population(2, seed=3) == generate_population(2, seed=3)
+    True
+    >>> len(generate_population(1)[1][0])
+    10
+    '''
+    rng = random.Random(seed)
+    tables = [sampler(locus, table) for locus, table in
+              (frequencies or load_frequencies()).items()]
+    ids, typings = [], []
+    for i in range(count):
+        alleles = []
+        for names, cum in tables:
+            if untyped_rate and rng.random() < untyped_rate:
+                continue
+            for _ in range(2):
+                k = bisect.bisect_left(cum, rng.random() * cum[-1])
+                alleles.append(names[min(k, len(names) - 1)])
+        ids.append(f'{prefix}{i + 1}')
+        typings.append(alleles)
+    return ids, typings
+
+
+def write_people(path: str, ids: list, typings: list, title: str = 'Donors'):
+    '''
+    Writes people in the examples/ CSV layout (id + up to 2 columns per locus)
+    '''
+    width = max((len(t) for t in typings), default=0)
+    out = open(path, 'w', newline='', encoding='utf-8') if path else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow([title] + [f'Allele{k + 1}' for k in range(width)])
+    for rid, alleles in zip(ids, typings):
+        writer.writerow([rid] + alleles + [''] * (width - len(alleles)))
+    if path:
+        out.close()
+
+
+def main(argv=None):
+    '''
+    Writes a generated population as CSV
+    '''
+    p = argparse.ArgumentParser(description='Synthetic HLA population generator')
+    p.add_argument('--count', type=int, default=1000)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--frequencies', help='JSON allele-frequency tables per locus')
+    p.add_argument('--untyped-rate', type=float, default=0.0,
+                   help='Probability that a locus is left untyped')
+    p.add_argument('--recipients', action='store_true', help='R ids instead of D ids')
+    p.add_argument('--out', help='Output CSV (default: stdout)')
+    args = p.parse_args(argv)
+
+    prefix, title = ('R', 'Recipient') if args.recipients else ('D', 'Donors')
+    ids, typings = generate_population(args.count, args.seed, load_frequencies(args.frequencies),
+                                       args.untyped_rate, prefix)
+    write_people(args.out, ids, typings, title)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''
+Optimality certificate of an assignment
+Checks a solver result against its dual potentials in one O(n * m) pass over the
+thresholded cost rows, in the model every engine solves: not accepted cells
+(INF) are no pairs at all, and every recipient has a private dummy donor of cost
+INF that it takes when it stays unassigned. Rows without any acceptable donor
+are left out. The potentials certify the assignment optimal when
+    primal - assigned columns are distinct and acceptable
+    dual - u[i] + v[j] <= c[i][j] on acceptable cells, v[j] <= 0 and u[i] <= INF
+           on assigned rows (the free dummy donor)
+    slackness - u[i] + v[j] == c[i][j] on assigned pairs, v[j] == 0 on free
+                columns and u[i] >= INF on unassigned rows (their dummy donor)
+Dual feasible potentials give the lower bound sum(min(u, INF)) + sum(v) of the
+optimal cost; with complementary slackness it equals the cost of the assignment.
+'''
+import numpy as np
+from matching import INF
+from cost_buffer import COST_DTYPE, similarity_to_cost
+
+# Violations described in the messages of a failed certificate
+MAX_MESSAGES = 10
+
+
+def similarity_cost_rows(sim, min_accept: int = 60):
+    '''
+    Thresholded cost rows of a similarity matrix, one row at a time
+    Same costs as convert_similarity + remove_not_accepted
+    :param sim: similarity matrix (rows may be generated lazily)
+    :param min_accept: minimum accepted similarity percentage
+    :type min_accept: int
+
+    >>> [row.tolist() for row in similarity_cost_rows([[0.5, 0.7], [0.9, 0.1]])]
+    [[100000, 30], [10, 100000]]
+    '''
+    for row in sim:
+        sim_row = np.asarray(row, dtype=np.float64)[None, :]
+        cost = np.empty(sim_row.shape, dtype=COST_DTYPE)
+        feasible = np.empty(sim_row.shape, dtype=bool)
+        similarity_to_cost(sim_row, cost, feasible, min_accept)
+        yield np.where(feasible[0], cost[0].astype(np.int64), INF)
+
+
+def buffer_cost_rows(cost: np.ndarray, feasible: np.ndarray):
+    '''
+    Thresholded cost rows of a cost buffer (cost_buffer, tiled_builder), one row at
+    a time, so the buffers may be memory-mapped files
+    '''
+    for i in range(cost.shape[0]):
+        yield np.where(feasible[i], np.asarray(cost[i], dtype=np.int64), INF)
+
+
+def verify(rows, result: list, u: list, v: list, tol: float = 1e-6) -> dict:
+    '''
+    Checks primal feasibility, dual feasibility and complementary slackness
+    :param rows: thresholded cost rows (INF for not accepted pairs), e.g.
+                 similarity_cost_rows or buffer_cost_rows
+    :param result: assigned donor index per recipient, -1 if none
+    :type result: list
+    :param u: row potentials, as match(duals=True) returns them
+    :type u: list
+    :param v: column potentials
+    :type v: list
+    :param tol: absolute tolerance of the comparisons
+    :type tol: float
+    :return: {'ok', 'primal', 'dual', 'slackness' (violation counts), 'cost',
+             'lower_bound', 'gap', 'messages' (first violations)}; the lower bound
+             only holds when there are no dual violations
+    :rtype: dict
+
+    >>> arr = [[10, 30], [20, INF]]
+    >>> report = verify(arr, [1, 0], [30, 40], [-20, 0])
+    >>> report['ok'], report['cost'], report['lower_bound']
+    (True, 50.0, 50.0)
+    >>> report = verify(arr, [0, -1], [10, 20], [0, 0])
+    >>> report['ok'], report['slackness'], report['messages'][0]
+    (False, 1, 'slackness: row 1 is unassigned but u = 20 < INF')
+    '''
+    v = np.asarray(v, dtype=np.float64)
+    m = len(v)
+    report = {'ok': True, 'primal': 0, 'dual': 0, 'slackness': 0,
+              'cost': 0.0, 'lower_bound': 0.0, 'gap': 0.0, 'messages': []}
+
+    def fail(kind: str, text: str):
+        report[kind] += 1
+        if len(report['messages']) < MAX_MESSAGES:
+            report['messages'].append(f'{kind}: {text}')
+
+    taken = np.zeros(m, dtype=bool)
+    n = 0
+    for i, row in enumerate(rows):
+        n += 1
+        row = np.asarray(row, dtype=np.float64)
+        j = result[i] if i < len(result) else -1
+        finite = row < INF
+        if not finite.any():
+            if j != -1:
+                fail('primal', f'row {i} has no acceptable donor but holds column {j}')
+            continue
+        u_i = float(u[i])
+        reduced = row - u_i - v
+        bad = np.flatnonzero(finite & (reduced < -tol))
+        if len(bad):
+            fail('dual', f'row {i}: u + v exceeds the cost at {len(bad)} column(s), '
+                         f'first {int(bad[0])}')
+        report['lower_bound'] += min(u_i, INF)
+        if j == -1:
+            report['cost'] += INF
+            if u_i < INF - tol:
+                fail('slackness', f'row {i} is unassigned but u = {u_i:g} < INF')
+            continue
+        if not 0 <= j < m or not finite[j]:
+            fail('primal', f'row {i} holds column {j}, not an acceptable donor')
+            report['cost'] += INF
+            continue
+        if taken[j]:
+            fail('primal', f'column {j} is assigned more than once (row {i})')
+        taken[j] = True
+        report['cost'] += float(row[j])
+        if u_i > INF + tol:
+            fail('dual', f'row {i}: u = {u_i:g} above its dummy donor cost INF')
+        if abs(reduced[j]) > tol:
+            fail('slackness', f'row {i}: reduced cost {reduced[j]:g} on its column {j}')
+    if n != len(result):
+        fail('primal', f'{len(result)} assignments for {n} rows')
+    for j in np.flatnonzero(v > tol).tolist():
+        fail('dual', f'column {j}: v = {v[j]:g} > 0')
+    for j in np.flatnonzero(~taken & (np.abs(v) > tol)).tolist():
+        fail('slackness', f'column {j} is free but v = {v[j]:g}')
+    report['lower_bound'] += float(v.sum())
+    report['gap'] = report['cost'] - report['lower_bound']
+    report['ok'] = not (report['primal'] or report['dual'] or report['slackness'])
+    return report
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
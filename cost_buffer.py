@@ -0,0 +1,229 @@
+"""Compact cost pipeline: one preallocated cost buffer and a feasibility mask.
+
+The list pipeline keeps several full recipients x donors copies alive
+(similarity floats, converted costs, thresholded costs, the solver's rows).
+Here similarities are computed a block of recipients at a time and converted
+in place into one (N, M) uint16 cost buffer, with a separate (N, M) bool mask
+of acceptable pairs instead of the INF sentinel. That is 3 bytes per pair;
+only one block of float64 similarities exists at a time.
+
+Costs are bit-identical to `matching.convert_similarity` +
+`remove_not_accepted`: the vectorized rounding is only trusted away from the
+rounding boundary, cells next to it are recomputed with Python's `round`.
+Similarities of single pairs (e.g. the assigned ones, for the outputs) are
+recomputed exactly on demand through `PairSimilarity`.
+"""
+
+import numpy as np
+
+from matching_approx import approx_assignment, assignment_duals, assignment_gap
+from matching_numpy import shortest_augmenting_path_masked
+from matching_sparse import sparse_assignment
+from matrix_builder import encode_populations, recipient_max_scores, score_encoded, \
+    normalize_scores
+from score_tables import DEFAULT_PARAMS
+
+COST_DTYPE = np.uint16
+# Float64 similarity cells computed per block
+BLOCK_CELLS = 1 << 21
+
+
+def similarity_to_cost(sim: np.ndarray, cost: np.ndarray, feasible: np.ndarray,
+                       min_accept: float = 60) -> None:
+    """
+    Convert a similarity block into costs and feasibility, in place.
+
+    `cost` gets int(round(1 - s, 2) * 100) and `feasible` whether that cost is
+    within 100 - min_accept.
+
+    Args:
+        sim: (R, M) float64 similarities.
+        cost: (R, M) output cost view (uint16).
+        feasible: (R, M) output bool view.
+        min_accept: Minimum accepted similarity percentage.
+
+    >>> sim = np.array([[0.5, 0.71, 1.0], [0.6, 0.395, 0.0]])
+    >>> cost = np.empty((2, 3), COST_DTYPE); feasible = np.empty((2, 3), bool)
+    >>> similarity_to_cost(sim, cost, feasible, 60)
+    >>> cost.tolist(), feasible.tolist()
+    ([[50, 28, 0], [40, 60, 100]], [[False, True, True], [True, False, False]])
+    """
+    scaled = np.subtract(1.0, sim)
+    scaled *= 100.0
+    # Hundredths next to .5 may round differently than Python's exact round()
+    near = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    np.rint(scaled, out=scaled)
+    # k / 100 * 100 truncated, like int(round(1 - s, 2) * 100) (0.29 gives 28)
+    scaled /= 100.0
+    scaled *= 100.0
+    np.trunc(scaled, out=scaled)
+    if near.any():
+        rows, cols = np.nonzero(near)
+        scaled[rows, cols] = [int(round(1 - v, 2) * 100) for v in sim[rows, cols].tolist()]
+    cost[...] = scaled
+    np.less_equal(cost, 100 - int(min_accept), out=feasible)
+
+
+def build_cost_buffer(recipients: list, donors, min_accept: float = 60,
+                      params: tuple = DEFAULT_PARAMS, block_cells: int = BLOCK_CELLS) -> dict:
+    """
+    Cost buffer and feasibility mask of all recipient-donor pairs.
+
+    Args:
+        recipients: List of lists of allele strings.
+        donors: List of lists of allele strings, or a pool_cache.load_pool pool.
+        min_accept: Minimum accepted similarity percentage.
+        params: Scoring parameters, see score_tables.scoring_params.
+        block_cells: Similarity cells computed at once.
+
+    Returns:
+        dict: ``'cost'`` ((N, M) uint16), ``'feasible'`` ((N, M) bool) and
+        ``'similarity'``, a `PairSimilarity` giving exact similarities.
+    """
+    rec, don, vocab = encode_populations(recipients, donors)
+    n, m = len(recipients), len(don['allele'])
+    max_s = np.array(recipient_max_scores(recipients, params))[:, None]
+    cost = np.empty((n, m), dtype=COST_DTYPE)
+    feasible = np.empty((n, m), dtype=bool)
+    step = max(1, block_cells // max(m, 1))
+    for start in range(0, n, step):
+        block = slice(start, min(n, start + step))
+        total = score_encoded({'locus': rec['locus'][block], 'allele': rec['allele'][block]},
+                              don, vocab, params)
+        similarity_to_cost(normalize_scores(total, max_s[block]), cost[block], feasible[block],
+                           min_accept)
+    return {'cost': cost, 'feasible': feasible,
+            'similarity': PairSimilarity(rec, don, vocab, max_s, params)}
+
+
+class PairSimilarity:
+    """Recipients x donors similarity computed pair by pair on demand.
+
+    `sim[i][j]` equals build_similarity_matrix(...)[i][j]; nothing is stored,
+    so it suits the few pairs the outputs read (the assigned ones).
+    """
+
+    def __init__(self, rec: dict, don: dict, vocab: dict, max_s: np.ndarray,
+                 params: tuple = DEFAULT_PARAMS):
+        self.rec = rec
+        self.don = don
+        self.vocab = vocab
+        self.max_s = max_s
+        self.params = params
+
+    def __len__(self):
+        return len(self.max_s)
+
+    def __getitem__(self, i):
+        return _PairRow(self, i)
+
+    def value(self, i: int, j: int) -> float:
+        """Similarity of recipient i and donor j."""
+        total = score_encoded({'locus': self.rec['locus'][i:i + 1],
+                               'allele': self.rec['allele'][i:i + 1]},
+                              {'allele': self.don['allele'][j:j + 1]}, self.vocab, self.params)
+        return float(normalize_scores(total, self.max_s[i:i + 1])[0, 0])
+
+
+class _PairRow:
+    __slots__ = ('_sim', '_i')
+
+    def __init__(self, sim: PairSimilarity, i: int):
+        self._sim = sim
+        self._i = i
+
+    def __len__(self):
+        return len(self._sim.don['allele'])
+
+    def __getitem__(self, j):
+        return self._sim.value(self._i, j)
+
+
+def live_rows(feasible: np.ndarray, block_cells: int = BLOCK_CELLS) -> np.ndarray:
+    """Rows with at least one feasible cell, read about block_cells cells at a time."""
+    step = max(1, block_cells // max(feasible.shape[1], 1))
+    parts = [np.flatnonzero(feasible[start:start + step].any(axis=1)) + start
+             for start in range(0, feasible.shape[0], step)]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+def feasible_edges(cost: np.ndarray, feasible: np.ndarray, rows: np.ndarray,
+                   block_cells: int = BLOCK_CELLS) -> tuple:
+    """CSR edges (indptr, indices, costs) of the feasible cells of `rows`.
+
+    Rows are read a block at a time, so the buffers may be memory-mapped.
+    """
+    m = cost.shape[1]
+    step = max(1, block_cells // max(m, 1))
+    counts, indices, costs = [], [], []
+    for start in range(0, len(rows), step):
+        block = rows[start:start + step]
+        mask = feasible[block]
+        r, c = np.nonzero(mask)
+        counts.append(np.bincount(r, minlength=len(block)))
+        indices.append(c)
+        costs.append(cost[block][r, c].astype(np.float64))
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    if counts:
+        np.cumsum(np.concatenate(counts), out=indptr[1:])
+    return (indptr, np.concatenate(indices) if indices else np.empty(0, dtype=np.int64),
+            np.concatenate(costs) if costs else np.empty(0))
+
+
+def match_buffer(cost: np.ndarray, feasible: np.ndarray, engine: str = 'jv',
+                 gap: dict = None, duals: bool = False):
+    """
+    matching.match on a cost buffer, same result contract.
+
+    Rows without any feasible donor stay -1 and are not given to the solver.
+
+    Args:
+        cost: (N, M) cost buffer, rows <= cols.
+        feasible: (N, M) bool feasibility mask.
+        engine: ``'jv'`` (matching_numpy.shortest_augmenting_path_masked),
+            ``'sparse'`` (CSR edges taken straight from the mask) or ``'approx'``
+            (matching_approx on the same edges).
+        gap: Filled with matching_approx.assignment_gap for ``'approx'``.
+        duals: Also return the row and column potentials, as
+            matching.match(duals=True) does.
+
+    Both engines read the buffers a row or a block of rows at a time, so
+    they can be memory-mapped files (see tiled_builder).
+
+    Returns:
+        list: Assigned donor index per recipient, -1 if none; with `duals`
+        a (result, u, v) tuple.
+
+    >>> cost = np.array([[50, 70], [10, 90], [99, 99]], dtype=COST_DTYPE)
+    >>> match_buffer(cost, cost <= 80), match_buffer(cost, cost <= 80, 'sparse')
+    ([1, 0, -1], [1, 0, -1])
+    """
+    if engine not in ('jv', 'sparse', 'approx'):
+        raise ValueError(f'Engine {engine} does not run on a cost buffer')
+    n, m = cost.shape
+    result = [-1] * n
+    row_u = [0] * n
+    live = live_rows(feasible)
+    if live.size == 0:
+        return (result, row_u, [0] * m) if duals else result
+    if engine == 'sparse':
+        indptr, cols, costs = feasible_edges(cost, feasible, live)
+        assignment, u, v = sparse_assignment(indptr.tolist(), cols.tolist(), costs.tolist(), m)
+    elif engine == 'approx':
+        edges = feasible_edges(cost, feasible, live)
+        assignment, u, v = approx_assignment(*edges, m)
+        if gap is not None:
+            gap.update(assignment_gap(*edges, assignment, u, v))
+    else:
+        assignment, u, v = shortest_augmenting_path_masked(cost, feasible, rows=live.tolist())
+        if duals and len(live) == m:
+            # No free donor, potentials of the INF dummy donors as in matching.match
+            u, v = assignment_duals(*feasible_edges(cost, feasible, live),
+                                    [c if feasible[i, c] else -1
+                                     for i, c in zip(live.tolist(), assignment)],
+                                    m, len(live) + 1)
+    for k, i in enumerate(live.tolist()):
+        c = assignment[k]
+        result[i] = c if c != -1 and c < m and feasible[i, c] else -1
+        row_u[i] = u[k]
+    return (result, row_u, v[:m]) if duals else result
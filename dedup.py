@@ -0,0 +1,121 @@
+"""Genotype deduplication.
+
+Registries hold many people with exactly the same typing (common
+haplotypes). Similarity only depends on the typing, so it is computed once
+per unique recipient genotype x unique donor genotype and expanded back to
+people through index arrays, without copying rows.
+"""
+
+from typing import List
+import numpy as np
+
+from scoring import parse_locus
+
+
+def recipient_key(alleles: List[str]) -> tuple:
+    """Canonical recipient genotype: sorted tuple of trimmed alleles.
+
+    >>> recipient_key(['B*07:02', ' A*01:01'])
+    ('A*01:01', 'B*07:02')
+    """
+    return tuple(sorted(str(a).strip() for a in alleles))
+
+
+def donor_key(alleles: List[str]) -> tuple:
+    """Canonical donor genotype.
+
+    Donors are compared through the last allele they list per locus, so two
+    donors are equivalent when those alleles agree, whatever the order.
+
+    >>> donor_key(['A*01:01', 'B*08:01']) == donor_key(['B*08:01', 'A*01:01'])
+    True
+    """
+    effective = {}
+    for allele in alleles:
+        effective[parse_locus(allele)] = str(allele).strip()
+    return tuple(sorted(effective.items()))
+
+
+def unique_genotypes(people: List[List[str]], key) -> tuple:
+    """Group people by canonical genotype.
+
+    Returns:
+        (representatives, index): one typing per unique genotype (its first
+        occurrence) and an int array mapping every person to its genotype.
+
+    >>> reps, index = unique_genotypes([['A*01'], ['A*02'], ['A*01']], recipient_key)
+    >>> reps, index.tolist()
+    ([['A*01'], ['A*02']], [0, 1, 0])
+    """
+    seen = {}
+    representatives = []
+    index = np.empty(len(people), dtype=np.int64)
+    for i, person in enumerate(people):
+        k = key(person)
+        pos = seen.get(k)
+        if pos is None:
+            pos = seen[k] = len(representatives)
+            representatives.append(person)
+        index[i] = pos
+    return representatives, index
+
+
+class SimilarityRow:
+    """One lazily expanded row of a `SimilarityView`."""
+
+    __slots__ = ('_values', '_col_index')
+
+    def __init__(self, values: np.ndarray, col_index: np.ndarray):
+        self._values = values
+        self._col_index = col_index
+
+    def __len__(self):
+        return len(self._col_index)
+
+    def __getitem__(self, j):
+        if isinstance(j, slice):
+            return self._values[self._col_index[j]].tolist()
+        return float(self._values[self._col_index[j]])
+
+    def __iter__(self):
+        return iter(self._values[self._col_index].tolist())
+
+
+class SimilarityView:
+    """Read-only recipients x donors similarity matrix backed by unique genotypes.
+
+    `view[i][j]` is `unique[row_index[i], col_index[j]]`; nothing is expanded
+    until a value is read, so memory stays at unique x unique.
+
+    >>> view = SimilarityView(np.array([[0.5, 1.0]]), np.array([0, 0]), np.array([1, 0, 1]))
+    >>> len(view), len(view[0]), view[1][0], view.tolist()
+    (2, 3, 1.0, [[1.0, 0.5, 1.0], [1.0, 0.5, 1.0]])
+    """
+
+    def __init__(self, unique: np.ndarray, row_index: np.ndarray, col_index: np.ndarray):
+        self.unique = unique
+        self.row_index = row_index
+        self.col_index = col_index
+
+    @property
+    def shape(self) -> tuple:
+        """(recipients, donors)"""
+        return len(self.row_index), len(self.col_index)
+
+    def __len__(self):
+        return len(self.row_index)
+
+    def __getitem__(self, i):
+        return SimilarityRow(self.unique[self.row_index[i]], self.col_index)
+
+    def __iter__(self):
+        for r in self.row_index:
+            yield SimilarityRow(self.unique[r], self.col_index)
+
+    def toarray(self) -> np.ndarray:
+        """Fully expanded (N, M) ndarray."""
+        return self.unique[np.ix_(self.row_index, self.col_index)]
+
+    def tolist(self) -> list:
+        """Fully expanded list of lists."""
+        return self.toarray().tolist()
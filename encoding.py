@@ -0,0 +1,185 @@
+"""Integer encoding of HLA typings.
+
+Every allele string is interned once into per-locus integer codes, so
+populations become small integer arrays that can be compared with NumPy
+instead of re-parsing strings for every recipient-donor pair.
+
+Codes kept per locus:
+- locus id (index into ``vocab['names']``)
+- full-allele id (exact string match)
+- two-field id (first two fields, -1 if the allele has fewer fields)
+- first-field id (allele group, -1 if the allele has no fields)
+"""
+
+from typing import List
+import numpy as np
+
+from scoring import parse_locus, _allele_fields
+
+
+def new_vocabulary() -> dict:
+    """Return an empty allele vocabulary.
+
+    The vocabulary is append-only, so codes stay valid while new
+    populations are encoded against it.
+    """
+    return {
+        'loci': {},      # locus name -> locus id
+        'names': [],     # locus id -> locus name
+        'alleles': [],   # per locus: allele string -> allele id
+        'first': [],     # per locus: allele id -> first-field id
+        'two': [],       # per locus: allele id -> two-field id
+        'first_ids': [],  # per locus: first field -> id
+        'two_ids': [],    # per locus: (first, second) field -> id
+    }
+
+
+def copy_vocabulary(vocab: dict) -> dict:
+    """Return a copy of `vocab` that can be extended without touching it.
+
+    Codes already in `vocab` keep their values in the copy.
+
+    >>> v = new_vocabulary()
+    >>> _ = intern_allele(v, 'A*02:01')
+    >>> w = copy_vocabulary(v)
+    >>> intern_allele(w, 'A*24:02'), len(v['alleles'][0]), len(w['alleles'][0])
+    ((0, 1), 1, 2)
+    """
+    return {
+        'loci': dict(vocab['loci']),
+        'names': list(vocab['names']),
+        'alleles': [dict(d) for d in vocab['alleles']],
+        'first': [list(ids) for ids in vocab['first']],
+        'two': [list(ids) for ids in vocab['two']],
+        'first_ids': [dict(d) for d in vocab['first_ids']],
+        'two_ids': [dict(d) for d in vocab['two_ids']],
+    }
+
+
+def intern_locus(vocab: dict, locus: str) -> int:
+    """Return the id of `locus`, adding it to the vocabulary if needed."""
+    locus_id = vocab['loci'].get(locus)
+    if locus_id is None:
+        locus_id = len(vocab['names'])
+        vocab['loci'][locus] = locus_id
+        vocab['names'].append(locus)
+        for key in ('alleles', 'first_ids', 'two_ids'):
+            vocab[key].append({})
+        vocab['first'].append([])
+        vocab['two'].append([])
+    return locus_id
+
+
+def intern_allele(vocab: dict, allele: str) -> tuple:
+    """Return ``(locus_id, allele_id)`` for an allele string.
+
+    Empty alleles keep their locus (they still count towards the maximum
+    score) but get allele id -1 because they never score any points.
+
+    >>> v = new_vocabulary()
+    >>> intern_allele(v, 'A*02:01'), intern_allele(v, ' A*02:01 '), intern_allele(v, 'B*07:02')
+    ((0, 0), (0, 0), (1, 0))
+    """
+    allele = str(allele or "").strip()
+    locus_id = intern_locus(vocab, parse_locus(allele))
+    if not allele:
+        return locus_id, -1
+    alleles = vocab['alleles'][locus_id]
+    allele_id = alleles.get(allele)
+    if allele_id is None:
+        allele_id = len(alleles)
+        alleles[allele] = allele_id
+        fields = _allele_fields(allele)
+        first_ids = vocab['first_ids'][locus_id]
+        two_ids = vocab['two_ids'][locus_id]
+        first = first_ids.setdefault(fields[0], len(first_ids)) if fields else -1
+        two = two_ids.setdefault(tuple(fields[:2]), len(two_ids)) if len(fields) >= 2 else -1
+        vocab['first'][locus_id].append(first)
+        vocab['two'][locus_id].append(two)
+    return locus_id, allele_id
+
+
+def encode_recipients(people: List[List[str]], vocab: dict) -> dict:
+    """Encode recipients keeping their typing order.
+
+    Returns a dict with two ``(N, S)`` int32 arrays, S being the longest
+    typing: ``'locus'`` (locus id per slot) and ``'allele'`` (allele id per
+    slot). Unused slots hold -1 in both arrays. Keeping the order means
+    per-pair scores are summed exactly like the scalar implementation.
+    """
+    slots = max((len(p) for p in people), default=0)
+    loci = np.full((len(people), slots), -1, dtype=np.int32)
+    alleles = np.full((len(people), slots), -1, dtype=np.int32)
+    for i, person in enumerate(people):
+        for k, allele in enumerate(person):
+            loci[i, k], alleles[i, k] = intern_allele(vocab, allele)
+    return {'locus': loci, 'allele': alleles}
+
+
+def knows_allele(vocab: dict, allele: str) -> bool:
+    """True if interning `allele` would leave `vocab` unchanged."""
+    allele = str(allele or "").strip()
+    locus_id = vocab['loci'].get(parse_locus(allele))
+    return locus_id is not None and (not allele or allele in vocab['alleles'][locus_id])
+
+
+def encode_queries(people: List[List[str]], vocab: dict) -> tuple:
+    """Encode recipients like `encode_recipients` without changing `vocab`.
+
+    Returns ``(rec, vocab)``: the codes, and the vocabulary they refer to,
+    which is `vocab` itself when it knows every allele and an extended
+    copy otherwise. Shared vocabularies (a resident donor pool) keep their
+    size, so their score tables stay cached.
+
+    >>> v = new_vocabulary()
+    >>> _ = intern_allele(v, 'A*02:01')
+    >>> rec, w = encode_queries([['A*02:01']], v)
+    >>> w is v, rec['allele'].tolist()
+    (True, [[0]])
+    >>> rec, w = encode_queries([['A*02:01', 'A*24:02']], v)
+    >>> w is v, rec['allele'].tolist(), len(v['alleles'][0])
+    (False, [[0, 1]], 1)
+    """
+    if not all(knows_allele(vocab, allele) for person in people for allele in person):
+        vocab = copy_vocabulary(vocab)
+    return encode_recipients(people, vocab), vocab
+
+
+def encode_donors(people: List[List[str]], vocab: dict) -> dict:
+    """Encode donors as one allele per locus.
+
+    Returns a dict with an ``(M, L)`` int32 array ``'allele'`` holding, for
+    every locus, the last allele the donor lists there (-1 if missing),
+    which is the allele the scalar similarity builder compares against.
+    """
+    pairs = [[intern_allele(vocab, allele) for allele in person] for person in people]
+    alleles = np.full((len(people), len(vocab['names'])), -1, dtype=np.int32)
+    for j, person in enumerate(pairs):
+        for locus_id, allele_id in person:
+            alleles[j, locus_id] = allele_id
+    return {'allele': alleles}
+
+
+def is_pool(donors) -> bool:
+    """True for a pre-encoded donor pool (see pool_cache.load_pool)."""
+    return isinstance(donors, dict) and 'allele' in donors
+
+
+def encode_populations(recipients: list, donors, vocab: dict = None) -> tuple:
+    """
+    Encode recipients and donors against one vocabulary.
+
+    `donors` is either a list of allele string lists or a pre-encoded pool.
+    Recipients are encoded with `encode_queries`: alleles the pool has
+    never seen go into a copy of its vocabulary, so resident pools stay
+    unchanged, and batches of known alleles need no copy at all.
+
+    Returns:
+        tuple: (rec, don, vocab) as `encode_recipients` / `encode_donors`.
+    """
+    if is_pool(donors):
+        rec, vocab = encode_queries(recipients, donors['vocab'])
+        return rec, donors, vocab
+    vocab = vocab if vocab is not None else new_vocabulary()
+    rec = encode_recipients(recipients, vocab)
+    return rec, encode_donors(donors, vocab), vocab
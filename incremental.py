@@ -0,0 +1,393 @@
+'''
+Incremental matching
+
+The waiting list changes one recipient or one donor at a time. IncrementalMatcher
+keeps the similarity and cost rows, the current assignment and the dual potentials
+(u per recipient row, v per donor column) of the last optimum, so every change only
+scores the new row or column and repairs the optimum from that warm start:
+
+- adding a recipient is one shortest augmenting path from its row, O(n*m)
+- freeing a donor column whose potential is below zero (its recipient was removed,
+  or a new donor undercuts current potentials) raises that column's potential along
+  an alternating tree until a column of the tree reaches 0, then flips the path, O(n*m)
+- removing a matched donor re-augments the recipient it held
+- raising the acceptance threshold (tighten) only turns costs into INF: the duals
+  stay feasible, recipients whose pair was rejected free their column and
+  re-augment
+
+Optimality is kept through the usual conditions for rows <= cols: u[i] + v[j] <= cost
+everywhere, equality on assigned pairs, v <= 0 and v == 0 on free columns.
+Costs are the integers of matching.convert_similarity / remove_not_accepted, and
+recipients whose costs are all INF take no column, exactly like matching.match.
+'''
+from matching import INF, convert_similarity, remove_not_accepted, shortest_augmenting_path
+from matrix_builder import build_similarity_array
+from encoding import new_vocabulary
+from score_tables import DEFAULT_PARAMS
+
+
+class IncrementalMatcher:
+    '''
+    Stateful matcher that re-optimizes after single recipient/donor changes
+
+    >>> im = IncrementalMatcher([['A*01:01', 'B*08:01']],
+    ...                         [['A*02:01', 'B*08:01'], ['A*01:01', 'B*08:01']])
+    >>> im.result()
+    [1]
+    >>> im.add_recipient(['A*02:01', 'B*08:01'], 'R2')
+    1
+    >>> im.result()
+    [1, 0]
+    >>> im.add_donor(['A*01:01', 'B*08:01'])
+    2
+    >>> im.remove_donor(1)
+    >>> im.result()
+    [1, 0]
+    '''
+
+    def __init__(self, recipients: list = (), donors: list = (), min_accept: int = 60,
+                 params: tuple = DEFAULT_PARAMS, rec_ids: list = None, don_ids: list = None):
+        '''
+        :param recipients: lists of allele strings
+        :param donors: lists of allele strings
+        :param min_accept: minimum accepted similarity percentage
+        :param params: scoring parameters, see score_tables.scoring_params
+        :param rec_ids: optional recipient ids kept next to the rows
+        :param don_ids: optional donor ids kept next to the columns
+        '''
+        if len(recipients) > len(donors):
+            raise ValueError('Donors must be >= recipients')
+        self.min_accept = min_accept
+        self.params = params
+        self.vocab = new_vocabulary()
+        self.recipients = [list(r) for r in recipients]
+        self.donors = [list(d) for d in donors]
+        self.rec_ids = list(rec_ids) if rec_ids is not None else [None] * len(recipients)
+        self.don_ids = list(don_ids) if don_ids is not None else [None] * len(donors)
+
+        self.similarity = []
+        self.cost = []
+        if recipients and donors:
+            self.similarity = build_similarity_array(self.recipients, self.donors,
+                                                     vocab=self.vocab, params=params).tolist()
+            self.cost = self._to_cost(self.similarity)
+        elif recipients:
+            self.similarity = [[] for _ in recipients]
+            self.cost = [[] for _ in recipients]
+
+        self._solve()
+
+    @classmethod
+    def from_similarity(cls, similarity: list, min_accept: int = 60, rec_ids: list = None,
+                        don_ids: list = None):
+        '''
+        Matcher over an already built similarity matrix (list of rows)
+        Rows and columns carry no allele lists, so add_recipient and add_donor
+        cannot score against them; tighten and the remove_* operations work
+
+        :param similarity: recipients x donors similarity rows
+        :param min_accept: minimum accepted similarity percentage
+        :return: solved matcher
+        :rtype: IncrementalMatcher
+
+        >>> im = IncrementalMatcher.from_similarity([[0.9, 0.7], [0.8, 0.1]], 60)
+        >>> im.result()
+        [1, 0]
+        '''
+        n, m = len(similarity), len(similarity[0]) if similarity else 0
+        if n > m:
+            raise ValueError('Donors must be >= recipients')
+        matcher = cls(min_accept=min_accept)
+        matcher.recipients = [None] * n
+        matcher.donors = [None] * m
+        matcher.rec_ids = list(rec_ids) if rec_ids is not None else [None] * n
+        matcher.don_ids = list(don_ids) if don_ids is not None else [None] * m
+        matcher.similarity = [list(row) for row in similarity]
+        matcher.cost = matcher._to_cost(matcher.similarity)
+        matcher._solve()
+        return matcher
+
+    def _solve(self):
+        '''
+        Optimum from scratch over the live rows
+        '''
+        n, m = len(self.cost), len(self.donors)
+        self.u = [0] * n
+        self.v = [0] * m
+        self.row_col = [-1] * n
+        self.col_row = [-1] * m
+        live = [i for i in range(n) if not self._is_dead(i)]
+        if live:
+            row_col, u, v = shortest_augmenting_path([self.cost[i] for i in live])
+            self.v = list(v)
+            for k, i in enumerate(live):
+                self.u[i] = u[k]
+                self.row_col[i] = row_col[k]
+                self.col_row[row_col[k]] = i
+
+    # --- scoring ---
+
+    def _to_cost(self, similarity: list) -> list:
+        return remove_not_accepted(convert_similarity(similarity), min_accept=int(self.min_accept))
+
+    def _is_dead(self, i: int) -> bool:
+        return all(c == INF for c in self.cost[i])
+
+    # --- repair ---
+
+    def _augment(self, i: int):
+        '''
+        Assign free row i along the shortest augmenting path in reduced costs
+        (one row phase of matching.shortest_augmenting_path on the current duals)
+        '''
+        cost, u, v, col_row = self.cost, self.u, self.v, self.col_row
+        m = len(v)
+        big = float('inf')
+        minv = [big] * m
+        way = [-1] * m
+        used = [False] * m
+        used_cols = []
+        i0, j0 = i, -1
+        while True:
+            row = cost[i0]
+            u_i0 = u[i0]
+            delta = big
+            j1 = -1
+            for j in range(m):
+                if not used[j]:
+                    cur = row[j] - u_i0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            u[i] += delta
+            for j in used_cols:
+                u[col_row[j]] += delta
+                v[j] -= delta
+            for j in range(m):
+                if not used[j]:
+                    minv[j] -= delta
+            if col_row[j1] == -1:
+                break
+            used[j1] = True
+            used_cols.append(j1)
+            i0, j0 = col_row[j1], j1
+        # Flipping the path back to row i
+        while j1 != -1:
+            j0 = way[j1]
+            k = i if j0 == -1 else col_row[j0]
+            col_row[j1] = k
+            self.row_col[k] = j1
+            j1 = j0
+
+    def _release(self, j0: int):
+        '''
+        Restore v == 0 on free column j0
+
+        Columns of the tree (j0 and the columns of rows reached through tight
+        edges) are raised and their rows lowered by the same delta, until either a
+        new row gets tight or a tree column reaches 0. That column becomes the free
+        one and the path from j0 to it is flipped.
+        '''
+        cost, u, v, row_col, col_row = self.cost, self.u, self.v, self.row_col, self.col_row
+        if v[j0] >= 0:
+            return
+        big = float('inf')
+        n = len(cost)
+        rows = [k for k in range(n) if row_col[k] != -1]
+        in_tree = [False] * n
+        slack = [big] * n
+        via = [-1] * n
+        parent = {}
+        tree_cols = []
+        tree_rows = []
+        top = j0
+        j_new = j0
+        while True:
+            tree_cols.append(j_new)
+            if v[j_new] > v[top]:
+                top = j_new
+            for k in rows:
+                if not in_tree[k]:
+                    s = cost[k][j_new] - u[k] - v[j_new]
+                    if s < slack[k]:
+                        slack[k] = s
+                        via[k] = j_new
+            best, k_best = big, -1
+            for k in rows:
+                if not in_tree[k] and slack[k] < best:
+                    best, k_best = slack[k], k
+            delta = min(best, -v[top])
+            for j in tree_cols:
+                v[j] += delta
+            for k in tree_rows:
+                u[k] -= delta
+            for k in rows:
+                if not in_tree[k]:
+                    slack[k] -= delta
+            if v[top] == 0:
+                break
+            in_tree[k_best] = True
+            tree_rows.append(k_best)
+            j_new = row_col[k_best]
+            parent[j_new] = k_best
+        # Column `top` becomes free, every row on the path moves one column towards j0
+        j = top
+        col_row[j] = -1
+        while j != j0:
+            k = parent[j]
+            j = via[k]
+            row_col[k] = j
+            col_row[j] = k
+
+    def _unassign(self, i: int):
+        j = self.row_col[i]
+        if j != -1:
+            self.row_col[i] = -1
+            self.col_row[j] = -1
+            self._release(j)
+
+    # --- public operations ---
+
+    def add_recipient(self, alleles: list, rid=None) -> int:
+        '''
+        Score one new recipient against all donors and assign it
+
+        :param alleles: allele strings of the recipient
+        :param rid: optional recipient id
+        :return: row index of the new recipient
+        :rtype: int
+        '''
+        if len(self.cost) + 1 > len(self.donors):
+            raise ValueError('Donors must be >= recipients')
+        sim = build_similarity_array([list(alleles)], self.donors, vocab=self.vocab,
+                                     params=self.params).tolist()[0]
+        i = len(self.cost)
+        self.recipients.append(list(alleles))
+        self.rec_ids.append(rid)
+        self.similarity.append(sim)
+        self.cost.append(self._to_cost([sim])[0])
+        self.u.append(0)
+        self.row_col.append(-1)
+        if not self._is_dead(i):
+            self._augment(i)
+        return i
+
+    def remove_recipient(self, i: int):
+        '''
+        Remove recipient row i and give its donor back to the pool
+
+        :param i: row index
+        :type i: int
+        '''
+        j = self.row_col[i]
+        for key in ('recipients', 'rec_ids', 'similarity', 'cost', 'u', 'row_col'):
+            getattr(self, key).pop(i)
+        self.col_row = [k - 1 if k > i else k for k in self.col_row]
+        if j != -1:
+            self.col_row[j] = -1
+            self._release(j)
+
+    def add_donor(self, alleles: list, did=None) -> int:
+        '''
+        Score one new donor against all recipients and re-optimize
+
+        :param alleles: allele strings of the donor
+        :param did: optional donor id
+        :return: column index of the new donor
+        :rtype: int
+        '''
+        j = len(self.donors)
+        self.donors.append(list(alleles))
+        self.don_ids.append(did)
+        if self.recipients:
+            col = build_similarity_array(self.recipients, [list(alleles)], vocab=self.vocab,
+                                         params=self.params)[:, 0].tolist()
+        else:
+            col = []
+        col_cost = [row[0] for row in self._to_cost([[s] for s in col])]
+        was_dead = [self._is_dead(i) for i in range(len(self.cost))]
+        for i, s in enumerate(col):
+            self.similarity[i].append(s)
+            self.cost[i].append(col_cost[i])
+        # Lowest potential keeping the new column dual feasible, then repaired to 0
+        self.v.append(min([0] + [col_cost[i] - self.u[i]
+                                 for i in range(len(col)) if self.row_col[i] != -1]))
+        self.col_row.append(-1)
+        self._release(j)
+        for i, dead in enumerate(was_dead):
+            if dead and col_cost[i] != INF:
+                self._augment(i)
+        return j
+
+    def remove_donor(self, j: int):
+        '''
+        Remove donor column j, re-assigning the recipient it held
+
+        :param j: column index
+        :type j: int
+        '''
+        if len(self.cost) > len(self.donors) - 1:
+            raise ValueError('Donors must be >= recipients')
+        k = self.col_row[j]
+        for key in ('donors', 'don_ids', 'v', 'col_row'):
+            getattr(self, key).pop(j)
+        for i, row in enumerate(self.cost):
+            self.similarity[i].pop(j)
+            row.pop(j)
+        self.row_col = [c - 1 if c > j else c for c in self.row_col]
+        if k != -1:
+            self.row_col[k] = -1
+        # Recipients left with no acceptable donor at all give their column back
+        for i in range(len(self.cost)):
+            if i != k and self.row_col[i] != -1 and self._is_dead(i):
+                self._unassign(i)
+        if k != -1 and not self._is_dead(k):
+            self._augment(k)
+
+    def tighten(self, min_accept: int):
+        '''
+        Raise the acceptance threshold and repair the optimum from the current one
+        Pairs now below the threshold cost INF; only the recipients that held such a
+        pair are re-augmented
+
+        :param min_accept: new minimum accepted similarity percentage, >= the current one
+        :type min_accept: int
+
+        >>> im = IncrementalMatcher.from_similarity([[0.9, 0.7], [0.8, 0.1]], 60)
+        >>> im.tighten(75)
+        >>> im.result()
+        [0, -1]
+        '''
+        if min_accept < self.min_accept:
+            raise ValueError('tighten only raises the threshold')
+        self.min_accept = min_accept
+        limit = 100 - int(min_accept)
+        for row in self.cost:
+            for j, c in enumerate(row):
+                if limit < c < INF:
+                    row[j] = INF
+        # Costs only went up, so the duals stay feasible; rejected pairs are not tight
+        rejected = [i for i, j in enumerate(self.row_col)
+                    if j != -1 and self.cost[i][j] == INF]
+        for i in rejected:
+            self._unassign(i)
+        for i in rejected:
+            if not self._is_dead(i):
+                self._augment(i)
+
+    def result(self) -> list:
+        '''
+        Assigned donor column per recipient row, -1 when unassigned or not accepted
+        (same contract as matching.match)
+        '''
+        return [j if j != -1 and self.cost[i][j] != INF else -1
+                for i, j in enumerate(self.row_col)]
+
+    def total_cost(self) -> int:
+        '''
+        Cost of the current assignment, INF counted for every rejected pair
+        '''
+        return sum(self.cost[i][j] for i, j in enumerate(self.row_col) if j != -1)
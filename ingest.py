@@ -0,0 +1,88 @@
+"""Streaming CSV ingest for recipients and donors.
+
+Rows are parsed one at a time from the open file, nothing holds the whole
+file. `iter_people` yields ``(id, alleles)`` pairs; `read_people_columnar`
+feeds allele codes straight into compact `array` columns, so a large donor
+pool never exists as Python lists of strings.
+
+Accepted layouts (same as before):
+- ``id,allele1,allele2,...`` (one allele per column)
+- ``id,"allele1;allele2;..."`` (one column, ``;`` or ``,`` separated)
+- ``id`` alone (no typing)
+An optional header row whose cells include ``recipient`` or ``donors`` is skipped.
+"""
+
+import csv
+import os
+from array import array
+from typing import Iterator, List, Tuple
+
+from encoding import new_vocabulary, intern_allele
+
+
+def _split_alleles(row: List[str]) -> List[str]:
+    """Allele strings of one CSV row (without the id column).
+
+    >>> _split_alleles(['R1', 'A*01:01; B*08:01'])
+    ['A*01:01', 'B*08:01']
+    >>> _split_alleles(['R1', 'A*01:01', ' ', 'B*08:01'])
+    ['A*01:01', 'B*08:01']
+    """
+    if len(row) == 1:
+        return []
+    if len(row) == 2 and (';' in row[1] or ',' not in row[1]):
+        cell = row[1]
+        if ',' in cell:
+            cell = cell.replace(',', ';')
+        return [a for a in (part.strip() for part in cell.split(';')) if a]
+    return [a for a in (c.strip() for c in row[1:]) if a]
+
+
+def iter_rows(path: str) -> Iterator[List[str]]:
+    """Yield non-empty CSV data rows of `path`, skipping a header row."""
+    if not os.path.exists(path):
+        return
+    with open(path, newline='', encoding='utf-8') as fh:
+        first = True
+        for row in csv.reader(fh):
+            if not row or not any(c.strip() for c in row):
+                continue
+            if first:
+                first = False
+                if any(h.lower() in ('recipient', 'donors') for h in row):
+                    continue
+            yield row
+
+
+def iter_people(path: str) -> Iterator[Tuple[str, List[str]]]:
+    """Yield ``(id, alleles)`` for every person in a CSV file, row by row."""
+    for row in iter_rows(path):
+        yield row[0].strip(), _split_alleles(row)
+
+
+def read_people_columnar(path: str, vocab: dict = None) -> dict:
+    """Read a CSV file straight into columnar allele codes.
+
+    Returns a dict with:
+    - ``'ids'``: list of person ids
+    - ``'offsets'``: array('q') of N+1 offsets into the allele columns
+    - ``'locus'`` / ``'allele'``: array('i') locus and allele codes in typing order
+    - ``'vocab'``: the `encoding` vocabulary used for the codes
+    """
+    vocab = vocab if vocab is not None else new_vocabulary()
+    ids = []
+    offsets = array('q', [0])
+    loci = array('i')
+    alleles = array('i')
+    # Raw cell -> codes, so each distinct allele string is parsed only once
+    seen = {}
+    for row in iter_rows(path):
+        ids.append(row[0].strip())
+        for allele in _split_alleles(row):
+            codes = seen.get(allele)
+            if codes is None:
+                codes = seen[allele] = intern_allele(vocab, allele)
+            loci.append(codes[0])
+            alleles.append(codes[1])
+        offsets.append(len(alleles))
+    return {'ids': ids, 'offsets': offsets, 'locus': loci, 'allele': alleles, 'vocab': vocab}
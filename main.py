@@ -5,15 +5,28 @@ Usage:
 python main.py recipients.csv donors.csv --output out.html --format html --min-accept 60 --verbose
 """
 import argparse
-import json
 import io
 import csv
 import sys
 import time
 import os
 from typing import List, Tuple, Optional, Any
+import metrics
 from matrix_builder import build_similarity_matrix
-from matching import convert_similarity, remove_not_accepted, match
+from ingest import iter_people
+from pool_cache import load_pool
+from allele_index import build_index, top_k
+from pruning import build_similarity_pruned
+from cost_buffer import build_cost_buffer, match_buffer
+from tiled_builder import build_tiled_buffer
+from matching import convert_similarity, remove_not_accepted, match, match_components, ENGINES
+from matching_sparse import edges_from_similarity, sparse_assignment
+from matching_approx import approx_assignment, assignment_gap
+from certificate import verify, similarity_cost_rows, buffer_cost_rows
+from planner import sample_density, plan_run, format_bytes
+from incremental import IncrementalMatcher
+from output import write_outputs, copy_json, assignment_rows, MATCHED, MatrixCsvSink, \
+    AssignmentCsvSink, NdjsonSink, MatrixHtmlSink, SparseHtmlSink, JsonDocumentSink
 
 # ANSI Colors constants
 HEADER = '\033[95m'
@@ -150,211 +163,336 @@ def print_table(headers: List[str], rows: List[List[Any]], verbose: bool, indent
     print()
 
 
-def run_with_timer(description: str, func, verbose: bool, *args, **kwargs):
-    """Executes a function and tracks time if verbose is True."""
+def run_with_timer(description: str, func, verbose: bool, *args, stage: str = None, **kwargs):
+    """Executes a function and tracks time if verbose is True.
+
+    The time is also recorded as metrics stage `stage` (default: function name).
+    """
     if verbose:
         sys.stdout.write(f"{BLUE} ⧗ {ENDC} {description}... ")
         sys.stdout.flush()
 
-    t0 = time.time()
+    t0 = time.perf_counter()
     try:
-        result = func(*args, **kwargs)
-        elapsed = time.time() - t0
+        with metrics.timer(stage or func.__name__):
+            result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - t0
         if verbose:
             print(f"{GREEN}DONE{ENDC} ({elapsed:.3f}s)")
         return result
     except Exception as e:
-        elapsed = time.time() - t0
+        elapsed = time.perf_counter() - t0
         if verbose:
             print(f"{FAIL}FAILED{ENDC} ({elapsed:.3f}s)")
         raise e
 
+
+def write_metrics(args, rec_count: int, don_count: int):
+    """Writes --metrics-out, with the run size as gauges."""
+    if not args.metrics_out:
+        return
+    metrics.set_gauge('hla_recipients', rec_count, 'Recipients in the run')
+    metrics.set_gauge('hla_donors', don_count, 'Donors in the run')
+    try:
+        metrics.write(args.metrics_out, args.metrics_format)
+    except OSError as e:
+        log_warn(f"Could not write metrics: {e}")
+
 # ==========================================
 #            CORE LOGIC
 # ==========================================
 
 def read_people(path: str) -> Tuple[List[str], List[List[str]]]:
-    '''Reads a CSV file with people (recipients or donors).'''
+    '''Reads a CSV file with people (recipients or donors), streaming row by row.'''
     ids: List[str] = []
     alleles_list: List[List[str]] = []
-
-    if not os.path.exists(path):
-        return ids, alleles_list
-
-    with open(path, newline='', encoding='utf-8') as fh:
-        reader = csv.reader(fh)
-        rows = [r for r in reader if r and any(c.strip() for c in r)]
-        if not rows:
-            return ids, alleles_list
-        header = rows[0]
-        start = 0
-        if any(h.lower() in ('recipient','donors') for h in header):
-            start = 1
-
-        for row in rows[start:]:
-            if not row:
-                continue
-            rid = row[0].strip()
-            if len(row) == 1:
-                alleles = []
-            elif len(row) == 2 and (';' in row[1] or ',' not in row[1]):
-                alleles = [a.strip() for a in row[1].replace(',', ';').split(';') if a.strip()]
-            else:
-                alleles = [c.strip() for c in row[1:] if c.strip()]
-
-            ids.append(rid)
-            alleles_list.append(alleles)
+    for rid, alleles in iter_people(path):
+        ids.append(rid)
+        alleles_list.append(alleles)
+    metrics.inc('hla_people_read_total', len(ids), 'People read from CSV files')
     return ids, alleles_list
 
 
 def write_matrix_csv(path: Optional[str], rec_ids: List[str], don_ids: List[str], \
                    sim: List[List[float]], result: List[int], min_accept: float):
     '''
-    Docstring for write_matrix_csv
+    Writes the recipients x donors CSV, only accepted assignments filled
 
-    :param path: Description
+    :param path: output path, stdout if None
     :type path: Optional[str]
-    :param rec_ids: Description
+    :param rec_ids: recipient ids
     :type rec_ids: List[str]
-    :param don_ids: Description
+    :param don_ids: donor ids
     :type don_ids: List[str]
-    :param sim: Description
+    :param sim: similarity matrix
     :type sim: List[List[float]]
-    :param result: Description
+    :param result: assigned donor column per recipient, -1 if none
     :type result: List[int]
-    :param min_accept: Description
+    :param min_accept: minimum accepted similarity percentage
     :type min_accept: float
     '''
-    out = open(path, 'w', newline='', encoding='utf-8') if path else sys.stdout
-    writer = csv.writer(out)
-    writer.writerow([''] + don_ids)
-    threshold = min_accept / 100.0
-    for i, rid in enumerate(rec_ids):
-        row = [''] * len(don_ids)
-        assigned = result[i] if i < len(result) else -1
-        if assigned != -1 and 0 <= assigned < len(don_ids):
-            val = sim[i][assigned]
-            if val is not None and val >= threshold:
-                row[assigned] = f"{val:.6f}"
-        writer.writerow([rid] + row)
-    if path:
-        out.close()
+    write_outputs(rec_ids, don_ids, sim, result, min_accept, [MatrixCsvSink(path)])
 
 
 def write_matrix_html(path: Optional[str], rec_ids: List[str], don_ids: List[str], \
                     sim: List[List[float]], result: List[int], min_accept: float):
     '''
-    Docstring for write_matrix_html
+    Writes the recipients x donors HTML table, accepted assignments highlighted
 
-    :param path: Description
+    :param path: output path, stdout if None
     :type path: Optional[str]
-    :param rec_ids: Description
+    :param rec_ids: recipient ids
     :type rec_ids: List[str]
-    :param don_ids: Description
+    :param don_ids: donor ids
     :type don_ids: List[str]
-    :param sim: Description
+    :param sim: similarity matrix
     :type sim: List[List[float]]
-    :param result: Description
+    :param result: assigned donor column per recipient, -1 if none
     :type result: List[int]
-    :param min_accept: Description
+    :param min_accept: minimum accepted similarity percentage
     :type min_accept: float
     '''
-    threshold = min_accept / 100.0
-    out = open(path, 'w', encoding='utf-8') if path else sys.stdout
-    out.write('<!doctype html>\n<html><head><meta charset="utf-8">')
-    out.write('<title>HLA Similarity Matrix</title>\n')
-    out.write('<style>body{font-family:sans-serif; padding:20px;} \
-table{border-collapse:collapse; width:100%;} ')
-    out.write('td,th{border:1px solid #ddd;padding:8px;text-align:center} ')
-    out.write('th{background-color:#f2f2f2;} tr:hover{background-color:#f5f5f5;} ')
-    out.write('.good{background:#c8e6c9; color:#2e7d32; font-weight:bold;} ')
-    out.write('.badrow{background:#ffebee; color:#c62828;}</style>\n')
-    out.write('</head><body>\n')
-    out.write('<h2>HLA Similarity Matrix</h2>')
-    out.write('<table>\n')
-
-    # header
-    out.write('<tr><th>Recipient / Donor</th>')
-    for d in don_ids:
-        out.write(f'<th>{d}</th>')
-    out.write('</tr>\n')
-
-    for i, r in enumerate(rec_ids):
-        assigned = result[i] if i < len(result) else -1
-        accepted_any = False
-        if assigned != -1 and 0 <= assigned < len(don_ids):
-            v = sim[i][assigned]
-            if v is not None and v >= threshold:
-                accepted_any = True
-
-        row_class = '' if accepted_any else ' class="badrow"'
-        out.write(f'<tr{row_class}><th>{r}</th>')
-        for j in range(len(don_ids)):
-            if assigned == j and accepted_any:
-                out.write(f'<td class="good">{sim[i][j]:.4f}</td>')
-            else:
-                out.write('<td></td>')
-        out.write('</tr>\n')
-
-    out.write('</table>\n</body></html>')
-    if path:
-        out.close()
+    write_outputs(rec_ids, don_ids, sim, result, min_accept, [MatrixHtmlSink(path)])
 
 
 def generate_csv_string(rec_ids, don_ids, sim, result, min_accept):
     '''
-    Docstring for generate_csv_string
+    The write_matrix_csv output as a string
 
-    :param rec_ids: Description
-    :param don_ids: Description
-    :param sim: Description
-    :param result: Description
-    :param min_accept: Description
+    :param rec_ids: recipient ids
+    :param don_ids: donor ids
+    :param sim: similarity matrix
+    :param result: assigned donor column per recipient, -1 if none
+    :param min_accept: minimum accepted similarity percentage
     '''
     buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow([''] + don_ids)
-    threshold = min_accept / 100.0
-    for i, rid in enumerate(rec_ids):
-        row = [''] * len(don_ids)
-        assigned = result[i] if i < len(result) else -1
-        if assigned != -1 and 0 <= assigned < len(don_ids):
-            val = sim[i][assigned]
-            if val is not None and val >= threshold:
-                row[assigned] = f"{val:.6f}"
-        writer.writerow([rid] + row)
+    write_outputs(rec_ids, don_ids, sim, result, min_accept, [MatrixCsvSink(stream=buf)])
     return buf.getvalue()
 
 
 def generate_assignment_csv_string(rec_ids, don_ids, sim, result, min_accept):
     '''
-    Docstring for generate_assignment_csv_string
-
-    :param rec_ids: Description
-    :param don_ids: Description
-    :param sim: Description
-    :param result: Description
-    :param min_accept: Description
-    :return: Description
+    recipient,assigned_donor,similarity CSV as a string
+
+    :param rec_ids: recipient ids
+    :param don_ids: donor ids
+    :param sim: similarity matrix
+    :param result: assigned donor column per recipient, -1 if none
+    :param min_accept: minimum accepted similarity percentage
+    :return: CSV text
     :rtype: str
     '''
     buf = io.StringIO()
-    writer = csv.writer(buf)
-    writer.writerow(['recipient', 'assigned_donor', 'similarity'])
-    threshold = min_accept / 100.0
-    for i, rid in enumerate(rec_ids):
-        assigned = result[i] if i < len(result) else -1
-        if assigned != -1 and 0 <= assigned < len(don_ids):
-            val = sim[i][assigned]
-            if val is not None and val >= threshold:
-                writer.writerow([rid, don_ids[assigned], f"{val:.6f}"])
-            else:
-                writer.writerow([rid, '', ''])
-        else:
-            writer.writerow([rid, '', ''])
+    write_outputs(rec_ids, don_ids, sim, result, min_accept, [AssignmentCsvSink(stream=buf)])
     return buf.getvalue()
 
 
+def write_top_k_csv(path: Optional[str], rec_ids: List[str], don_ids: List[str], \
+                    ranked: List[list]):
+    '''
+    Writes top-k donors per recipient as recipient,rank,donor,similarity rows
+
+    :param path: output path, stdout if None
+    :type path: Optional[str]
+    :param rec_ids: recipient ids
+    :type rec_ids: List[str]
+    :param don_ids: donor ids
+    :type don_ids: List[str]
+    :param ranked: per recipient list of (donor index, similarity), best first
+    :type ranked: List[list]
+    '''
+    out = open(path, 'w', newline='', encoding='utf-8') if path else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(['recipient', 'rank', 'donor', 'similarity'])
+    for rid, best in zip(rec_ids, ranked):
+        for rank, (j, val) in enumerate(best, 1):
+            writer.writerow([rid, rank, don_ids[j], f"{val:.6f}"])
+    if path:
+        out.close()
+
+
+def run_top_k(args, rec_ids, recs, don_ids, dons, start_total_time) -> int:
+    '''
+    --top-k mode: best donors per recipient from the inverted allele index
+
+    :param args: parsed CLI arguments
+    :param rec_ids: recipient ids
+    :param recs: recipient allele lists
+    :param don_ids: donor ids
+    :param dons: donor allele lists or compiled pool
+    :param start_total_time: perf_counter at start
+    :return: exit code
+    :rtype: int
+    '''
+    verbose = args.verbose
+    print_section("Top-K Candidates", verbose)
+    index = run_with_timer("Building allele index", build_index, verbose, dons)
+    ranked = run_with_timer(f"Querying top {args.top_k} donors",
+                            lambda: [top_k(index, alleles, args.top_k) for alleles in recs],
+                            verbose, stage='top_k')
+    if verbose:
+        preview = [[rid, don_ids[best[0][0]], f"{best[0][1]*100:.1f}%"] if best else [rid, '-', '-']
+                   for rid, best in zip(rec_ids, ranked)]
+        print_table(["Recipient", "Best Donor", "Similarity"], preview, verbose)
+    with metrics.timer('write_top_k_csv'):
+        write_top_k_csv(args.output, rec_ids, don_ids, ranked)
+    log_success(f"Top-K saved to: {BOLD}{args.output or 'stdout'}{ENDC}", verbose)
+    write_metrics(args, len(recs), len(don_ids))
+    if verbose:
+        elapsed_total = time.perf_counter() - start_total_time
+        print(f"\n{DIM}Total execution time: {elapsed_total:.4f}s{ENDC}\n")
+    return 0
+
+
+def plan_engine(args, recs, dons, don_count: int) -> dict:
+    '''
+    --engine auto: samples the share of acceptable pairs, lets planner.plan_run pick
+    the representation and the solver from the run size, memory and CPUs, and sets
+    the matching options on args accordingly
+
+    :param args: parsed CLI arguments, updated in place
+    :param recs: recipient allele lists
+    :param dons: donor allele lists or compiled pool
+    :param don_count: number of donors
+    :return: the plan
+    :rtype: dict
+    '''
+    verbose = args.verbose
+    density = run_with_timer("Sampling Acceptable Pairs", sample_density, verbose, recs, dons,
+                             args.min_accept, stage='plan')
+    fixed = 'memmap-tiles' if args.tiled else 'ndarray' if args.compact else None
+    plan = plan_run(len(recs), don_count, density,
+                    max_memory=args.max_memory << 20 if args.max_memory else None,
+                    list_options=args.dedup or args.prune or args.decompose,
+                    representation=fixed)
+    args.engine = plan['engine']
+    args.compact = plan['representation'] == 'ndarray'
+    args.tiled = plan['representation'] == 'memmap-tiles'
+    if args.tiled:
+        args.ram_budget = max(1, min(args.ram_budget, plan['ram_budget'] >> 20))
+    if args.workers is None:
+        args.workers = plan['workers']
+
+    budget = plan['memory_budget']
+    log_info(f"Plan: {BOLD}{plan['representation']}{ENDC} + {BOLD}{plan['engine']}{ENDC}",
+             verbose)
+    print_table(["Planner Input / Choice", "Value"], [
+        ["Recipients x donors", f"{len(recs)} x {don_count}"],
+        ["Acceptable pairs (sampled)", f"{density:.2%} (~{plan['edges']})"],
+        ["Memory budget", format_bytes(budget) if budget is not None else "unknown"],
+        ["Estimated peak memory", format_bytes(plan['estimated_bytes'])],
+        ["CPUs / workers", f"{plan['cpus']} / {plan['workers']}"],
+        ["Reason", plan['reason']]], verbose)
+    metrics.set_gauge('hla_plan', 1, 'Representation and solver chosen by --engine auto',
+                      representation=plan['representation'], engine=plan['engine'])
+    metrics.set_gauge('hla_plan_density', density, 'Sampled share of acceptable pairs')
+    metrics.set_gauge('hla_plan_estimated_bytes', plan['estimated_bytes'],
+                      'Planned peak memory of the run')
+    if budget is not None:
+        metrics.set_gauge('hla_plan_memory_budget_bytes', budget, 'Memory budget of the plan')
+    metrics.set_gauge('hla_plan_workers', plan['workers'], 'Workers of the plan',
+                      cpus=plan['cpus'])
+    return plan
+
+
+def parse_sweep(text: str) -> List[int]:
+    '''
+    'start:stop[:step]' -> thresholds from start to stop inclusive (step 5 by default)
+
+    >>> parse_sweep('50:90:10'), parse_sweep('85:95')
+    ([50, 60, 70, 80, 90], [85, 90, 95])
+    '''
+    try:
+        parts = [int(x) for x in text.split(':')]
+    except ValueError:
+        parts = []
+    if len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] <= 0) or parts[0] > parts[1]:
+        raise argparse.ArgumentTypeError(f"expected start:stop[:step] with start <= stop, \
+got '{text}'")
+    step = parts[2] if len(parts) == 3 else 5
+    return list(range(parts[0], parts[1] + 1, step))
+
+
+def write_sweep_csv(path: Optional[str], rows: List[list]):
+    '''
+    Writes one min_accept,matched,recipients,match_rate,avg_similarity row per threshold
+
+    :param path: output path, stdout if None
+    :type path: Optional[str]
+    :param rows: [threshold, matched, recipients, match rate %, average similarity %]
+    :type rows: List[list]
+    '''
+    out = open(path, 'w', newline='', encoding='utf-8') if path else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(['min_accept', 'matched', 'recipients', 'match_rate', 'avg_similarity'])
+    for threshold, matched, total, rate, avg in rows:
+        writer.writerow([threshold, matched, total, f"{rate:.2f}", f"{avg:.2f}"])
+    if path:
+        out.close()
+
+
+def run_sweep(args, rec_ids, recs, don_ids, dons, start_total_time) -> int:
+    '''
+    --min-accept-sweep mode: scores once, then solves the thresholds in increasing
+    order; every step only raises the threshold, so the optimum of the previous one
+    (assignment and duals) is repaired instead of solved again
+
+    :param args: parsed CLI arguments
+    :param rec_ids: recipient ids
+    :param recs: recipient allele lists
+    :param don_ids: donor ids
+    :param dons: donor allele lists or compiled pool
+    :param start_total_time: perf_counter at start
+    :return: exit code
+    :rtype: int
+    '''
+    verbose = args.verbose
+    thresholds = sorted(set(args.min_accept_sweep))
+    print_section("Threshold Sweep", verbose)
+    for flag in ('compact', 'tiled', 'decompose', 'verify'):
+        if getattr(args, flag):
+            log_warn(f"--{flag} is ignored with --min-accept-sweep")
+    if args.engine != 'jv':
+        log_warn(f"--engine {args.engine} is ignored, the sweep repairs jv optima")
+    if args.prune:
+        # Pairs below the lowest threshold are below every threshold
+        similarity, _ = run_with_timer("Building Similarity Matrix (pruned)",
+                                       build_similarity_pruned, verbose, recs, dons,
+                                       min_accept=thresholds[0])
+        similarity = similarity.tolist()
+    else:
+        similarity = run_with_timer("Building Similarity Matrix", build_similarity_matrix,
+                                    verbose, recs, dons, dedup=args.dedup, workers=args.workers)
+    matcher = None
+    rows = []
+    for threshold in thresholds:
+        if matcher is None:
+            matcher = run_with_timer(f"Matching at {threshold}%",
+                                     IncrementalMatcher.from_similarity, verbose, similarity,
+                                     threshold, stage='match')
+        else:
+            run_with_timer(f"Tightening to {threshold}%", matcher.tighten, verbose, threshold,
+                           stage='match')
+        scores = [val for _, _, _, val, status in
+                  assignment_rows(rec_ids, don_ids, similarity, matcher.result(), threshold)
+                  if status == MATCHED]
+        rate = len(scores) / len(rec_ids) * 100 if rec_ids else 0.0
+        avg = sum(scores) / len(scores) * 100 if scores else 0.0
+        rows.append([threshold, len(scores), len(rec_ids), rate, avg])
+        metrics.set_gauge('hla_matched', len(scores), 'Recipients matched above the threshold',
+                          min_accept=threshold)
+    print_table(["Min Accept", "Matched", "Recipients", "Match Rate", "Avg Score"],
+                [[f"{t}%", k, n, f"{r:.1f}%", f"{a:.1f}%"] for t, k, n, r, a in rows], verbose)
+    with metrics.timer('write_sweep_csv'):
+        write_sweep_csv(args.output, rows)
+    log_success(f"Sweep saved to: {BOLD}{args.output or 'stdout'}{ENDC}", verbose)
+    write_metrics(args, len(recs), len(don_ids))
+    if verbose:
+        elapsed_total = time.perf_counter() - start_total_time
+        print(f"\n{DIM}Total execution time: {elapsed_total:.4f}s{ENDC}\n")
+    return 0
+
+
 def main(argv=None):
     '''
     Docstring for main
@@ -370,11 +508,59 @@ def main(argv=None):
                    help='Minimum acceptance threshold in percent (default: 60)')
     p.add_argument('--verbose', action='store_true', help='Verbose output with UI')
     p.add_argument('--output', '-o', help='Output path (defaults to stdout)')
-    p.add_argument('--format', choices=['csv', 'html'], default='csv', \
-                   help='Output format for matrix (csv or html)')
+    p.add_argument('--format', choices=['csv', 'html', 'html-sparse'], default='csv', \
+                   help='Output format for matrix (csv, html, or html-sparse: one row per \
+recipient for large pools)')
+    p.add_argument('--assignment-out', metavar='PATH', \
+                   help='Also write recipient,assigned_donor,similarity CSV to PATH')
+    p.add_argument('--ndjson-out', metavar='PATH', \
+                   help='Also write one JSON record per recipient to PATH')
+    p.add_argument('--engine', choices=ENGINES + ('auto',), default='jv', \
+                   help='Matching engine (default: jv; approx is fast but not always optimal \
+and reports its optimality gap; auto picks the engine and the matrix representation from the \
+run size, sampled density, memory and CPUs)')
+    p.add_argument('--max-memory', type=int, default=None, metavar='MB', \
+                   help='Memory budget of --engine auto (default: 80%% of available memory)')
+    p.add_argument('--decompose', action='store_true', \
+                   help='Solve connected groups of acceptable pairs independently')
+    p.add_argument('--workers', type=int, default=None, \
+                   help='Workers for similarity building and --decompose (default: CPU count); \
+worker processes hold the similarity matrix twice while it is copied out of shared memory')
+    p.add_argument('--dedup', action='store_true', \
+                   help='Score identical donor/recipient typings only once')
+    p.add_argument('--pool-cache', action='store_true', \
+                   help='Load donors from a memory-mapped compiled pool next to the CSV \
+(rebuilt when the CSV changes)')
+    p.add_argument('--top-k', type=int, default=None, metavar='K', \
+                   help='Only list the K best donors per recipient (inverted allele index, \
+no matching)')
+    p.add_argument('--prune', action='store_true', \
+                   help='Skip scoring pairs whose score upper bound is below --min-accept')
+    p.add_argument('--compact', action='store_true', \
+                   help='Keep costs in one uint16 buffer with a feasibility mask instead of \
+list matrices (engines jv, sparse and approx)')
+    p.add_argument('--tiled', action='store_true', \
+                   help='Like --compact, but build every matrix tile by tile into memory-mapped \
+files, for pools larger than RAM')
+    p.add_argument('--ram-budget', type=int, default=512, metavar='MB', \
+                   help='RAM for one tile of temporaries with --tiled (default: 512)')
+    p.add_argument('--tile-dir', metavar='DIR', \
+                   help='Directory of the --tiled backing files (default: system temp dir)')
+    p.add_argument('--min-accept-sweep', type=parse_sweep, metavar='START:STOP:STEP', \
+                   help='Score once and report match rate and average similarity for every \
+threshold from START to STOP %%, each solve warm-started from the previous one')
+    p.add_argument('--verify', action='store_true', \
+                   help='Check the assignment against the solver duals (primal and dual \
+feasibility, complementary slackness); exit code 3 if it is not certified optimal')
+    p.add_argument('--metrics-out', metavar='PATH', \
+                   help='Write stage timings and solver counters to PATH')
+    p.add_argument('--metrics-format', choices=['json', 'prometheus'], default=None, \
+                   help='Format of --metrics-out (default: prometheus for .prom/.txt, else json)')
     args = p.parse_args(argv)
 
     verbose = args.verbose
+    if args.metrics_out:
+        metrics.enable()
 
     # Initialize UI
     print_banner(verbose)
@@ -393,10 +579,15 @@ def main(argv=None):
     rec_ids, recs = run_with_timer(f"Reading {os.path.basename(args.recipients)}",
                                   read_people, verbose, args.recipients)
 
-    don_ids, dons = run_with_timer(f"Reading {os.path.basename(args.donors)}",
-                                  read_people, verbose, args.donors)
+    if args.pool_cache:
+        dons = run_with_timer(f"Opening compiled pool of {os.path.basename(args.donors)}",
+                              load_pool, verbose, args.donors)
+        don_ids = dons['ids'].tolist()
+    else:
+        don_ids, dons = run_with_timer(f"Reading {os.path.basename(args.donors)}",
+                                      read_people, verbose, args.donors)
 
-    log_success(f"Loaded {BOLD}{len(recs)}{ENDC} recipients and {BOLD}{len(dons)}\
+    log_success(f"Loaded {BOLD}{len(recs)}{ENDC} recipients and {BOLD}{len(don_ids)}\
 {ENDC} donors", verbose)
 
     # Preview Data
@@ -407,26 +598,110 @@ def main(argv=None):
                         for i, rid in enumerate(rec_ids)]
         print_table(["ID", "Allele Count", "Alleles (Sample)"], preview_data, verbose)
 
+    if args.top_k is not None:
+        return run_top_k(args, rec_ids, recs, don_ids, dons, start_total_time)
+
     # Logic Checks
-    if len(dons) < len(recs):
+    if len(don_ids) < len(recs):
         log_error(f"Configuration Invalid: Number of donors \
-({len(dons)}) must be >= number of recipients ({len(recs)}).")
+({len(don_ids)}) must be >= number of recipients ({len(recs)}).")
         return 2
 
+    if args.min_accept_sweep is not None:
+        return run_sweep(args, rec_ids, recs, don_ids, dons, start_total_time)
+
     # 2. Computation
     print_section("Processing", verbose)
 
-    similarity = run_with_timer("Building Similarity Matrix",
-                               build_similarity_matrix, verbose, recs, dons)
+    if args.engine == 'auto':
+        plan_engine(args, recs, dons, len(don_ids))
+
+    pruned = None
+    buffer = None
+    # Cost and dual lower bound of an approx assignment
+    gap = {}
+    # Row and column potentials of the assignment, for --verify
+    duals = {}
+    if args.compact or args.tiled:
+        mode = 'tiled' if args.tiled else 'compact'
+        for flag in ('prune', 'dedup', 'decompose'):
+            if getattr(args, flag):
+                log_warn(f"--{flag} is ignored with --{mode}")
+        if args.engine not in ('jv', 'sparse', 'approx'):
+            log_warn(f"--engine {args.engine} does not run on the cost buffer, using jv")
+            args.engine = 'jv'
+        if args.tiled:
+            buffer = run_with_timer("Building Tiled Similarity and Cost Buffers",
+                                    build_tiled_buffer, verbose, recs, dons,
+                                    min_accept=args.min_accept,
+                                    ram_budget=args.ram_budget << 20, tile_dir=args.tile_dir,
+                                    stage='build_similarity_matrix')
+        else:
+            buffer = run_with_timer("Building Cost Buffer", build_cost_buffer, verbose, recs,
+                                    dons, min_accept=args.min_accept,
+                                    stage='build_similarity_matrix')
+        similarity = buffer['similarity']
+    elif args.prune:
+        if args.dedup:
+            log_warn("--dedup is ignored with --prune")
+        similarity, pruned = run_with_timer("Building Similarity Matrix (pruned)",
+                                            build_similarity_pruned, verbose, recs, dons,
+                                            min_accept=args.min_accept)
+        similarity = similarity.tolist()
+        metrics.inc('hla_pruned_pairs_total', pruned, 'Pairs skipped by the score upper bound')
+        log_info(f"Pruned {pruned} of {len(recs) * len(don_ids)} pairs below the \
+acceptance bound", verbose)
+    else:
+        similarity = run_with_timer("Building Similarity Matrix",
+                                   build_similarity_matrix, verbose, recs, dons,
+                                   dedup=args.dedup, workers=args.workers)
+    if args.dedup and hasattr(similarity, 'unique'):
+        log_info(f"Unique genotypes: {similarity.unique.shape[0]} recipients, \
+{similarity.unique.shape[1]} donors", verbose)
 
     # Wrap the matching process in a simple function to time the whole block
     def compute_match_wrapper(sim_matrix, minimum_acceptance):
+        if args.engine in ('sparse', 'approx') and not args.decompose:
+            # Only acceptable pairs are kept, no dense cost matrix
+            edges = edges_from_similarity(sim_matrix, min_accept=int(minimum_acceptance))
+            if args.engine == 'approx':
+                assignment, u, v = approx_assignment(*edges)
+                gap.update(assignment_gap(*edges[:3], assignment, u, v))
+            else:
+                assignment, u, v = sparse_assignment(*edges)
+            if args.verify:
+                duals.update(u=u, v=v)
+            return assignment
         c = convert_similarity(sim_matrix)
         f = remove_not_accepted(c, min_accept=int(minimum_acceptance))
-        return match(f)
+        if args.decompose:
+            solved = match_components(f, engine=args.engine, workers=args.workers,
+                                      duals=args.verify)
+        else:
+            solved = match(f, engine=args.engine, duals=args.verify)
+        if args.verify and solved != 'Broken':
+            solved, duals['u'], duals['v'] = solved
+        return solved
+
+    metrics.inc('hla_similarity_cells_total', len(recs) * len(don_ids),
+                'Recipient-donor pairs in the similarity matrix')
+    if buffer is not None:
+        result = run_with_timer("Computing Optimal Matching", match_buffer, verbose,
+                                buffer['cost'], buffer['feasible'], args.engine, gap,
+                                args.verify, stage='match')
+        if args.verify:
+            result, duals['u'], duals['v'] = result
+    else:
+        result = run_with_timer("Computing Optimal Matching",
+                               compute_match_wrapper, verbose, similarity, args.min_accept,
+                               stage='match')
 
-    result = run_with_timer("Computing Optimal Matching",
-                           compute_match_wrapper, verbose, similarity, args.min_accept)
+    certificate = None
+    if args.verify and duals:
+        cost_rows = (buffer_cost_rows(buffer['cost'], buffer['feasible']) if buffer is not None
+                     else similarity_cost_rows(similarity, int(args.min_accept)))
+        certificate = run_with_timer("Verifying Optimality Certificate", verify, verbose,
+                                     cost_rows, result, duals['u'], duals['v'], stage='verify')
 
     # 3. Results & Stats
     print_section("Results", verbose)
@@ -465,6 +740,33 @@ def main(argv=None):
     # We print summary statistics regardless of verbose, but style them nicely
     print(f"  {BOLD}Match Rate:{ENDC} {match_rate:.1f}% ({matches_found}/{len(rec_ids)})")
     print(f"  {BOLD}Avg Score :{ENDC} {avg_score:.1f}% (of matched pairs)")
+    if pruned is not None:
+        print(f"  {BOLD}Pruned    :{ENDC} {pruned}/{len(recs) * len(don_ids)} pairs \
+skipped by upper bound")
+    if gap:
+        # Cost units are similarity points, unmatched recipients count INF
+        print(f"  {BOLD}Opt. Gap  :{ENDC} <= {gap['gap']:.0f} of cost {gap['cost']:.0f} \
+({gap['relative_gap'] * 100:.2f}%, lower bound {gap['lower_bound']:.0f})")
+        metrics.set_gauge('hla_approx_cost', gap['cost'], 'Total cost of the approx assignment')
+        metrics.set_gauge('hla_approx_lower_bound', gap['lower_bound'],
+                          'Dual lower bound of the optimal total cost')
+        metrics.set_gauge('hla_approx_gap', gap['gap'],
+                          'Approx cost minus the lower bound')
+    if certificate is not None:
+        if certificate['ok']:
+            print(f"  {BOLD}Certificate:{ENDC} optimal, cost {certificate['cost']:.0f} equals \
+the dual bound")
+        else:
+            print(f"  {BOLD}Certificate:{ENDC} NOT certified, {certificate['primal']} primal, \
+{certificate['dual']} dual, {certificate['slackness']} slackness violations \
+(gap {certificate['gap']:.0f})")
+            for message in certificate['messages']:
+                log_warn(message)
+        metrics.set_gauge('hla_certificate_ok', int(certificate['ok']),
+                          'Assignment certified optimal by its duals (1) or not (0)')
+        for kind in ('primal', 'dual', 'slackness'):
+            metrics.set_gauge('hla_certificate_violations', certificate[kind],
+                              'Violated optimality conditions', condition=kind)
     print("")
 
     if verbose:
@@ -474,46 +776,51 @@ def main(argv=None):
     # 4. Output Generation
     print_section("Output Generation", verbose)
 
-    # Write matrix output
-    if args.format == 'csv':
-        write_matrix_csv(args.output, rec_ids, don_ids, similarity, result, args.min_accept)
-    else:
-        write_matrix_html(args.output, rec_ids, don_ids, similarity, result, args.min_accept)
+    # One pass over the assignment feeds every requested artifact
+    matrix_sinks = {'csv': MatrixCsvSink, 'html': MatrixHtmlSink, 'html-sparse': SparseHtmlSink}
+    sinks = [matrix_sinks[args.format](args.output)]
+    csv_path = None
+    if args.output and args.format != 'csv':
+        # If HTML was requested and output path given, write CSV beside it
+        csv_path = args.output.rsplit('.', 1)[0] + '.csv'
+        if os.path.abspath(csv_path) == os.path.abspath(args.output):
+            log_warn(f"Side-car CSV would overwrite {args.output}, skipped")
+            csv_path = None
+        else:
+            sinks.append(MatrixCsvSink(csv_path))
+    if args.assignment_out:
+        sinks.append(AssignmentCsvSink(args.assignment_out))
+    if args.ndjson_out:
+        sinks.append(NdjsonSink(args.ndjson_out))
+    # JSON document on stdout: always when writing to a file, otherwise unless verbose
+    document = JsonDocumentSink(result) if args.output or not verbose else None
+    if document:
+        sinks.append(document)
+
+    with metrics.timer('write_outputs'):
+        write_outputs(rec_ids, don_ids, similarity, result, args.min_accept, sinks)
 
     log_success(f"Matrix saved to: {BOLD}{args.output or 'stdout'}{ENDC}", verbose)
+    if csv_path:
+        log_success(f"Raw CSV saved to: {BOLD}{csv_path}{ENDC}", verbose)
+    for label, path in (("Assignment CSV", args.assignment_out), ("NDJSON", args.ndjson_out)):
+        if path:
+            log_success(f"{label} saved to: {BOLD}{path}{ENDC}", verbose)
+
+    # Final JSON output, after the matrix when both go to stdout
+    if document:
+        copy_json(document)
 
-    # Generate CSV strings
-    csv_text = generate_csv_string(rec_ids, don_ids, similarity, result, args.min_accept)
-    assign_csv_text = generate_assignment_csv_string(rec_ids, don_ids, similarity, \
-                                                    result, args.min_accept)
-
-    # If HTML was requested and output path given, write CSV beside it
-    if args.output and args.format == 'html':
-        try:
-            base = args.output.rsplit('.', 1)[0]
-            csv_path = base + '.csv'
-            with open(csv_path, 'w', encoding='utf-8', newline='') as fh:
-                fh.write(csv_text)
-            log_success(f"Raw CSV saved to: {BOLD}{csv_path}{ENDC}", verbose)
-        except FileNotFoundError as e:
-            log_warn(f"Could not save side-car CSV: {e}")
-
-    # Final JSON output
-    json_output = json.dumps({"result": result, "csv_matrix": csv_text, \
-                              "csv_assignment": assign_csv_text})
-
-    # If not outputting to file, and not verbose, print JSON to stdout (standard pipe behavior)
-    if not args.output and not verbose:
-        print(json_output)
-    elif args.output:
-        # If output is file, we can print JSON safely
-        print(json_output)
+    metrics.set_gauge('hla_matched', matches_found, 'Recipients matched above the threshold')
+    metrics.observe('hla_total_seconds', time.perf_counter() - start_total_time,
+                    metrics.SECONDS_BUCKETS, 'Wall time of the whole run')
+    write_metrics(args, len(recs), len(don_ids))
 
     if verbose:
         elapsed_total = time.perf_counter() - start_total_time
         print(f"\n{DIM}Total execution time: {elapsed_total:.4f}s{ENDC}\n")
 
-    return 0
+    return 3 if certificate is not None and not certificate['ok'] else 0
 
 
 if __name__ == '__main__':
@@ -1,13 +1,15 @@
 '''
 Matching module
 '''
-import collections
 import sys
-from sys import exit as system32_termination
+import metrics
+from matching_common import INF, cover_zeros, system32_termination
+from matching_numpy import hungarian_numpy
+from matching_sparse import edges_from_cost, match_sparse, sparse_assignment
+from matching_approx import approx_assignment, assignment_duals, match_approx
 # import random
 
-# INF = float('inf')
-INF = 100000
+ENGINES = ('jv', 'hungarian', 'numpy', 'sparse', 'approx')
 # RANDM = [[float(f'0.{i}') for i in random.choices(range(100), k=10)] for _ in range(10)]
 
 
@@ -74,16 +76,117 @@ def remove_not_accepted(arr: list, min_accept: int = 60) -> list:
     return [[(value if value <= 100-min_accept else INF) for value in row] for row in arr]
 
 
-def match(arr: list):
+def shortest_augmenting_path(arr: list) -> tuple:
     '''
-    Hungarian algorithm implementation for assignment problem
+    Shortest augmenting path solver (Jonker-Volgenant style Hungarian with potentials)
+    Rows are added one at a time and every row is augmented along the shortest path
+    in reduced costs (Dijkstra over the columns), potentials are updated once per row
+    for the scanned columns only. Works on the rectangular matrix directly, no dummy
+    rows: O(n^2 * m) time and O(n * m) memory, no iteration cap.
+    Matrix must have rows <= cols.
+    :param arr: cost matrix
+    :type arr: list
+    :return: (row -> column assignment, row potentials u, column potentials v)
+    :rtype: tuple
+
+    >>> shortest_augmenting_path([[4, 1, 3], [2, 0, 5], [3, 2, 2]])[0]
+    [1, 0, 2]
+    >>> shortest_augmenting_path([[5, 1, 9, 9], [1, 5, 9, 9]])[0]
+    [1, 0]
+    '''
+    n = len(arr)
+    m = len(arr[0])
+    big = float('inf')
+    u = [0] * n
+    v = [0] * m
+    col_row = [-1] * m
+
+    for i in range(n):
+        dist = [big] * m
+        # Previous column on the shortest path, -1 for the new row itself
+        way = [-1] * m
+        scanned = [False] * m
+        order = []
+        i0 = i
+        j0 = -1
+        d0 = 0
+        while True:
+            row = arr[i0]
+            base = d0 - u[i0]
+            best = big
+            j1 = -1
+            for j in range(m):
+                if not scanned[j]:
+                    cur = row[j] + base - v[j]
+                    if cur < dist[j]:
+                        dist[j] = cur
+                        way[j] = j0
+                    if dist[j] < best:
+                        best = dist[j]
+                        j1 = j
+            scanned[j1] = True
+            order.append(j1)
+            if col_row[j1] == -1:
+                break
+            i0 = col_row[j1]
+            j0 = j1
+            d0 = best
+        metrics.observe('hla_augmenting_path_columns', len(order),
+                        help_text='Columns scanned per augmenting path', engine='jv')
+        # Potentials of the rows and columns reached before the free column
+        u[i] += best
+        for j in order[:-1]:
+            step = best - dist[j]
+            u[col_row[j]] += step
+            v[j] -= step
+        # Flipping the augmenting path back to row i
+        while j1 != -1:
+            j0 = way[j1]
+            col_row[j1] = i if j0 == -1 else col_row[j0]
+            j1 = j0
+
+    row_col = [-1] * n
+    for j in range(m):
+        if col_row[j] != -1:
+            row_col[col_row[j]] = j
+    return row_col, u, v
+
+
+def match(arr: list, engine: str = 'jv', duals: bool = False):
+    '''
+    Solves assignment problem for cost matrix
     Returns list indexed by recipient rows with assigned donor column index or -1 if no assignment
-    Using Hopcroft-Karp for finding maximum matching in bipartite graph
+    Engines:
+        'jv' - shortest augmenting path with dual potentials, O(n^3), no iteration cap
+        'hungarian' - reduction/shift loop, using Hopcroft-Karp for finding maximum
+                      matching in bipartite graph
+        'numpy' - same loop as 'hungarian' over one ndarray with boolean cover masks
+        'sparse' - shortest augmenting path over feasible (non INF) edges only, no padding
+        'approx' - greedy + maximum cardinality + 2-opt over feasible edges, not always
+                   optimal, see matching_approx for its dual lower bound
     :param arr: cost matrix
     :type arr: list
-    :return: list of assigned donor indices per recipient
-    :rtype: list
+    :param engine: solver engine, one of ENGINES
+    :type engine: str
+    :param duals: also return the dual potentials, see below
+    :type duals: bool
+    :return: list of assigned donor indices per recipient, or with duals
+             (result, row potentials u, column potentials v) of the model where every
+             recipient has a private INF dummy donor (as in 'sparse'); rows without
+             any acceptable donor get u = 0. certificate.verify checks them.
+    :rtype: list | tuple
+
+    >>> result, u, v = match([[10, 30], [20, INF]], duals=True)
+    >>> result, sum(u) + sum(v)
+    ([1, 0], 50.0)
     '''
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown matching engine: {engine}')
+    if engine in ('sparse', 'approx'):
+        if duals:
+            solver = sparse_assignment if engine == 'sparse' else approx_assignment
+            return solver(*edges_from_cost(arr))
+        return match_sparse(arr) if engine == 'sparse' else match_approx(arr)
     # if len(arr) > len(arr[0]):
     #     pass
     n = len(arr)
@@ -99,19 +202,151 @@ def match(arr: list):
         else:
             valid.append(i)
 
+    if metrics.enabled():
+        metrics.inc('hla_match_rows_total', n, 'Recipient rows given to match', engine=engine)
+        metrics.inc('hla_match_dead_rows_total', len(dead),
+                    'Rows without any acceptable donor', engine=engine)
+        metrics.inc('hla_feasible_edges_total', sum(m - row.count(INF) for row in arr),
+                    'Acceptable (non INF) recipient-donor pairs', engine=engine)
     if not valid:
-        return [-1] * n # If everyone is dead
+        # If everyone is dead
+        return ([-1] * n, [0] * n, [0] * m) if duals else [-1] * n
     sub_arr = [arr[i].copy() for i in valid]
     rows_to_match = len(sub_arr)
     cols = m
 
     n = len(arr)
-    if rows_to_match < cols:
-        # Add dummy rows (Recipients) to make it square
+    if rows_to_match < cols and engine != 'jv':
+        # Add dummy rows (Recipients) to make it square, jv works on the rectangle
         sub_arr.extend([[0] * cols for _ in range(cols - rows_to_match)])
-    n = len(sub_arr)
     arr = sub_arr
 
+    if engine == 'jv':
+        matching, u, v = shortest_augmenting_path(arr)
+    elif engine == 'numpy':
+        matching, u, v = hungarian_numpy(arr)
+    else:
+        solved = _hungarian(arr)
+        if solved == 'Broken':
+            return solved
+        matching, u, v = solved
+
+    # Return a list indexed by original recipient rows
+    result = [-1] * original_n
+    for i, idx in enumerate(valid):
+        c = matching[i]
+        if arr[i][c] == INF:
+            result[idx] = -1
+        else:
+            result[idx] = c
+    if not duals:
+        return result
+    if rows_to_match == m:
+        # No donor is left free, the square potentials need not fit the INF dummy
+        # donors; converged column prices of the same assignment do
+        indptr, indices, costs, _ = edges_from_cost(arr)
+        u, v = assignment_duals(indptr, indices, costs, [result[idx] for idx in valid], m,
+                                rows_to_match + 1)
+        shift_by = 0
+    else:
+        # Dummy rows cost 0 everywhere and all hold a column, so they share one
+        # potential; moving it onto the columns leaves v = 0 on the donors they hold
+        shift_by = max(u[rows_to_match:]) if engine != 'jv' else 0
+    row_u = [0] * original_n
+    for i, idx in enumerate(valid):
+        row_u[idx] = u[i] - shift_by
+    return result, row_u, [value + shift_by for value in v[:m]]
+
+
+def zero_adjacency(matrix: list) -> list:
+    '''
+    Columns with zero cost per row, in increasing order
+
+    >>> zero_adjacency([[0, 3, 0], [1, 2, 3]])
+    [[0, 2], []]
+    '''
+    return [[k for k, value in enumerate(row) if value == 0] for row in matrix]
+
+
+def shift_zeros(matrix: list, adj: list, rows: list, cols: list) -> int:
+    '''
+    Shifting step of Hungarian algorithm, in place on matrix and its zero adjacency
+    Decreases uncovered elements by minimum uncovered value
+    Increases elements covered twice by minimum uncovered value
+    Only those cells change: zeros of covered rows in covered columns are dropped
+    from adj, uncovered cells reaching zero are merged into adj (kept sorted)
+    INF cells stay INF
+    :param matrix: reduced square cost matrix
+    :type matrix: list
+    :param adj: zero adjacency of matrix, see zero_adjacency
+    :type adj: list
+    :param rows: covered rows
+    :type rows: list
+    :param cols: covered columns
+    :type cols: list
+    :return: minimum uncovered value, INF if every uncovered cell is INF
+    :rtype: int
+
+    >>> m = [[0, 2], [0, 5]]
+    >>> adj = zero_adjacency(m)
+    >>> shift_zeros(m, adj, [], [0]), m, adj
+    (2, [[0, 0], [0, 3]], [[0, 1], [0]])
+    '''
+    n = len(matrix)
+    row_cov = [False] * n
+    col_cov = [False] * n
+    for r in rows:
+        row_cov[r] = True
+    for c in cols:
+        col_cov[c] = True
+    free_cols = [c for c in range(n) if not col_cov[c]]
+    min_v = INF
+    for r in range(n):
+        if not row_cov[r]:
+            row = matrix[r]
+            for c in free_cols:
+                if row[c] < min_v:
+                    min_v = row[c]
+    if min_v == INF:
+        return min_v
+    covered_cols = [c for c in range(n) if col_cov[c]]
+    for r in range(n):
+        row = matrix[r]
+        if row_cov[r]:
+            # Covered twice: grows by min_v, its zeros disappear
+            dropped = False
+            for c in covered_cols:
+                value = row[c]
+                if value != INF:
+                    row[c] = value + min_v
+                    dropped = dropped or value == 0
+            if dropped:
+                adj[r] = [c for c in adj[r] if not col_cov[c]]
+        else:
+            # Uncovered: shrinks by min_v, cells equal to min_v become zeros
+            new = []
+            for c in free_cols:
+                value = row[c]
+                if value != INF:
+                    row[c] = value - min_v
+                    if value == min_v:
+                        new.append(c)
+            if new:
+                adj[r] = sorted(adj[r] + new)
+    return min_v
+
+
+def _hungarian(arr: list):
+    '''
+    Hungarian algorithm on square cost matrix
+    Returns (matching row -> column, row potentials u, column potentials v) or 'Broken'
+    if it did not converge. Potentials start at the reduction minima, every shift adds
+    its value to the uncovered rows and takes it from the covered columns.
+    :param arr: square cost matrix
+    :type arr: list
+    '''
+    n = len(arr)
+
     def reduction(arr_copy: list):
         '''
         Reduction step of Hungarian algorithm
@@ -122,154 +357,166 @@ def match(arr: list):
         ... [0.4, 0.5, 0.9]]
         >>> reduction(matrix)
         '''
-        # First we reducing rows
-        arr_copy = [[value - min(row) for value in row] for row in arr_copy]
+        # First we reducing rows (minimum taken once per row)
+        row_mins = [min(row) for row in arr_copy]
+        arr_copy = [[value - low for value in row] for row, low in zip(arr_copy, row_mins)]
         # Finding mins for columns
         col_mins = [min(row[i] for row in arr_copy) for i in range(len(arr_copy[0]))]
         # Reducing columns
         arr_copy = [[arr_copy[r][c] - col_mins[c] for c in range(n)] for r in range(n)]
-        return [[value for value in row] for row in arr_copy]
+        return [[value for value in row] for row in arr_copy], row_mins, col_mins
 
 
-    def find_lines(matrix: list[list], prev: list = None):
+    def find_lines(adj: list, prev: list = None):
         '''
         Finding minimum number of lines to cover all zeros in matrix
-        Using Hopcroft-Karp algorithm for maximum matching
-        :param matrix: Matrix to find lines in
-        :type matrix: list[list]
+        :param adj: zero adjacency of the matrix, kept up to date by shift_zeros
+        :type adj: list
         :param prev: Previous matching to start from
         :type prev: list
         :return: Dictionary with rows and columns to be crossed
         :rtype: dict
         '''
-        # Building graph
-        adj = [[] for _ in range(n)]
-        for i, row in enumerate(matrix):
-            for k, value in enumerate(row):
-                if value == 0:
-                    adj[i].append(k)
-
-        # Hopcroft algorithm
-        pair_u = prev.copy() if prev else [-1] * n
-        pair_v = [-1] * n
-
-        for u, v in enumerate(pair_u):
-            if v != -1:
-                pair_v[v] = u
-
-        dist = [-1] * n
-
-        def bfs():
-            queue = collections.deque()
-            for u in range(n):
-                if pair_u[u] == -1:
-                    dist[u] = 0
-                    queue.append(u)
-                else:
-                    dist[u] = INF
-            dist_null = INF
-
-            while queue:
-                u = queue.popleft()
-                if dist[u] < dist_null:
-                    for v in adj[u]:
-                        if pair_v[v] == -1:
-                            if dist_null == INF:
-                                dist_null = dist[u] + 1
-                        elif dist[pair_v[v]] == INF:
-                            dist[pair_v[v]] = dist[u] + 1
-                            queue.append(pair_v[v])
-            return dist_null != INF
-
-        def dfs(u):
-            if u != -1:
-                for v in adj[u]:
-                    if pair_v[v] == -1 or (dist[pair_v[v]] == dist[u] + 1 and dfs(pair_v[v])):
-                        pair_v[v] = u
-                        pair_u[u] = v
-                        return True
-                dist[u] = INF
-                return False
-            return True
-
-        while bfs():
-            for u in range(n):
-                if pair_u[u] == -1:
-                    dfs(u)
-
-        # Koning theorem
-
-        free_rows = [i for i in range(n) if pair_u[i] == -1]
-        visited_rows = set(free_rows)
-        visited_cols = set()
-        queue = collections.deque(free_rows)
-
-        while queue:
-            u = queue.popleft()
-            for v in adj[u]:
-                if v not in visited_cols:
-                    visited_cols.add(v)
-
-                    matched_row = pair_v[v]
-                    if matched_row != -1 and matched_row not in visited_rows:
-                        visited_rows.add(matched_row)
-                        queue.append(matched_row)
-        selected_rows = [i for i in range(n) if i not in visited_rows]
-        selected_cols = sorted(list(visited_cols))
-        return {'rows': selected_rows, 'cols': selected_cols, \
-        'count': len([x for x in pair_u if x != -1]), 'matching': pair_u}
-
-    def shift(matrix: list[list], dels: dict):
-        ''''
-        Shifting step of Hungarian algorithm
-        Decreases uncovered elements by minimum uncovered value
-        Increases elements covered twice by minimum uncovered value
-
-        :param matrix: Description
-        :type matrix: list[list]
-        :param dels: Description
-        :type dels: dict
-        '''
-        min_v = INF
-        check = [i for i in range(n) if i not in dels['rows']]
-        # print(matrix, file=sys.stderr)
-        for row in check:
-            for i in range(n):
-                if i not in dels['cols']:
-                    if matrix[row][i] < min_v:
-                        min_v = matrix[row][i]
-        if min_v == INF:
-            print('\033[91mERROR in shifting, no possible shift\033[0m')
-            system32_termination()
-        for index, row in enumerate(matrix):
-            if index in dels['rows']: # adding to crossed number
-                matrix[index] = [(n + min_v if INF not in (n, min_v)else INF) if i in dels['cols']\
-                                 else n for i, n in enumerate(row)]
-                continue
-            matrix[index] = [n if i in dels['cols'] else \
-                            (n - min_v if INF not in (n, min_v) else INF) \
-                            for i, n in enumerate(row)]
-        return matrix
-
-    arr2 = reduction(arr)
-    lines = find_lines(arr2)
+        metrics.inc('hla_find_lines_calls_total', help_text='Line cover searches',
+                    engine='hungarian')
+        return cover_zeros(adj, n, prev)
+
+    arr2, u, v = reduction(arr)
+    # Zero adjacency is built once, shifts only touch the cells they change
+    adj = zero_adjacency(arr2)
+    lines = find_lines(adj)
+    # Every shift adds a zero to the cover search, n * (n + 1) bounds a converging run
+    limit = max(400, n * (n + 1))
     k = 0
     while lines['count'] != n:
         k += 1
-        if k == 400:
+        metrics.inc('hla_shift_iterations_total', help_text='Hungarian shift steps',
+                    engine='hungarian')
+        if k == limit:
             return 'Broken'
-        arr2 = shift(arr2, lines)
-        lines = find_lines(arr2, prev=lines['matching'])
+        min_v = shift_zeros(arr2, adj, lines['rows'], lines['cols'])
+        if min_v == INF:
+            print('\033[91mERROR in shifting, no possible shift\033[0m')
+            system32_termination()
+        covered = set(lines['rows'])
+        for r in range(n):
+            if r not in covered:
+                u[r] += min_v
+        for c in lines['cols']:
+            v[c] -= min_v
+        lines = find_lines(adj, prev=lines['matching'])
+    return lines['matching'], u, v
 
-    # Return a list indexed by original recipient rows
-    result = [-1] * original_n
-    for i, idx in enumerate(valid):
-        c = lines['matching'][i]
-        if arr[i][c] == INF:
-            result[idx] = -1
-        else:
-            result[idx] = c
-    return result
+
+def find_components(arr: list) -> list:
+    '''
+    Splitting acceptable pairs graph into connected components
+    Union-find over all non INF cells, rows without any acceptable donor are skipped
+    :param arr: cost matrix after remove_not_accepted
+    :type arr: list
+    :return: list of (recipient rows, donor columns) per component
+    :rtype: list
+
+    >>> find_components([[10, INF, INF], [INF, INF, 20], [INF, 30, 40], [INF, INF, INF]])
+    [([0], [0]), ([1, 2], [1, 2])]
+    '''
+    n = len(arr)
+    m = len(arr[0]) if arr else 0
+    # Nodes 0..n-1 are recipients, n..n+m-1 are donors
+    parent = list(range(n + m))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    has_edge = [False] * n
+    for i, row in enumerate(arr):
+        for j, value in enumerate(row):
+            if value != INF:
+                has_edge[i] = True
+                a, b = find(i), find(n + j)
+                if a != b:
+                    parent[b] = a
+
+    groups = {}
+    for i in range(n):
+        if has_edge[i]:
+            groups.setdefault(find(i), ([], []))[0].append(i)
+    for j in range(m):
+        root = find(n + j)
+        if root in groups:
+            groups[root][1].append(j)
+    return sorted(groups.values())
+
+
+def _solve_component(task: tuple):
+    '''
+    Solving one component sub matrix, top level so it can run in a process pool
+    '''
+    sub, engine, duals = task
+    return match(sub, engine=engine, duals=duals)
+
+
+def match_components(arr: list, engine: str = 'jv', workers: int = None,
+                     inline_cells: int = 2500, duals: bool = False):
+    '''
+    Solves every connected component of acceptable pairs independently
+    and merges assignments back, same contract as match()
+    Components bigger than inline_cells are solved in parallel across a process pool
+    :param arr: cost matrix after remove_not_accepted
+    :type arr: list
+    :param engine: solver engine for components, one of ENGINES
+    :type engine: str
+    :param workers: process pool size, None means cpu count, 1 disables the pool
+    :type workers: int
+    :param inline_cells: components up to this many cells are solved in this process
+    :type inline_cells: int
+    :param duals: also return the merged dual potentials like match(duals=True),
+                  pairs across components are INF so the component duals stay valid
+    :type duals: bool
+    :return: list of assigned donor indices per recipient, or (result, u, v) with duals
+    :rtype: list | tuple
+    '''
+    result = [-1] * len(arr)
+    u = [0] * len(arr)
+    v = [0] * (len(arr[0]) if arr else 0)
+    components = find_components(arr)
+
+    tasks = []
+    for rows, cols in components:
+        sub = [[arr[r][c] for c in cols] for r in rows]
+        if len(rows) > len(cols):
+            # Dummy INF donors so component has rows <= cols
+            for row in sub:
+                row.extend([INF] * (len(rows) - len(cols)))
+        tasks.append((sub, engine, duals))
+
+    big = [k for k, (rows, cols) in enumerate(components)
+           if len(rows) * len(cols) > inline_cells]
+    solved = {}
+    if workers != 1 and len(big) > 1:
+        # Imported lazily, pool is only needed for several big components
+        from concurrent.futures import ProcessPoolExecutor # pylint: disable=import-outside-toplevel
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for k, sub_result in zip(big, pool.map(_solve_component, [tasks[k] for k in big])):
+                solved[k] = sub_result
+
+    for k, (rows, cols) in enumerate(components):
+        sub_result = solved[k] if k in solved else _solve_component(tasks[k])
+        if sub_result == 'Broken':
+            return sub_result
+        if duals:
+            sub_result, sub_u, sub_v = sub_result
+            for r, value in zip(rows, sub_u):
+                u[r] = value
+            for c, value in zip(cols, sub_v):
+                v[c] = value
+        for r, c in zip(rows, sub_result):
+            if c != -1 and c < len(cols):
+                result[r] = cols[c]
+    return (result, u, v) if duals else result
 
 
 
@@ -0,0 +1,308 @@
+'''
+Approximate assignment engine with a dual lower bound
+Works on the same CSR edges as matching_sparse and in the same model: every
+recipient has a private dummy donor of cost INF, rows without any acceptable
+donor are left out. The assignment is built in three cheap steps:
+    1. greedy - acceptable edges by increasing cost, taken while both ends are free
+    2. cardinality - Hopcroft-Karp (matching_common.cover_zeros) from the greedy matching,
+       so no recipient stays unmatched that some assignment could match
+    3. 2-opt - every row takes its best move to a cheaper free donor or swap with
+       the owner of a cheaper donor, until no move improves or the pass limit is hit
+Column prices then come from vectorized label-correcting sweeps (shortest paths
+to a free column in the residual graph). Any prices p >= 0 give dual feasible
+potentials u[i] = min(INF, min_j c[i][j] + p[j]), v[j] = -p[j], so
+sum(u) + sum(v) is a lower bound of the exact optimum; on an optimal assignment
+with converged prices the bound equals its cost.
+'''
+import numpy as np
+from matching_common import INF, cover_zeros
+from matching_sparse import edges_from_cost
+
+# Improvement passes over all rows
+MAX_PASSES = 10
+# Label-correcting sweeps for the column prices
+MAX_SWEEPS = 200
+# Sorted edges handed to the greedy loop at once
+GREEDY_CHUNK = 1 << 16
+
+
+class CsrRows:
+    '''
+    Rows of CSR column indices as a read-only list of sequences for cover_zeros,
+    without copying (rows past the CSR rows are empty)
+    '''
+
+    def __init__(self, indptr: list, indices: np.ndarray, size: int):
+        self.indptr = indptr
+        self.indices = memoryview(indices)
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, row):
+        if row >= len(self.indptr) - 1:
+            return self.indices[0:0]
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+
+def csr_arrays(indptr, indices, costs) -> tuple:
+    '''
+    CSR edges as (indptr list, int64 indices, float64 costs) ndarrays
+    '''
+    return (list(indptr), np.asarray(indices, dtype=np.int64),
+            np.asarray(costs, dtype=np.float64))
+
+
+def edge_cost(indptr, indices, costs, row: int, col: int):
+    '''
+    Cost of the (row, col) edge or None, CSR columns must be increasing per row
+
+    >>> indptr, indices, costs = [0, 2], np.array([0, 3]), np.array([10.0, 20.0])
+    >>> edge_cost(indptr, indices, costs, 0, 3), edge_cost(indptr, indices, costs, 0, 1)
+    (20.0, None)
+    '''
+    start, stop = indptr[row], indptr[row + 1]
+    k = start + int(np.searchsorted(indices[start:stop], col))
+    if k < stop and indices[k] == col:
+        return float(costs[k])
+    return None
+
+
+def greedy_assignment(indptr, indices, costs, n_cols: int) -> list:
+    '''
+    Edges by increasing cost (ties in row, column order), taken while both ends are free
+
+    >>> greedy_assignment(*csr_arrays([0, 2, 3], [0, 1, 0], [10, 20, 15]), 2)
+    [0, -1]
+    '''
+    n = len(indptr) - 1
+    edge_row = np.repeat(np.arange(n), np.diff(indptr))
+    order = np.argsort(costs, kind='stable')
+    row_col = [-1] * n
+    row_done = np.zeros(n, dtype=bool)
+    col_done = np.zeros(n_cols, dtype=bool)
+    target = min(int(np.count_nonzero(np.diff(indptr))), n_cols)
+    matched = 0
+    for start in range(0, len(order), GREEDY_CHUNK):
+        if matched == target:
+            break
+        chunk = order[start:start + GREEDY_CHUNK]
+        rows = edge_row[chunk]
+        cols = indices[chunk]
+        # Edges whose ends were taken by earlier chunks
+        keep = ~(row_done[rows] | col_done[cols])
+        for i, j in zip(rows[keep].tolist(), cols[keep].tolist()):
+            if row_col[i] == -1 and not col_done[j]:
+                row_col[i] = j
+                row_done[i] = col_done[j] = True
+                matched += 1
+    return row_col
+
+
+def improve_assignment(indptr, indices, costs, row_col: list, col_row: list,
+                       passes: int = MAX_PASSES) -> int:
+    '''
+    Best 2-opt move or swap per row in place, returns the number of improving moves
+    :param row_col: row -> column assignment, updated in place
+    :param col_row: column -> row assignment, updated in place
+    :param passes: maximum passes over all rows
+    :type passes: int
+    '''
+    n = len(indptr) - 1
+    owner = np.array(col_row, dtype=np.int64)
+    row_cost = np.zeros(n)
+    row_min = np.zeros(n)
+    for i, a in enumerate(row_col):
+        if a != -1:
+            row_cost[i] = edge_cost(indptr, indices, costs, i, a)
+            row_min[i] = costs[indptr[i]:indptr[i + 1]].min()
+    moves = 0
+    for _ in range(passes):
+        improved = 0
+        for i in range(n):
+            a = row_col[i]
+            if a == -1 or row_cost[i] == row_min[i]:
+                continue
+            start, stop = indptr[i], indptr[i + 1]
+            cheaper = np.flatnonzero(costs[start:stop] < row_cost[i]) + start
+            cols = indices[cheaper]
+            others = owner[cols]
+            free = others == -1
+            best_gain, best = 0.0, None
+            if free.any():
+                k = cheaper[free][np.argmin(costs[cheaper[free]])]
+                best_gain, best = row_cost[i] - costs[k], (int(indices[k]), -1)
+            # Swap gain is at most this, the owner's cost at a is >= its row minimum
+            cheaper, cols, others = cheaper[~free], cols[~free], others[~free]
+            bound = row_cost[i] - costs[cheaper] + row_cost[others] - row_min[others]
+            for k in np.argsort(-bound, kind='stable').tolist():
+                if bound[k] <= best_gain:
+                    break
+                other = int(others[k])
+                cka = edge_cost(indptr, indices, costs, other, a)
+                if cka is None:
+                    continue
+                gain = bound[k] + row_min[other] - cka
+                if gain > best_gain:
+                    best_gain, best = gain, (int(cols[k]), other)
+            if best is None:
+                continue
+            b, other = best
+            if other == -1:
+                owner[a] = -1
+            else:
+                row_col[other] = a
+                owner[a] = other
+                row_cost[other] = edge_cost(indptr, indices, costs, other, a)
+            row_col[i] = b
+            owner[b] = i
+            row_cost[i] = edge_cost(indptr, indices, costs, i, b)
+            improved += 1
+        moves += improved
+        if not improved:
+            break
+    col_row[:] = owner.tolist()
+    return moves
+
+
+def _row_minima(indptr, indices, costs, price: np.ndarray, live: np.ndarray) -> np.ndarray:
+    '''
+    min_j c[i][j] + p[j] of the live (non empty) rows
+    '''
+    return np.minimum.reduceat(costs + price[indices], np.asarray(indptr)[live])
+
+
+def column_prices(indptr, indices, costs, row_col: list, n_cols: int,
+                  sweeps: int = MAX_SWEEPS) -> np.ndarray:
+    '''
+    Column prices p >= 0 from vectorized label-correcting sweeps
+    p[j] is the shortest residual path length from column j to a free column or to
+    the dummy of a row on the way (free columns cost 0), clamped at 0; stops early
+    when a sweep changes nothing
+    :return: float64 price per column
+    :rtype: np.ndarray
+    '''
+    price = np.zeros(n_cols)
+    live = np.flatnonzero(np.diff(indptr))
+    assigned = np.array([row_col[i] for i in live.tolist()], dtype=np.int64)
+    matched = assigned != -1
+    cols = assigned[matched]
+    own = np.array([edge_cost(indptr, indices, costs, int(i), int(j))
+                    for i, j in zip(live[matched], cols)], dtype=np.float64)
+    price[cols] = INF - own
+    for _ in range(sweeps):
+        best = _row_minima(indptr, indices, costs, price, live)[matched] - own
+        best = np.maximum(np.minimum(best, price[cols]), 0)
+        if not (best < price[cols]).any():
+            break
+        price[cols] = best
+    return price
+
+
+def approx_assignment(indptr, indices, costs, n_cols: int, passes: int = MAX_PASSES,
+                      sweeps: int = MAX_SWEEPS) -> tuple:
+    '''
+    Fast near-optimal assignment over CSR edges
+    Rows without edges stay unassigned (-1) with potential 0
+    :param indptr: CSR row pointers
+    :param indices: CSR column indices, increasing per row
+    :param costs: CSR edge costs
+    :param n_cols: number of columns (donors)
+    :type n_cols: int
+    :param passes: maximum 2-opt passes
+    :type passes: int
+    :param sweeps: maximum price sweeps
+    :type sweeps: int
+    :return: (row -> column assignment, row potentials u, column potentials v),
+             sum(u) + sum(v) is a lower bound of the optimal cost
+    :rtype: tuple
+
+    >>> result, u, v = approx_assignment([0, 2, 3], [0, 1, 0], [10, 20, 15], 2)
+    >>> result, sum(u) + sum(v)
+    ([1, 0], 35.0)
+    '''
+    indptr, indices, costs = csr_arrays(indptr, indices, costs)
+    n = len(indptr) - 1
+    row_col = greedy_assignment(indptr, indices, costs, n_cols)
+    live = np.flatnonzero(np.diff(indptr))
+    matched = sum(j != -1 for j in row_col)
+    if matched < min(len(live), n_cols):
+        # Hopcroft-Karp needs as many rows as columns, the extra rows have no edges
+        size = max(n, n_cols)
+        row_col = cover_zeros(CsrRows(indptr, indices, size), size,
+                              row_col + [-1] * (size - n))['matching'][:n]
+    col_row = [-1] * n_cols
+    for i, j in enumerate(row_col):
+        if j != -1:
+            col_row[j] = i
+    improve_assignment(indptr, indices, costs, row_col, col_row, passes)
+    return (row_col,) + assignment_duals(indptr, indices, costs, row_col, n_cols, sweeps)
+
+
+def assignment_duals(indptr, indices, costs, row_col: list, n_cols: int,
+                     sweeps: int = MAX_SWEEPS) -> tuple:
+    '''
+    Dual potentials of an assignment over CSR edges from its column prices
+    u[i] = min(INF, min_j c[i][j] + p[j]) (0 on rows without edges) and v = -p are
+    dual feasible for any assignment; when the prices converge (at most one sweep per
+    row plus one) on an optimal assignment they also satisfy complementary slackness
+    :param row_col: row -> column assignment, -1 for unassigned rows
+    :param n_cols: number of columns (donors)
+    :type n_cols: int
+    :param sweeps: maximum price sweeps
+    :type sweeps: int
+    :return: (row potentials u, column potentials v)
+    :rtype: tuple
+
+    >>> u, v = assignment_duals([0, 2, 3], [0, 1, 0], [10, 20, 15], [1, 0], 2)
+    >>> sum(u) + sum(v)
+    35.0
+    '''
+    indptr, indices, costs = csr_arrays(indptr, indices, costs)
+    price = np.zeros(n_cols)
+    u = np.zeros(len(indptr) - 1)
+    live = np.flatnonzero(np.diff(indptr))
+    if len(live):
+        price = column_prices(indptr, indices, costs, row_col, n_cols, sweeps)
+        u[live] = np.minimum(INF, _row_minima(indptr, indices, costs, price, live))
+    return u.tolist(), (-price).tolist()
+
+
+def assignment_gap(indptr, indices, costs, result: list, u: list, v: list) -> dict:
+    '''
+    Cost of an assignment next to the lower bound of its dual potentials
+    Unassigned rows with edges cost INF, rows without edges are left out
+    :return: {'cost', 'lower_bound', 'gap', 'relative_gap'}, gap = cost - lower_bound
+             bounds how far the assignment can be from the optimum
+    :rtype: dict
+
+    >>> assignment_gap([0, 2, 3], [0, 1, 0], [10, 20, 15], [0, -1], [10, 15], [0, 0])
+    {'cost': 100010.0, 'lower_bound': 25.0, 'gap': 99985.0, 'relative_gap': 0.99975}
+    '''
+    indptr, indices, costs = csr_arrays(indptr, indices, costs)
+    cost = 0.0
+    for i, j in enumerate(result):
+        if indptr[i] == indptr[i + 1]:
+            continue
+        cost += INF if j == -1 else edge_cost(indptr, indices, costs, i, j)
+    bound = float(sum(u) + sum(v))
+    gap = cost - bound
+    return {'cost': cost, 'lower_bound': bound, 'gap': gap,
+            'relative_gap': round(gap / cost, 6) if cost else 0.0}
+
+
+def match_approx(arr: list) -> list:
+    '''
+    Approximate engine behind match() contract
+    :param arr: cost matrix after remove_not_accepted
+    :type arr: list
+    :return: list of assigned donor indices per recipient
+    :rtype: list
+    '''
+    return approx_assignment(*edges_from_cost(arr))[0]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,127 @@
+'''
+Pieces shared by the matching engines
+INF marks a not accepted recipient-donor pair, cover_zeros is the Hopcroft-Karp
+maximum matching with its Koenig line cover, system32_termination ends a run the
+reduction/shift loop cannot finish. matching and every engine module import them
+from here, so no engine has to import matching.
+'''
+import collections
+from sys import exit as system32_termination # pylint: disable=unused-import
+
+# INF = float('inf')
+INF = 100000
+
+
+def cover_zeros(adj: list, n: int, prev: list = None) -> dict:
+    '''
+    Finding minimum number of lines to cover all zeros of square matrix
+    Using Hopcroft-Karp algorithm for maximum matching and Koning theorem for the cover
+    The augmenting DFS runs on an explicit stack (no recursion limit on long paths)
+    and visits columns in the same order as the recursive formulation.
+    :param adj: zero adjacency, adj[row] is list of columns with zero cost
+    :type adj: list
+    :param n: matrix size
+    :type n: int
+    :param prev: Previous matching to start from
+    :type prev: list
+    :return: Dictionary with rows and columns to be crossed
+    :rtype: dict
+
+    >>> cover_zeros([[0, 1], [0], [2]], 3)['matching']
+    [1, 0, 2]
+    '''
+    # Hopcroft algorithm, flat int lists indexed by row / column
+    pair_u = prev.copy() if prev else [-1] * n
+    pair_v = [-1] * n
+
+    for u, v in enumerate(pair_u):
+        if v != -1:
+            pair_v[v] = u
+
+    dist = [-1] * n
+    # Next adjacency position to try, per row on the DFS stack
+    pos = [0] * n
+
+    def bfs():
+        queue = collections.deque()
+        for u in range(n):
+            if pair_u[u] == -1:
+                dist[u] = 0
+                queue.append(u)
+            else:
+                dist[u] = INF
+        dist_null = INF
+
+        while queue:
+            u = queue.popleft()
+            if dist[u] < dist_null:
+                for v in adj[u]:
+                    if pair_v[v] == -1:
+                        if dist_null == INF:
+                            dist_null = dist[u] + 1
+                    elif dist[pair_v[v]] == INF:
+                        dist[pair_v[v]] = dist[u] + 1
+                        queue.append(pair_v[v])
+        return dist_null != INF
+
+    def dfs(root):
+        # Explicit stack of rows; pos[u] - 1 is the column u went through
+        stack = [root]
+        pos[root] = 0
+        while stack:
+            u = stack[-1]
+            row = adj[u]
+            k = pos[u]
+            while k < len(row):
+                v = row[k]
+                k += 1
+                w = pair_v[v]
+                if w == -1:
+                    pos[u] = k
+                    # Flipping the path: every row on the stack takes its column
+                    for x in stack:
+                        col = adj[x][pos[x] - 1]
+                        pair_v[col] = x
+                        pair_u[x] = col
+                    return True
+                if dist[w] == dist[u] + 1:
+                    pos[u] = k
+                    pos[w] = 0
+                    stack.append(w)
+                    break
+            else:
+                dist[u] = INF
+                stack.pop()
+        return False
+
+    while bfs():
+        for u in range(n):
+            if pair_u[u] == -1:
+                dfs(u)
+
+    # Koning theorem
+
+    free_rows = [i for i in range(n) if pair_u[i] == -1]
+    visited_rows = set(free_rows)
+    visited_cols = set()
+    queue = collections.deque(free_rows)
+
+    while queue:
+        u = queue.popleft()
+        for v in adj[u]:
+            if v not in visited_cols:
+                visited_cols.add(v)
+
+                matched_row = pair_v[v]
+                if matched_row != -1 and matched_row not in visited_rows:
+                    visited_rows.add(matched_row)
+                    queue.append(matched_row)
+    selected_rows = [i for i in range(n) if i not in visited_rows]
+    selected_cols = sorted(list(visited_cols))
+    return {'rows': selected_rows, 'cols': selected_cols, \
+    'count': len([x for x in pair_u if x != -1]), 'matching': pair_u}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
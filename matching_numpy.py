@@ -0,0 +1,184 @@
+'''
+Vectorized Hungarian engine
+Same reduction -> line covering -> shift loop as matching._hungarian, but the
+cost matrix lives in one contiguous 2-D ndarray and every step is a masked
+array operation over boolean row/column cover masks.
+'''
+import numpy as np
+import metrics
+from matching_common import INF, cover_zeros, system32_termination
+
+
+def reduction(cost: np.ndarray) -> tuple:
+    '''
+    Row reduction followed by column reduction, in place
+    :return: (row minima, column minima after the row reduction), the starting
+             row and column potentials
+    :rtype: tuple
+
+    >>> cost = np.array([[4, 1, 3], [2, 0, 5], [3, 2, 2]])
+    >>> [part.tolist() for part in reduction(cost)], cost.tolist()
+    ([[1, 0, 2], [1, 0, 0]], [[2, 0, 2], [1, 0, 5], [0, 0, 0]])
+    '''
+    row_min = cost.min(axis=1)
+    cost -= row_min[:, None]
+    col_min = cost.min(axis=0)
+    cost -= col_min
+    return row_min, col_min
+
+
+def find_lines(cost: np.ndarray, prev: list = None) -> dict:
+    '''
+    Finding minimum number of lines to cover all zeros in matrix
+    Adds boolean 'row_mask'/'col_mask' of covered lines to the cover_zeros result
+    :param cost: reduced cost matrix
+    :type cost: np.ndarray
+    :param prev: Previous matching to start from
+    :type prev: list
+    :return: Dictionary with rows and columns to be crossed
+    :rtype: dict
+    '''
+    n = cost.shape[0]
+    metrics.inc('hla_find_lines_calls_total', help_text='Line cover searches',
+                engine='numpy')
+    zeros = cost == 0
+    adj = [np.flatnonzero(row).tolist() for row in zeros]
+    lines = cover_zeros(adj, n, prev)
+    row_mask = np.zeros(n, dtype=bool)
+    col_mask = np.zeros(n, dtype=bool)
+    row_mask[lines['rows']] = True
+    col_mask[lines['cols']] = True
+    lines['row_mask'] = row_mask
+    lines['col_mask'] = col_mask
+    return lines
+
+
+def shift(cost: np.ndarray, lines: dict):
+    '''
+    Shifting step of Hungarian algorithm, in place
+    Decreases uncovered elements by minimum uncovered value
+    Increases elements covered twice by minimum uncovered value
+    INF cells are left untouched like in the list engine
+
+    :param cost: reduced cost matrix
+    :type cost: np.ndarray
+    :param lines: result of find_lines
+    :type lines: dict
+    :return: the minimum uncovered value the matrix was shifted by
+    '''
+    row_cov = lines['row_mask']
+    col_cov = lines['col_mask']
+    uncovered = cost[~row_cov][:, ~col_cov]
+    min_v = uncovered.min() if uncovered.size else INF
+    if min_v >= INF:
+        print('\033[91mERROR in shifting, no possible shift\033[0m')
+        system32_termination()
+    # +min_v on double covered, -min_v on uncovered, 0 elsewhere
+    step = (row_cov[:, None].astype(cost.dtype) + col_cov[None, :] - 1) * min_v
+    np.add(cost, step, out=cost, where=cost != INF)
+    return min_v
+
+
+def hungarian_numpy(arr) -> tuple:
+    '''
+    Hungarian algorithm on square cost matrix kept as ndarray
+    Matching identical to matching._hungarian; the potentials follow the reduction
+    and every shift (uncovered rows gain the shift, covered columns lose it)
+    :param arr: square cost matrix
+    :type arr: list | np.ndarray
+    :return: (row -> column matching, row potentials u, column potentials v)
+    :rtype: tuple
+
+    >>> matching, u, v = hungarian_numpy([[4, 1, 3], [2, 0, 5], [3, 2, 2]])
+    >>> matching, sum(u) + sum(v)
+    ([1, 0, 2], 5.0)
+    '''
+    cost = np.array(arr)
+    if not np.issubdtype(cost.dtype, np.integer):
+        cost = cost.astype(np.float64)
+    n = cost.shape[0]
+    u, v = reduction(cost)
+    u, v = u.astype(np.float64), v.astype(np.float64)
+    lines = find_lines(cost)
+    while lines['count'] != n:
+        metrics.inc('hla_shift_iterations_total', help_text='Hungarian shift steps',
+                    engine='numpy')
+        min_v = shift(cost, lines)
+        u[~lines['row_mask']] += min_v
+        v[lines['col_mask']] -= min_v
+        lines = find_lines(cost, prev=lines['matching'])
+    return lines['matching'], u.tolist(), v.tolist()
+
+
+def shortest_augmenting_path_masked(cost: np.ndarray, feasible: np.ndarray = None,
+                                    rows=None) -> tuple:
+    '''
+    matching.shortest_augmenting_path over a cost ndarray, rows <= cols
+    Cells outside the feasible mask cost INF. Every Dijkstra step is one vectorized
+    pass over the columns; the same columns are picked as in the list engine,
+    so the assignment is identical.
+    :param cost: (n, m) cost matrix of any numeric dtype
+    :type cost: np.ndarray
+    :param feasible: (n, m) bool mask of acceptable cells, None means all
+    :type feasible: np.ndarray
+    :param rows: rows of cost to solve, in order (default all); rows are read one
+                 at a time, so cost may be a memory-mapped file
+    :return: (row -> column assignment, row potentials u, column potentials v)
+             indexed like rows
+    :rtype: tuple
+
+    >>> cost = np.array([[5, 1, 9, 9], [1, 5, 9, 9]], dtype=np.uint16)
+    >>> shortest_augmenting_path_masked(cost, cost < 9)[0]
+    [1, 0]
+    '''
+    rows = range(cost.shape[0]) if rows is None else rows
+    n, m = len(rows), cost.shape[1]
+    u = np.zeros(n)
+    v = np.zeros(m)
+    col_row = np.full(m, -1, dtype=np.int64)
+    for i in range(n):
+        dist = np.full(m, np.inf)
+        way = np.full(m, -1, dtype=np.int64)
+        scanned = np.zeros(m, dtype=bool)
+        order = []
+        i0, j0, d0 = i, -1, 0.0
+        while True:
+            row = cost[rows[i0]].astype(np.float64)
+            if feasible is not None:
+                row[~feasible[rows[i0]]] = INF
+            row += d0 - u[i0]
+            row -= v
+            better = row < dist
+            better &= ~scanned
+            dist[better] = row[better]
+            way[better] = j0
+            # First minimum among unscanned columns, like the list engine's scan
+            masked = np.where(scanned, np.inf, dist)
+            j1 = int(np.argmin(masked))
+            best = masked[j1]
+            scanned[j1] = True
+            order.append(j1)
+            if col_row[j1] == -1:
+                break
+            i0 = int(col_row[j1])
+            j0 = j1
+            d0 = best
+        u[i] += best
+        if len(order) > 1:
+            reached = np.array(order[:-1])
+            step = best - dist[reached]
+            u[col_row[reached]] += step
+            v[reached] -= step
+        while j1 != -1:
+            j0 = int(way[j1])
+            col_row[j1] = i if j0 == -1 else col_row[j0]
+            j1 = j0
+    row_col = [-1] * n
+    for j in np.flatnonzero(col_row >= 0).tolist():
+        row_col[int(col_row[j])] = j
+    return row_col, u.tolist(), v.tolist()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,207 @@
+'''
+Sparse assignment engine
+Works only with feasible (recipient, donor, cost) edges stored in CSR arrays,
+so memory and time scale with the number of acceptable pairs instead of n x m.
+Every recipient is augmented once with a Dijkstra search over reduced costs
+(sparse shortest augmenting path). Each recipient also has a private dummy
+donor of cost INF, which gives the same optimum as the dense engines where
+not accepted cells cost INF.
+'''
+import heapq
+from array import array
+import metrics
+from matching_common import INF
+
+
+def edges_from_cost(arr: list) -> tuple:
+    '''
+    Building CSR edges from thresholded cost matrix, INF cells are skipped
+    :param arr: cost matrix after remove_not_accepted
+    :type arr: list
+    :return: (indptr, indices, costs, number of columns)
+    :rtype: tuple
+
+    >>> indptr, indices, costs, m = edges_from_cost([[INF, 30], [10, INF]])
+    >>> list(indptr), list(indices), list(costs), m
+    ([0, 1, 2], [1, 0], [30.0, 10.0], 2)
+    '''
+    indptr = array('q', [0])
+    indices = array('q')
+    costs = array('d')
+    for row in arr:
+        for j, value in enumerate(row):
+            if value != INF:
+                indices.append(j)
+                costs.append(value)
+        indptr.append(len(indices))
+    return indptr, indices, costs, len(arr[0]) if arr else 0
+
+
+def edges_from_similarity(sim, min_accept: int = 60) -> tuple:
+    '''
+    Building CSR edges straight from similarity rows without dense cost matrix
+    Cost and threshold are the same as convert_similarity + remove_not_accepted
+    :param sim: similarity matrix (rows may be generated lazily)
+    :param min_accept: minimum accepted similarity percentage
+    :type min_accept: int
+    :return: (indptr, indices, costs, number of columns)
+    :rtype: tuple
+
+    >>> indptr, indices, costs, m = edges_from_similarity([[0.5, 0.7], [0.9, 0.1]])
+    >>> list(indptr), list(indices), list(costs), m
+    ([0, 1, 2], [1, 0], [30.0, 10.0], 2)
+    '''
+    limit = 100 - min_accept
+    indptr = array('q', [0])
+    indices = array('q')
+    costs = array('d')
+    m = 0
+    for row in sim:
+        m = len(row)
+        for j, value in enumerate(row):
+            cost = int(round(1 - value, 2) * 100)
+            if cost <= limit:
+                indices.append(j)
+                costs.append(cost)
+        indptr.append(len(indices))
+    return indptr, indices, costs, m
+
+
+def edges_from_array(sim, min_accept: int = 60) -> tuple:
+    '''
+    edges_from_similarity for a similarity ndarray
+    Cells are prefiltered with a vectorized comparison (with a margin for rounding),
+    only the candidates get the exact cost of convert_similarity
+    :param sim: (n, m) similarity ndarray
+    :param min_accept: minimum accepted similarity percentage
+    :type min_accept: int
+    :return: (indptr, indices, costs, number of columns)
+    :rtype: tuple
+
+    >>> import numpy as np
+    >>> indptr, indices, costs, m = edges_from_array(np.array([[0.5, 0.7], [0.9, 0.1]]))
+    >>> list(indptr), list(indices), list(costs), m
+    ([0, 1, 2], [1, 0], [30.0, 10.0], 2)
+    '''
+    import numpy as np # pylint: disable=import-outside-toplevel
+    limit = 100 - min_accept
+    indptr = array('q', [0])
+    indices = array('q')
+    costs = array('d')
+    floor = 1 - (limit + 2) / 100
+    for row in sim:
+        for j in np.flatnonzero(row >= floor).tolist():
+            cost = int(round(1 - float(row[j]), 2) * 100)
+            if cost <= limit:
+                indices.append(j)
+                costs.append(cost)
+        indptr.append(len(indices))
+    return indptr, indices, costs, sim.shape[1]
+
+
+def sparse_assignment(indptr, indices, costs, n_cols: int) -> tuple:
+    '''
+    Min cost assignment over CSR edges
+    Rows without any augmenting path stay unassigned (-1)
+    :param indptr: CSR row pointers
+    :param indices: CSR column indices
+    :param costs: CSR edge costs
+    :param n_cols: number of columns (donors)
+    :type n_cols: int
+    :return: (row -> column assignment, row potentials u, column potentials v)
+    :rtype: tuple
+
+    >>> sparse_assignment([0, 2, 3], [0, 1, 0], [50, 70, 10], 2)[0]
+    [1, 0]
+    '''
+    n = len(indptr) - 1
+    metrics.inc('hla_feasible_edges_total', len(indices),
+                'Acceptable (non INF) recipient-donor pairs', engine='sparse')
+    # Columns n_cols + r are the private dummy donors of rows r
+    u = [0] * n
+    v = [0] * (n_cols + n)
+    col_row = [-1] * (n_cols + n)
+    row_col = [-1] * n
+
+    for start in range(n):
+        if indptr[start] == indptr[start + 1]:
+            continue
+        dist = {}
+        pred = {}
+        done = []
+        done_set = set()
+        row_dist = {start: 0}
+        heap = []
+        row = start
+        base = 0
+        target = -1
+        while True:
+            u_r = u[row]
+            for k in range(indptr[row], indptr[row + 1]):
+                j = indices[k]
+                if j in done_set:
+                    continue
+                nd = base + costs[k] - u_r - v[j]
+                if nd < dist.get(j, INF * 2):
+                    dist[j] = nd
+                    pred[j] = row
+                    heapq.heappush(heap, (nd, j))
+            j = n_cols + row
+            if j not in done_set:
+                nd = base + INF - u_r - v[j]
+                if nd < dist.get(j, INF * 2):
+                    dist[j] = nd
+                    pred[j] = row
+                    heapq.heappush(heap, (nd, j))
+
+            while True:
+                d, j = heapq.heappop(heap)
+                if j not in done_set and d == dist[j]:
+                    break
+            done.append(j)
+            done_set.add(j)
+            if col_row[j] == -1:
+                target = j
+                break
+            row = col_row[j]
+            base = d
+            row_dist[row] = d
+
+        metrics.observe('hla_augmenting_path_columns', len(done),
+                        help_text='Columns scanned per augmenting path', engine='sparse')
+        # Updating potentials of the search tree only
+        total = dist[target]
+        for r, d in row_dist.items():
+            u[r] += total - d
+        for j in done:
+            v[j] -= total - dist[j]
+
+        # Flipping the augmenting path
+        j = target
+        while True:
+            r = pred[j]
+            prev = row_col[r]
+            row_col[r] = j
+            col_row[j] = r
+            if r == start:
+                break
+            j = prev
+
+    result = [c if c < n_cols else -1 for c in row_col]
+    return result, u, v[:n_cols]
+
+
+def match_sparse(arr: list) -> list:
+    '''
+    Sparse engine behind match() contract
+    :param arr: cost matrix after remove_not_accepted
+    :type arr: list
+    :return: list of assigned donor indices per recipient
+    :rtype: list
+    '''
+    return sparse_assignment(*edges_from_cost(arr))[0]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,9 +1,74 @@
 '''
 Docstring for DM.DM_Project_2025.matrix_builder
 '''
-from scoring import pair_score, parse_locus, get_max_score
+import numpy as np
+from scoring import pair_score, parse_locus
+from encoding import encode_populations, is_pool
+from score_tables import DEFAULT_PARAMS, params_kwargs, recipient_max_scores, score_encoded, \
+    normalize_scores
+from parallel_builder import build_similarity_parallel
+from dedup import unique_genotypes, recipient_key, donor_key, SimilarityView
 
-def build_similarity_matrix(recipients: list, donors: list) -> list[list[float]]:
+# Smallest matrix (recipients x donors) worth building in parallel
+PARALLEL_MIN_CELLS = 1_000_000
+
+def _is_typed(people: list) -> bool:
+    """True if every person is a list of allele strings (not legacy numeric input)."""
+    return all(isinstance(p, list) and all(isinstance(a, str) for a in p) for p in people)
+
+
+def build_similarity_array(recipients: list, donors: list, vocab: dict = None,
+                           params: tuple = DEFAULT_PARAMS, workers: int = 1) -> np.ndarray:
+    """
+    Vectorized build_similarity_matrix for lists of allele strings.
+
+    Both populations are interned into integer codes once, then all pairs are
+    scored with score table lookups. Values are identical to the scalar loop.
+    `donors` may also be a compiled pool from pool_cache.load_pool.
+    `params` is a score_tables.scoring_params key. With workers other than 1
+    (None means CPU count) large matrices are built by parallel_builder.
+
+    Returns:
+        np.ndarray: (N, M) float64 matrix with values between 0.0 and 1.0.
+    """
+    n_donors = len(donors['allele']) if is_pool(donors) else len(donors)
+    if workers != 1 and len(recipients) * n_donors >= PARALLEL_MIN_CELLS:
+        return build_similarity_parallel(recipients, donors, workers=workers, params=params)
+
+    rec, don, vocab = encode_populations(recipients, donors, vocab)
+    total = score_encoded(rec, don, vocab, params)
+    max_s = np.array(recipient_max_scores(recipients, params))[:, None]
+    return normalize_scores(total, max_s)
+
+
+def build_similarity_dedup(recipients: list, donors: list,
+                           params: tuple = DEFAULT_PARAMS, workers: int = 1) -> SimilarityView:
+    """
+    Similarity computed only for unique recipient x unique donor genotypes.
+
+    Genotypes are canonicalized (see dedup), scored once per unique pair and
+    expanded lazily through index mapping. A recipient whose typing only differs
+    in allele order from the first one seen shares its row; the per-pair sum is
+    then taken in that first typing order.
+
+    Returns:
+        SimilarityView: indexable like the list matrix, view[i][j].
+    """
+    rec_unique, rec_index = unique_genotypes(recipients, recipient_key)
+    if is_pool(donors):
+        # Encoded rows already are the canonical donor genotype
+        rows, don_index = np.unique(donors['allele'], axis=0, return_inverse=True)
+        don_unique = dict(donors, allele=rows)
+        don_index = don_index.reshape(-1)
+    else:
+        don_unique, don_index = unique_genotypes(donors, donor_key)
+    unique = build_similarity_array(rec_unique, don_unique, params=params, workers=workers)
+    return SimilarityView(unique, rec_index, don_index)
+
+
+def build_similarity_matrix(recipients: list, donors: list,
+                            params: tuple = DEFAULT_PARAMS, dedup: bool = False,
+                            workers: int = 1):
     """
     Constructs a normalized similarity matrix (0.0 to 1.0).
 
@@ -16,27 +81,26 @@ def build_similarity_matrix(recipients: list, donors: list) -> list[list[float]]
 
     Args:
         recipients: List of lists of allele strings (e.g. [['A*01','B*02'], ...])
-        donors: List of lists of allele strings.
+        donors: List of lists of allele strings, or a pool_cache.load_pool pool.
+        params: Scoring parameters, see score_tables.scoring_params.
+        dedup: Score identical genotypes once and return a lazy SimilarityView.
+        workers: Worker count for large matrices, None means CPU count.
 
     Returns:
         List[List[float]]: A matrix where val is between 0.0 and 1.0.
     """
 
+    # Allele string typings go through the vectorized integer-encoded path
+    if recipients and _is_typed(recipients) and (is_pool(donors) or donors and _is_typed(donors)):
+        if dedup:
+            return build_similarity_dedup(recipients, donors, params=params, workers=workers)
+        return build_similarity_array(recipients, donors, params=params,
+                                      workers=workers).tolist()
+
     # 1. Pre-calculate max scores for recipients to save time
     # This represents the score if a donor matched the recipient perfectly.
-    rec_max_scores = []
-    for rec_alleles in recipients:
-        max_total = 0.0
-        # If input is simple numbers (legacy tests), handle gracefully
-        if rec_alleles and isinstance(rec_alleles, (list, tuple)) \
-            and isinstance(rec_alleles[0], str):
-            for allele in rec_alleles:
-                max_total += get_max_score(allele)
-        else:
-            # Fallback for legacy numeric tests
-            max_total = 1.0
-
-        rec_max_scores.append(max_total)
+    rec_max_scores = recipient_max_scores(recipients, params)
+    scoring_kwargs = params_kwargs(params)
 
     similarity_matrix = []
 
@@ -76,7 +140,7 @@ def build_similarity_matrix(recipients: list, donors: list) -> list[list[float]]
 
                     if d_match:
                         # Calculate score for this specific locus pair
-                        current_score += pair_score(r_all, d_match)
+                        current_score += pair_score(r_all, d_match, **scoring_kwargs)
                     # If donor is missing the locus, score remains 0 for this allele
 
             # Normalize: Actual Score / Max Possible Score
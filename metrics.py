@@ -0,0 +1,196 @@
+"""Run metrics: counters, gauges and histograms with JSON / Prometheus export.
+
+Metrics are off by default and every recording call returns immediately then,
+so the solvers can be instrumented in place. `enable()` (main.py does it for
+``--metrics-out``) starts recording into one process-wide registry. Durations
+come from `time.perf_counter`, a monotonic clock.
+
+Work done in worker processes (``--workers``, ``--decompose``) is timed as a
+whole by the parent; counters inside the workers are not collected.
+
+Metric names follow the Prometheus conventions (``hla_`` prefix, ``_total``
+for counters, ``_seconds`` for durations); labels are keyword arguments.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets (an implicit +Inf bucket follows)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, 300.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+_ENABLED = False
+_LOCK = threading.Lock()
+_METRICS = {}
+
+
+def enable(on: bool = True):
+    """Start (or stop) recording."""
+    global _ENABLED # pylint: disable=global-statement
+    _ENABLED = on
+
+
+def enabled() -> bool:
+    """True while metrics are recorded, to skip work that only feeds them."""
+    return _ENABLED
+
+
+def reset():
+    """Drop every recorded metric."""
+    with _LOCK:
+        _METRICS.clear()
+
+
+def _series(name: str, kind: str, help_text: str, labels: dict) -> tuple:
+    metric = _METRICS.get(name)
+    if metric is None:
+        metric = _METRICS[name] = {'type': kind, 'help': help_text, 'series': {}}
+    return metric, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, help_text: str = '', **labels):
+    """Add `value` to a counter.
+
+    >>> enable(); reset(); inc('hla_demo_total', 2, stage='x'); inc('hla_demo_total', stage='x')
+    >>> snapshot()['hla_demo_total']['series']
+    [{'labels': {'stage': 'x'}, 'value': 3}]
+    >>> enable(False); reset()
+    """
+    if not _ENABLED:
+        return
+    with _LOCK:
+        metric, key = _series(name, 'counter', help_text, labels)
+        metric['series'][key] = metric['series'].get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, help_text: str = '', **labels):
+    """Set a gauge to `value`."""
+    if not _ENABLED:
+        return
+    with _LOCK:
+        metric, key = _series(name, 'gauge', help_text, labels)
+        metric['series'][key] = value
+
+
+def observe(name: str, value: float, buckets: tuple = SIZE_BUCKETS, help_text: str = '',
+            **labels):
+    """Record one value in a histogram.
+
+    The buckets of the first observation of `name` are kept.
+    """
+    if not _ENABLED:
+        return
+    with _LOCK:
+        metric, key = _series(name, 'histogram', help_text, labels)
+        metric.setdefault('buckets', tuple(buckets))
+        hist = metric['series'].get(key)
+        if hist is None:
+            hist = metric['series'][key] = {'counts': [0] * (len(metric['buckets']) + 1),
+                                            'sum': 0, 'count': 0}
+        k = 0
+        for bound in metric['buckets']:
+            if value <= bound:
+                break
+            k += 1
+        hist['counts'][k] += 1
+        hist['sum'] += value
+        hist['count'] += 1
+
+
+@contextmanager
+def timer(stage: str):
+    """Time a block into the ``hla_stage_seconds`` histogram.
+
+    Also counts failures of the stage in ``hla_stage_errors_total``.
+    """
+    if not _ENABLED:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc('hla_stage_errors_total', help_text='Pipeline stages that raised', stage=stage)
+        raise
+    finally:
+        observe('hla_stage_seconds', time.perf_counter() - t0, SECONDS_BUCKETS,
+                'Wall time of pipeline stages', stage=stage)
+
+
+def snapshot() -> dict:
+    """All metrics as plain data, histogram buckets cumulative like Prometheus."""
+    out = {}
+    with _LOCK:
+        for name, metric in sorted(_METRICS.items()):
+            series = []
+            for key, value in metric['series'].items():
+                entry = {'labels': dict(key)}
+                if metric['type'] == 'histogram':
+                    bounds = [str(b) for b in metric['buckets']] + ['+Inf']
+                    cumulative, running = {}, 0
+                    for bound, count in zip(bounds, value['counts']):
+                        running += count
+                        cumulative[bound] = running
+                    entry.update(buckets=cumulative, sum=value['sum'], count=value['count'])
+                else:
+                    entry['value'] = value
+                series.append(entry)
+            out[name] = {'type': metric['type'], 'help': metric['help'], 'series': series}
+    return out
+
+
+def _labels(labels: dict, extra: dict = None) -> str:
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, v in items)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+
+def to_prometheus(data: dict = None) -> str:
+    """Prometheus text exposition format of a snapshot.
+
+    >>> enable(); reset(); inc('hla_demo_total', 3, 'Demo', stage='x')
+    >>> print(to_prometheus(), end='')
+    # HELP hla_demo_total Demo
+    # TYPE hla_demo_total counter
+    hla_demo_total{stage="x"} 3
+    >>> enable(False); reset()
+    """
+    data = snapshot() if data is None else data
+    lines = []
+    for name, metric in data.items():
+        if metric['help']:
+            lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for entry in metric['series']:
+            labels = entry['labels']
+            if metric['type'] == 'histogram':
+                for bound, count in entry['buckets'].items():
+                    lines.append(f'{name}_bucket{_labels(labels, {"le": bound})} {count}')
+                lines.append(f"{name}_sum{_labels(labels)} {entry['sum']}")
+                lines.append(f"{name}_count{_labels(labels)} {entry['count']}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {entry['value']}")
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def write(path: str, fmt: str = None):
+    """Write all metrics to `path`.
+
+    Args:
+        path: Output file.
+        fmt: ``'json'`` or ``'prometheus'``; by default Prometheus for
+            ``.prom`` / ``.txt`` files and JSON otherwise.
+    """
+    if fmt is None:
+        fmt = 'prometheus' if path.endswith(('.prom', '.txt')) else 'json'
+    data = snapshot()
+    with open(path, 'w', encoding='utf-8') as fh:
+        if fmt == 'prometheus':
+            fh.write(to_prometheus(data))
+        else:
+            json.dump({'created': time.time(), 'metrics': data}, fh, indent=2)
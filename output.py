@@ -0,0 +1,288 @@
+"""Single-pass streaming output of a matching result.
+
+`write_outputs` walks the assignment once and hands every recipient row to
+each requested sink, which streams it to its own file (or stdout):
+
+- `MatrixCsvSink`: the recipients x donors CSV of main.write_matrix_csv,
+  only the assigned cell filled
+- `AssignmentCsvSink`: ``recipient,assigned_donor,similarity``
+- `NdjsonSink`: one JSON record per recipient
+- `MatrixHtmlSink`: the full table of main.write_matrix_html
+- `SparseHtmlSink`: one table row per recipient, for large pools
+- `JsonDocumentSink`: the ``{"result", "csv_matrix", "csv_assignment"}``
+  document main.py prints, assembled in spooled temporary files
+
+Rows are written as they are produced; nothing holds a whole artifact in
+memory (spooled files move to disk past `SPOOL_SIZE` bytes).
+"""
+
+import csv
+import io
+import json
+import sys
+import tempfile
+from html import escape
+
+# Bytes a JsonDocumentSink section keeps in memory before spilling to disk
+SPOOL_SIZE = 1 << 20
+
+MATCHED = 'matched'
+BELOW_THRESHOLD = 'below_threshold'
+UNMATCHED = 'unmatched'
+
+HTML_HEAD = ('<!doctype html>\n<html><head><meta charset="utf-8">'
+             '<title>HLA Similarity Matrix</title>\n'
+             '<style>body{font-family:sans-serif; padding:20px;} '
+             'table{border-collapse:collapse; width:100%;} '
+             'td,th{border:1px solid #ddd;padding:8px;text-align:center} '
+             'th{background-color:#f2f2f2;} tr:hover{background-color:#f5f5f5;} '
+             '.good{background:#c8e6c9; color:#2e7d32; font-weight:bold;} '
+             '.badrow{background:#ffebee; color:#c62828;}</style>\n'
+             '</head><body>\n')
+
+
+def csv_field(value: str) -> str:
+    """One field as csv.writer quotes it (QUOTE_MINIMAL, excel dialect).
+
+    >>> print(csv_field('R1'), csv_field('a,b'), csv_field('x"y'))
+    R1 "a,b" "x""y"
+    """
+    value = str(value)
+    if any(c in value for c in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _csv_line(cells: list) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(cells)
+    return buf.getvalue()
+
+
+def assignment_rows(rec_ids: list, don_ids: list, sim, result: list, min_accept: float):
+    """Yield (row, recipient id, donor column or -1, similarity or None, status).
+
+    The column is only given for assignments at or above min_accept; below
+    the threshold the similarity is still reported with status
+    BELOW_THRESHOLD.
+
+    >>> list(assignment_rows(['R1', 'R2'], ['D1', 'D2'], [[0.9, 0.1], [0.5, 0.2]], [0, 1], 60))
+    [(0, 'R1', 0, 0.9, 'matched'), (1, 'R2', -1, 0.2, 'below_threshold')]
+    """
+    threshold = min_accept / 100.0
+    for i, rid in enumerate(rec_ids):
+        assigned = result[i] if i < len(result) else -1
+        if assigned != -1 and 0 <= assigned < len(don_ids):
+            val = sim[i][assigned]
+            if val is not None and val >= threshold:
+                yield i, rid, assigned, val, MATCHED
+            else:
+                yield i, rid, -1, val, BELOW_THRESHOLD
+        else:
+            yield i, rid, -1, None, UNMATCHED
+
+
+class _Sink:
+    """Base sink writing to a path, an open text stream, or stdout."""
+
+    def __init__(self, path: str = None, stream=None):
+        self.path = path
+        self.stream = stream
+        self.out = None
+        self.m = 0
+
+    def open(self):
+        """Open the target, before the first row."""
+        self.out = self._open_target()
+
+    def _open_target(self):
+        if self.path:
+            return open(self.path, 'w', newline='', encoding='utf-8')
+        return self.stream or sys.stdout
+
+    def begin(self, don_ids: list):
+        """Header, called once before the rows."""
+
+    def row(self, rid: str, assigned: int, val, status: str, don_ids: list):
+        """One recipient; assigned is -1 unless matched."""
+
+    def end(self):
+        """Footer, called once after the rows."""
+
+    def close(self):
+        """Flush and close the target (stdout is only flushed)."""
+        if self.out is None:
+            return
+        if self.path:
+            self.out.close()
+        else:
+            self.out.flush()
+        self.out = None
+
+
+class MatrixCsvSink(_Sink):
+    """Recipients x donors CSV with only the assigned cell filled."""
+
+    def begin(self, don_ids: list):
+        self.out.write(_csv_line([''] + list(don_ids)))
+        self.m = len(don_ids)
+
+    def row(self, rid, assigned, val, status, don_ids):
+        if assigned == -1:
+            self.out.write(f'{csv_field(rid)}{"," * self.m}\r\n')
+        else:
+            self.out.write(f'{csv_field(rid)}{"," * (assigned + 1)}{val:.6f}'
+                           f'{"," * (self.m - assigned - 1)}\r\n')
+
+
+class AssignmentCsvSink(_Sink):
+    """recipient,assigned_donor,similarity rows, empty cells when unmatched."""
+
+    def begin(self, don_ids):
+        self.out.write('recipient,assigned_donor,similarity\r\n')
+
+    def row(self, rid, assigned, val, status, don_ids):
+        if assigned == -1:
+            self.out.write(f'{csv_field(rid)},,\r\n')
+        else:
+            self.out.write(f'{csv_field(rid)},{csv_field(don_ids[assigned])},{val:.6f}\r\n')
+
+
+class NdjsonSink(_Sink):
+    """One JSON object per line: recipient, donor, similarity, status."""
+
+    def row(self, rid, assigned, val, status, don_ids):
+        record = {'recipient': rid,
+                  'donor': don_ids[assigned] if assigned != -1 else None,
+                  'similarity': round(float(val), 6) if val is not None else None,
+                  'status': status}
+        self.out.write(json.dumps(record) + '\n')
+
+
+class MatrixHtmlSink(_Sink):
+    """The full recipients x donors HTML table."""
+
+    def begin(self, don_ids):
+        self.out.write(HTML_HEAD)
+        self.out.write('<h2>HLA Similarity Matrix</h2><table>\n')
+        self.out.write('<tr><th>Recipient / Donor</th>')
+        self.out.write(''.join(f'<th>{d}</th>' for d in don_ids))
+        self.out.write('</tr>\n')
+        self.m = len(don_ids)
+
+    def row(self, rid, assigned, val, status, don_ids):
+        if assigned == -1:
+            self.out.write(f'<tr class="badrow"><th>{rid}</th>{"<td></td>" * self.m}</tr>\n')
+        else:
+            self.out.write(f'<tr><th>{rid}</th>{"<td></td>" * assigned}'
+                           f'<td class="good">{val:.4f}</td>'
+                           f'{"<td></td>" * (self.m - assigned - 1)}</tr>\n')
+
+    def end(self):
+        self.out.write('</table>\n</body></html>')
+
+
+class SparseHtmlSink(_Sink):
+    """Compact HTML: one row per recipient with its donor, no empty donor columns."""
+
+    def begin(self, don_ids):
+        self.out.write(HTML_HEAD)
+        self.out.write(f'<h2>HLA Matching ({len(don_ids)} donors)</h2><table>\n')
+        self.out.write('<tr><th>Recipient</th><th>Assigned Donor</th><th>Similarity</th>'
+                       '<th>Status</th></tr>\n')
+
+    def row(self, rid, assigned, val, status, don_ids):
+        if assigned == -1:
+            shown = f'{val:.4f}' if val is not None else ''
+            self.out.write(f'<tr class="badrow"><th>{escape(str(rid))}</th><td></td>'
+                           f'<td>{shown}</td><td>{status}</td></tr>\n')
+        else:
+            self.out.write(f'<tr><th>{escape(str(rid))}</th>'
+                           f'<td>{escape(str(don_ids[assigned]))}</td>'
+                           f'<td class="good">{val:.4f}</td><td>{status}</td></tr>\n')
+
+    def end(self):
+        self.out.write('</table>\n</body></html>')
+
+
+class JsonDocumentSink(_Sink):
+    """``{"result": ..., "csv_matrix": ..., "csv_assignment": ...}`` document.
+
+    Both CSVs are JSON-escaped row by row into spooled temporary files, so
+    the document can be copied out after the other sinks (`copy_to`).
+    """
+
+    def __init__(self, result: list):
+        super().__init__(None)
+        self.result = result
+        self.matrix = MatrixCsvSink()
+        self.assignment = AssignmentCsvSink()
+
+    def _open_target(self):
+        return tempfile.SpooledTemporaryFile(SPOOL_SIZE, mode='w+', newline='',
+                                               encoding='utf-8')
+
+    def open(self):
+        self.matrix.out = self._open_target()
+        self.assignment.out = self._open_target()
+
+    def begin(self, don_ids):
+        self.matrix.begin(don_ids)
+        self.assignment.begin(don_ids)
+
+    def row(self, rid, assigned, val, status, don_ids):
+        self.matrix.row(rid, assigned, val, status, don_ids)
+        self.assignment.row(rid, assigned, val, status, don_ids)
+
+    def copy_to(self, out):
+        """Write the document (and a newline) to `out`."""
+        out.write('{"result": ' + json.dumps(self.result) + ', "csv_matrix": "')
+        for key, part in (('csv_assignment', self.matrix.out), (None, self.assignment.out)):
+            part.seek(0)
+            while True:
+                chunk = part.read(1 << 16)
+                if not chunk:
+                    break
+                # Escaping is per character, so chunks escape like the whole string
+                out.write(json.dumps(chunk)[1:-1])
+            out.write(f'", "{key}": "' if key else '"}\n')
+
+    def close(self):
+        for part in (self.matrix, self.assignment):
+            if part.out is not None:
+                part.out.close()
+                part.out = None
+
+
+def write_outputs(rec_ids: list, don_ids: list, sim, result: list, min_accept: float,
+                  sinks: list):
+    """Walk the assignment once and stream every row to all sinks.
+
+    Sinks are opened before the walk and closed after it, also on errors;
+    a JsonDocumentSink is left open for `copy_to` and closed by the caller.
+    """
+    opened = []
+    try:
+        for sink in sinks:
+            sink.open()
+            opened.append(sink)
+        for sink in sinks:
+            sink.begin(don_ids)
+        for _, rid, assigned, val, status in assignment_rows(rec_ids, don_ids, sim, result,
+                                                               min_accept):
+            for sink in sinks:
+                sink.row(rid, assigned, val, status, don_ids)
+        for sink in sinks:
+            sink.end()
+    finally:
+        for sink in opened:
+            if not isinstance(sink, JsonDocumentSink):
+                sink.close()
+
+
+def copy_json(sink: JsonDocumentSink, out=None):
+    """Copy a JsonDocumentSink to out (stdout) and release its spool files."""
+    try:
+        sink.copy_to(out or sys.stdout)
+    finally:
+        sink.close()
@@ -0,0 +1,132 @@
+"""Parallel similarity matrix construction.
+
+Recipients are split into row blocks that are scored concurrently. With the
+process backend every worker attaches to one `multiprocessing.shared_memory`
+float64 matrix and writes its block in place, so nothing but block bounds
+travels back to the parent. The thread backend writes into a plain ndarray
+and is the default on free-threaded Python (3.13t) where threads run in
+parallel.
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+from encoding import encode_populations
+from score_tables import (DEFAULT_PARAMS, normalize_scores, recipient_max_scores, score_encoded,
+                          tables_for)
+
+
+BACKENDS = ('auto', 'process', 'thread')
+
+# State installed once per worker process by _init_worker
+_WORKER = {}
+
+
+def gil_enabled() -> bool:
+    """False only on a free-threaded interpreter running without the GIL."""
+    check = getattr(sys, '_is_gil_enabled', None)
+    return check() if check else True
+
+
+def _score_block(state: dict, out: np.ndarray, start: int, stop: int):
+    """Score recipients[start:stop] against all donors into out[start:stop]."""
+    rec = {key: value[start:stop] for key, value in state['rec'].items()}
+    total = score_encoded(rec, state['don'], state['vocab'], state['params'])
+    out[start:stop] = normalize_scores(total, state['max_s'][start:stop])
+
+
+def _attach(shm_name: str) -> shared_memory.SharedMemory:
+    """Attach an existing segment without taking ownership of it.
+
+    The parent unlinks the segment. Python 3.13+ attaches without registering
+    it with the resource tracker. Before that, workers (fork, spawn and
+    forkserver alike) inherit the parent's tracker, which has the segment
+    registered already: registering it again adds nothing, and unregistering it
+    here would drop the parent's leak protection (and make its unlink fail in
+    the tracker), so the registration is left alone.
+    """
+    options = {'track': False} if sys.version_info >= (3, 13) else {}
+    return shared_memory.SharedMemory(name=shm_name, **options)
+
+
+def _init_worker(shm_name: str, shape: tuple, state: dict):
+    """Attach the shared output matrix in a worker process."""
+    shm = _attach(shm_name)
+    _WORKER['shm'] = shm
+    _WORKER['out'] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _WORKER['state'] = state
+    # Warm the score table cache once per worker
+    tables_for(state['vocab'], state['params'])
+
+
+def _process_block(bounds: tuple) -> tuple:
+    """Process pool task, returns only the bounds it filled."""
+    _score_block(_WORKER['state'], _WORKER['out'], *bounds)
+    return bounds
+
+
+def row_blocks(n: int, workers: int, per_worker: int = 4) -> list:
+    """Split n rows into about workers * per_worker contiguous blocks.
+
+    >>> row_blocks(10, 2, per_worker=2)
+    [(0, 3), (3, 6), (6, 9), (9, 10)]
+    """
+    size = max(1, -(-n // (workers * per_worker)))
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+
+def build_similarity_parallel(recipients: list, donors: list, workers: int = None,
+                              backend: str = 'auto',
+                              params: tuple = DEFAULT_PARAMS) -> np.ndarray:
+    """
+    Build the similarity matrix with a pool of workers.
+
+    Args:
+        recipients: List of lists of allele strings.
+        donors: List of lists of allele strings, or a pool_cache.load_pool pool.
+        workers: Pool size, None means CPU count.
+        backend: 'process' (shared memory), 'thread', or 'auto' which picks
+            threads only when the GIL is disabled.
+        params: Scoring parameters, see score_tables.scoring_params.
+
+    Returns:
+        np.ndarray: (N, M) float64 matrix, same values as build_similarity_array.
+        The process backend copies it out of the shared segment before
+        unlinking it, so its peak memory is twice the matrix.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}')
+    workers = workers or os.cpu_count() or 1
+    if backend == 'auto':
+        backend = 'process' if gil_enabled() else 'thread'
+
+    rec, don, vocab = encode_populations(recipients, donors)
+    state = {
+        'rec': rec,
+        'don': {'allele': np.asarray(don['allele'])},
+        'vocab': vocab,
+        'params': params,
+        'max_s': np.array(recipient_max_scores(recipients, params))[:, None],
+    }
+    shape = (len(recipients), len(don['allele']))
+    blocks = row_blocks(shape[0], workers)
+
+    if backend == 'thread':
+        out = np.empty(shape)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda b: _score_block(state, out, *b), blocks))
+        return out
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1] * 8))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shm.name, shape, state)) as pool:
+            list(pool.map(_process_block, blocks))
+        # The segment is unlinked below, the result must own its memory
+        return np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
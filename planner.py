@@ -0,0 +1,222 @@
+"""Execution planner: representation and solver from problem size and memory.
+
+`plan_run` picks how main.py builds and solves a run (``--engine auto``):
+
+- ``'dense-list'``: build_similarity_matrix lists, dense cost lists, `match`
+- ``'sparse-edges'``: build_similarity_matrix lists, CSR edges of the
+  acceptable pairs, matching_sparse
+- ``'ndarray'``: cost_buffer.build_cost_buffer (uint16 cost, bool mask),
+  solved by cost_buffer.match_buffer
+- ``'memmap-tiles'``: tiled_builder.build_tiled_buffer, the same buffers in
+  memory-mapped files, for runs that do not fit in memory
+
+The solver is ``'sparse'`` when few pairs are acceptable (the feasible-edge
+density is estimated by scoring a random sample of pairs) and ``'jv'``
+otherwise. The buffers are both faster and smaller than the list pipeline,
+which is only planned for the options that need it (``--dedup``,
+``--prune``, ``--decompose``). Memory estimates are peak resident bytes
+measured on the pipelines; the budget is ``--max-memory`` or a fraction of
+the memory available to the process (cgroup limit included).
+"""
+
+import os
+
+import numpy as np
+
+from cost_buffer import BLOCK_CELLS, COST_DTYPE, similarity_to_cost
+from matrix_builder import build_similarity_array
+from tiled_builder import CELL_BYTES, RAM_BUDGET
+
+REPRESENTATIONS = ('dense-list', 'sparse-edges', 'ndarray', 'memmap-tiles')
+# Peak bytes per recipient-donor pair of the list pipeline: similarity floats, cost lists
+LIST_CELL_BYTES = 64
+# Similarity floats alone, when the sparse solver takes edges straight from them
+SIMILARITY_CELL_BYTES = 48
+# uint16 cost and bool mask
+BUFFER_CELL_BYTES = 3
+# Acceptable pair held by the sparse solver: CSR arrays and their Python lists
+EDGE_BYTES = 48
+# Interpreter, numpy and the input populations
+BASE_BYTES = 64 << 20
+# Smallest tile budget worth planning
+MIN_TILE_BYTES = 16 << 20
+# Feasible-edge density up to which the sparse solver beats jv
+SPARSE_DENSITY = 0.05
+# Part of the available memory a run plans for
+MEMORY_FRACTION = 0.8
+# Pairs scored to estimate the density
+SAMPLE_ROWS = 64
+SAMPLE_COLS = 2048
+
+
+def available_memory() -> int:
+    """Bytes of memory available to this process, None if unknown.
+
+    MemAvailable of /proc/meminfo, capped by the free part of a cgroup v2
+    memory limit (containers); physical free pages elsewhere.
+    """
+    available = None
+    try:
+        with open('/proc/meminfo', encoding='ascii') as fh:
+            for line in fh:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        try:
+            available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            return None
+    try:
+        with open('/sys/fs/cgroup/memory.max', encoding='ascii') as fh:
+            limit = fh.read().strip()
+        with open('/sys/fs/cgroup/memory.current', encoding='ascii') as fh:
+            current = int(fh.read())
+        if limit != 'max':
+            free = max(0, int(limit) - current)
+            available = free if available is None else min(available, free)
+    except (OSError, ValueError):
+        pass
+    return available
+
+
+def cpu_count() -> int:
+    """CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def sample_density(recipients: list, donors, min_accept: float = 60,
+                   rows: int = SAMPLE_ROWS, cols: int = SAMPLE_COLS, seed: int = 0) -> float:
+    """Share of acceptable pairs among a random sample of recipients x donors.
+
+    Args:
+        recipients: List of lists of allele strings.
+        donors: List of lists of allele strings, or a pool_cache.load_pool pool.
+        min_accept: Minimum accepted similarity percentage.
+        rows: Sampled recipients.
+        cols: Sampled donors.
+        seed: Seed of the sample.
+
+    Returns:
+        float: Estimated feasible-edge density between 0.0 and 1.0.
+    """
+    pool = isinstance(donors, dict)
+    m = len(donors['allele']) if pool else len(donors)
+    if not recipients or not m:
+        return 0.0
+    rng = np.random.default_rng(seed)
+    rec_idx = np.sort(rng.choice(len(recipients), min(rows, len(recipients)), replace=False))
+    don_idx = np.sort(rng.choice(m, min(cols, m), replace=False))
+    sample_dons = dict(donors, allele=donors['allele'][don_idx]) if pool \
+        else [donors[j] for j in don_idx.tolist()]
+    sim = build_similarity_array([recipients[i] for i in rec_idx.tolist()], sample_dons)
+    cost = np.empty(sim.shape, dtype=COST_DTYPE)
+    feasible = np.empty(sim.shape, dtype=bool)
+    similarity_to_cost(sim, cost, feasible, min_accept)
+    return float(feasible.mean())
+
+
+def estimate_bytes(representation: str, engine: str, n: int, m: int, edges: float,
+                   ram_budget: int = RAM_BUDGET) -> int:
+    """Peak resident bytes of a run.
+
+    >>> estimate_bytes('ndarray', 'jv', 1000, 10000, 0) >> 20
+    188
+    """
+    cells = n * m
+    solver = edges * EDGE_BYTES if engine == 'sparse' else 0
+    if representation == 'dense-list':
+        data = cells * LIST_CELL_BYTES
+    elif representation == 'sparse-edges':
+        data = cells * SIMILARITY_CELL_BYTES
+    elif representation == 'ndarray':
+        # Plus one block of float64 similarities and their scoring temporaries
+        data = cells * BUFFER_CELL_BYTES + min(cells, BLOCK_CELLS) * CELL_BYTES
+    else:
+        data = ram_budget
+    return int(BASE_BYTES + data + solver)
+
+
+def plan_run(n: int, m: int, density: float, max_memory: int = None, cpus: int = None,
+             list_options: bool = False, representation: str = None) -> dict:
+    """
+    Representation and solver for an n recipients x m donors run.
+
+    Args:
+        n: Recipients.
+        m: Donors.
+        density: Estimated share of acceptable pairs, see sample_density.
+        max_memory: Memory budget in bytes (default: MEMORY_FRACTION of
+            available_memory, unlimited if unknown).
+        cpus: CPUs to plan for (default: cpu_count).
+        list_options: Options of the list pipeline were asked for (dedup,
+            prune, decompose); planned when the lists fit.
+        representation: Keep this representation, only plan the rest.
+
+    Returns:
+        dict: ``'representation'``, ``'engine'``, ``'workers'`` (similarity
+        builder and --decompose pool), ``'ram_budget'`` (tile bytes),
+        ``'estimated_bytes'``, ``'memory_budget'``, ``'density'``,
+        ``'edges'`` (estimated acceptable pairs), ``'cpus'`` and ``'reason'``.
+
+    >>> plan = plan_run(500, 20000, 0.01, max_memory=1 << 30, cpus=4)
+    >>> plan['representation'], plan['engine'], plan['workers']
+    ('ndarray', 'sparse', 1)
+    >>> plan_run(50000, 500000, 0.5, max_memory=8 << 30, cpus=4)['representation']
+    'memmap-tiles'
+    """
+    cpus = cpus or cpu_count()
+    if max_memory is None:
+        available = available_memory()
+        max_memory = int(available * MEMORY_FRACTION) if available else None
+    budget = max_memory if max_memory is not None else float('inf')
+    edges = density * n * m
+    engine = 'sparse' if density <= SPARSE_DENSITY else 'jv'
+    reasons = [f'density {density:.2%} {"<=" if engine == "sparse" else ">"} '
+               f'{SPARSE_DENSITY:.0%}: {engine} solver']
+
+    if representation is not None:
+        candidates = [representation]
+    elif list_options:
+        candidates = ['sparse-edges' if engine == 'sparse' else 'dense-list',
+                      'ndarray', 'memmap-tiles']
+    else:
+        candidates = ['ndarray', 'memmap-tiles']
+    ram_budget = RAM_BUDGET
+    for representation in candidates:
+        if representation == 'memmap-tiles':
+            if engine == 'sparse' and estimate_bytes(representation, engine, n, m, edges,
+                                                     MIN_TILE_BYTES) > budget:
+                # The edges alone do not fit, jv only keeps O(n + m) state
+                engine = 'jv'
+                reasons.append('edges do not fit: jv solver')
+            spare = budget - estimate_bytes(representation, engine, n, m, edges, 0)
+            ram_budget = int(max(MIN_TILE_BYTES, min(RAM_BUDGET, spare)))
+        estimated = estimate_bytes(representation, engine, n, m, edges, ram_budget)
+        if estimated <= budget or representation == candidates[-1]:
+            break
+        reasons.append(f'{representation} needs {format_bytes(estimated)}')
+    limit = format_bytes(max_memory) if max_memory is not None else 'unknown'
+    reasons.append(f'{representation} needs {format_bytes(estimated)} of {limit}')
+    # Only the list pipeline builds similarities (and --decompose components) in parallel
+    workers = cpus if representation in ('dense-list', 'sparse-edges') else 1
+    return {'representation': representation, 'engine': engine, 'workers': workers,
+            'ram_budget': ram_budget, 'estimated_bytes': estimated, 'memory_budget': max_memory,
+            'density': density, 'edges': int(edges), 'cpus': cpus, 'reason': '; '.join(reasons)}
+
+
+def format_bytes(size: float) -> str:
+    """Human readable size.
+
+    >>> format_bytes(3 << 29), format_bytes(1000)
+    ('1.5 GiB', '1000 B')
+    """
+    if size < 1024:
+        return f'{size:.0f} B'
+    for unit in ('KiB', 'MiB', 'GiB', 'TiB'):
+        size /= 1024
+        if size < 1024 or unit == 'TiB':
+            break
+    return f'{size:.1f} {unit}'
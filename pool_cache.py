@@ -0,0 +1,211 @@
+"""Compiled donor pool cache.
+
+Parsing and interning the donor CSV dominates start-up when the same pool
+is matched against changing recipient lists. `load_pool` compiles the CSV
+once into a cache directory next to it (``donors.csv.pool/``):
+
+- ``alleles.<hash>.npy``: (M, L) int32 donor allele codes, as `encoding.encode_donors`
+- ``ids.<hash>.npy``: donor ids as a fixed-width unicode array
+- ``meta.json``: format version, source size/mtime/SHA-256, the vocabulary and
+  the names of the two arrays
+
+Both arrays are opened with ``np.load(mmap_mode='r')``: a warm start only maps
+the files and concurrent runs share one copy in the page cache. The cache is
+rebuilt when the CSV content hash no longer matches. Array names carry the
+source hash and meta.json is swapped in last, so a run never maps arrays of
+another build than the vocabulary it read.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+
+from encoding import new_vocabulary, intern_locus, intern_allele
+from ingest import read_people_columnar
+
+
+POOL_FORMAT = 2
+CACHE_SUFFIX = '.pool'
+# Tries of load_pool when concurrent rebuilds remove the arrays it was about to map
+LOAD_ATTEMPTS = 3
+
+
+def default_cache_dir(csv_path: str) -> str:
+    """Cache directory used for `csv_path` when none is given."""
+    return csv_path + CACHE_SUFFIX
+
+
+def file_sha256(path: str, chunk: int = 1 << 20) -> str:
+    """Hex SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(chunk), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stat(path: str) -> dict:
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _replace(path: str, write):
+    """Write through a temporary file then rename, so readers never see a partial file."""
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fh:
+        write(fh)
+    os.replace(tmp, path)
+
+
+def _write_meta(cache_dir: str, meta: dict):
+    _replace(os.path.join(cache_dir, 'meta.json'),
+             lambda fh: fh.write(json.dumps(meta).encode('utf-8')))
+
+
+def _read_meta(cache_dir: str):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json'), encoding='utf-8') as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(meta: dict, csv_path: str, cache_dir: str) -> bool:
+    """True if `meta` describes the current content of `csv_path`.
+
+    Size and mtime are compared first; the file is only hashed when they
+    differ, and a touched but unchanged file just refreshes the stored stat.
+    """
+    if not meta or meta.get('format') != POOL_FORMAT:
+        return False
+    stat = _source_stat(csv_path)
+    if all(meta['source'].get(key) == value for key, value in stat.items()):
+        return True
+    if meta['source'].get('sha256') != file_sha256(csv_path):
+        return False
+    meta['source'].update(stat)
+    _write_meta(cache_dir, meta)
+    return True
+
+
+def donor_alleles(columns: dict, chunk: int = 65536) -> np.ndarray:
+    """(M, L) int32 last allele per locus from `ingest.read_people_columnar` columns.
+
+    >>> import array
+    >>> donor_alleles({'offsets': array.array('q', [0, 3, 4]),
+    ...                'locus': array.array('i', [0, 1, 0, 1]),
+    ...                'allele': array.array('i', [0, 0, 1, 2]),
+    ...                'vocab': {'names': ['A', 'B']}}).tolist()
+    [[1, 0], [-1, 2]]
+    """
+    offsets = np.frombuffer(columns['offsets'], dtype=np.int64)
+    loci = np.frombuffer(columns['locus'], dtype=np.int32)
+    codes = np.frombuffer(columns['allele'], dtype=np.int32)
+    n_loci = len(columns['vocab']['names'])
+    n = len(offsets) - 1
+    out = np.full((n, n_loci), -1, dtype=np.int32)
+    # Donors are done in chunks to bound the temporary index arrays
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        lo, hi = offsets[start], offsets[stop]
+        rows = np.repeat(np.arange(start, stop), np.diff(offsets[start:stop + 1]))
+        flat = rows * n_loci + loci[lo:hi]
+        # Keep the last allele listed per (donor, locus), like the scalar builder
+        _, first_rev = np.unique(flat[::-1], return_index=True)
+        last = len(flat) - 1 - first_rev
+        out.reshape(-1)[flat[last]] = codes[lo:hi][last]
+    return out
+
+
+def array_names(sha: str) -> dict:
+    """File names of the arrays compiled from a source with SHA-256 `sha`.
+
+    >>> array_names('0123456789abcdef0123')
+    {'allele': 'alleles.0123456789abcdef.npy', 'ids': 'ids.0123456789abcdef.npy'}
+    """
+    return {'allele': f'alleles.{sha[:16]}.npy', 'ids': f'ids.{sha[:16]}.npy'}
+
+
+def _remove_stale(cache_dir: str, keep: dict):
+    """Delete arrays of earlier builds; runs that mapped them keep their mapping."""
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npy') and name not in keep.values():
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
+
+
+def build_pool(csv_path: str, cache_dir: str = None) -> dict:
+    """Parse `csv_path` and write its compiled pool to `cache_dir`."""
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    stat = _source_stat(csv_path)
+    sha = file_sha256(csv_path)
+    columns = read_people_columnar(csv_path)
+    vocab = columns['vocab']
+    names = array_names(sha)
+
+    _replace(os.path.join(cache_dir, names['allele']),
+             lambda fh: np.save(fh, donor_alleles(columns)))
+    _replace(os.path.join(cache_dir, names['ids']),
+             lambda fh: np.save(fh, np.array(columns['ids'], dtype=str)))
+    # meta.json goes last, it is what marks the cache as complete
+    _write_meta(cache_dir, {
+        'format': POOL_FORMAT,
+        'source': dict(stat, sha256=sha),
+        'arrays': names,
+        'loci': vocab['names'],
+        'alleles': [list(alleles) for alleles in vocab['alleles']],
+    })
+    _remove_stale(cache_dir, names)
+    return cache_dir
+
+
+def vocabulary_from_meta(meta: dict) -> dict:
+    """Rebuild the encoding vocabulary stored in a pool, with the same codes."""
+    vocab = new_vocabulary()
+    for name in meta['loci']:
+        intern_locus(vocab, name)
+    for alleles in meta['alleles']:
+        for allele in alleles:
+            intern_allele(vocab, allele)
+    return vocab
+
+
+def _open_pool(csv_path: str, cache_dir: str, meta: dict) -> dict:
+    """Map the build `meta` describes, compiling the pool first if it is stale."""
+    if not is_fresh(meta, csv_path, cache_dir):
+        build_pool(csv_path, cache_dir)
+        meta = _read_meta(cache_dir)
+    # Array names carry the source hash: they always hold the build of this meta
+    arrays = {key: os.path.join(cache_dir, name) for key, name in meta['arrays'].items()}
+    ids = np.load(arrays['ids'], mmap_mode='r')
+    alleles = np.load(arrays['allele'], mmap_mode='r')
+    return {'ids': ids, 'allele': alleles, 'vocab': vocabulary_from_meta(meta)}
+
+
+def load_pool(csv_path: str, cache_dir: str = None, rebuild: bool = False) -> dict:
+    """
+    Open the compiled donor pool of `csv_path`, compiling it first if missing or stale.
+
+    Args:
+        csv_path: Donor CSV file.
+        cache_dir: Cache directory, defaults to `csv_path` + '.pool'.
+        rebuild: Recompile even if the cache is fresh.
+
+    Returns:
+        dict: ``'ids'`` (unicode ndarray), ``'allele'`` ((M, L) int32 ndarray)
+        and ``'vocab'``. Both arrays are read-only memory maps. The dict is
+        accepted as `donors` by matrix_builder.build_similarity_matrix.
+    """
+    cache_dir = cache_dir or default_cache_dir(csv_path)
+    meta = None if rebuild else _read_meta(cache_dir)
+    for _ in range(LOAD_ATTEMPTS - 1):
+        try:
+            return _open_pool(csv_path, cache_dir, meta)
+        except FileNotFoundError:
+            # A concurrent rebuild removed the arrays meta named, read its meta.json
+            meta = _read_meta(cache_dir)
+    return _open_pool(csv_path, cache_dir, meta)
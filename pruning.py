@@ -0,0 +1,115 @@
+"""Upper-bound pruning of pairs that cannot reach the acceptance threshold.
+
+Most recipient-donor pairs end up as INF after `remove_not_accepted`, yet
+`build_similarity_matrix` scores every one of them. Here every pair first
+gets a cheap upper bound on its raw score, per recipient slot:
+
+- 0 if the donor is not typed at the slot's locus
+- `locus_only_points` if the donor shares no allele group with the slot
+- the best of the full / two-field / serotype points inside the group
+
+(times the locus weight). The bound is built from the typed-loci baseline
+and the allele group postings of `allele_index`, so it costs one pass over
+the donors plus the group postings. Pairs whose bound cannot reach
+`min_accept` are skipped; only the rest is scored exactly.
+"""
+
+from typing import List
+import numpy as np
+
+from allele_index import build_index, _posting
+from encoding import encode_queries
+from matrix_builder import recipient_max_scores, score_encoded, normalize_scores
+from score_tables import DEFAULT_PARAMS
+
+
+def upper_bounds(index: dict, alleles: List[str], params: tuple = DEFAULT_PARAMS) -> tuple:
+    """
+    Upper bound of the raw pair score of one recipient against every donor.
+
+    The recipient is encoded with encoding.encode_queries, so the index (and
+    a pool it was built from) keeps its vocabulary.
+
+    Returns:
+        tuple: ((M,) float64 bounds, recipient codes as encoding.encode_recipients,
+        the vocabulary of those codes).
+    """
+    full, two_pts, sero, locus_only, weights = params
+    weights = dict(weights)
+    in_group = max(full, two_pts, sero)
+    rec, vocab = encode_queries([list(alleles)], index['vocab'])
+    n_loci = index['allele'].shape[1]
+    typed = index['typed']
+    codes = zip(rec['locus'][0].tolist(), rec['allele'][0].tolist())
+
+    baseline = np.zeros(len(typed))
+    groups = []
+    for locus_id, allele_id in codes:
+        if allele_id < 0 or locus_id >= n_loci:
+            continue
+        weight = float(weights.get(vocab['names'][locus_id], 0.8))
+        first = vocab['first'][locus_id][allele_id]
+        if first < 0:
+            # Without fields only an identical string can score above locus-only
+            baseline += max(full, locus_only) * weight * typed[:, locus_id]
+            continue
+        baseline += locus_only * weight * typed[:, locus_id]
+        if in_group > locus_only:
+            groups.append((locus_id, first, (in_group - locus_only) * weight))
+
+    bounds = baseline[index['typed_index']]
+    for locus_id, first, extra in groups:
+        donors = _posting(index['postings'][locus_id], 'first', first)
+        if len(donors):
+            bounds[donors] += extra
+    return bounds, rec, vocab
+
+
+def reachable(bounds: np.ndarray, max_s: float, min_accept: float) -> np.ndarray:
+    """
+    Mask of donors whose bound may still pass remove_not_accepted.
+
+    The cost is int(round(1 - similarity, 2) * 100), which is at least
+    (1 - similarity) * 100 - 0.5 truncated, so pruning only keeps a safe
+    margin of 1.5 points below the threshold.
+
+    >>> reachable(np.array([2.0, 1.0, 1.5]), 2.0, 60).tolist()
+    [True, False, True]
+    """
+    limit = 100 - int(min_accept)
+    if max_s <= 0:
+        return np.full(len(bounds), 100 <= limit)
+    sim = np.clip(bounds / max_s, 0.0, 1.0)
+    return (1 - sim) < (limit + 1.5) / 100 + 1e-9
+
+
+def build_similarity_pruned(recipients: list, donors, min_accept: float = 60,
+                            params: tuple = DEFAULT_PARAMS) -> tuple:
+    """
+    Similarity matrix where only pairs that can reach min_accept are scored.
+
+    Pruned cells hold 0.0, which is below any threshold that prunes them, so
+    convert_similarity + remove_not_accepted give the same cost matrix as for
+    build_similarity_matrix.
+
+    Args:
+        recipients: List of lists of allele strings.
+        donors: List of lists of allele strings, or a pool_cache.load_pool pool.
+        min_accept: Minimum accepted similarity percentage.
+        params: Scoring parameters, see score_tables.scoring_params.
+
+    Returns:
+        tuple: ((N, M) float64 similarity ndarray, number of pruned pairs).
+    """
+    index = build_index(donors)
+    sim = np.zeros((len(recipients), len(index['allele'])))
+    max_scores = recipient_max_scores(recipients, params)
+    pruned = 0
+    for i, alleles in enumerate(recipients):
+        bounds, rec, vocab = upper_bounds(index, alleles, params)
+        keep = np.flatnonzero(reachable(bounds, max_scores[i], min_accept))
+        pruned += len(bounds) - len(keep)
+        if len(keep):
+            total = score_encoded(rec, {'allele': index['allele'][keep]}, vocab, params)
+            sim[i, keep] = normalize_scores(total, np.array([[max_scores[i]]]))[0]
+    return sim, pruned
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""Resident matching service.
+
+The donor pool is loaded and encoded once; recipient batches are then matched
+against it over a small HTTP/1.1 JSON API (TCP or Unix socket), without paying
+for interpreter start-up and CSV parsing on every request.
+
+Usage:
+python service.py donors.csv --port 8080 --workers 4
+python service.py donors.csv --unix /tmp/hla.sock --pool-cache
+
+Endpoints:
+- ``GET /health``: ``{"status": "ok", "donors": M}``
+- ``POST /match``: ``{"recipients": [{"id": "R1", "alleles": ["A*01:01", ...]}, ...],
+  "min_accept": 60}``, answers ``{"result": [...], "matches": [...]}``
+
+Every request is its own assignment problem against the whole pool. Requests that
+arrive together are scored in one vectorized similarity build, then every
+request is solved by the sparse engine in a process pool, so the event loop
+never blocks on scoring or solving.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+
+from ingest import read_people_columnar
+from pool_cache import load_pool, donor_alleles
+from matrix_builder import build_similarity_array
+from matching_sparse import edges_from_array, sparse_assignment
+from score_tables import DEFAULT_PARAMS
+
+# Largest request body accepted, in bytes
+MAX_BODY = 16 * 1024 * 1024
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large'}
+
+
+def load_donors(path: str, pool_cache: bool = False) -> dict:
+    '''
+    Donor pool encoded once, in the pool_cache.load_pool layout
+
+    :param path: donor CSV file
+    :type path: str
+    :param pool_cache: open (or compile) the memory-mapped pool next to the CSV
+    :type pool_cache: bool
+    :return: dict with 'ids', 'allele' and 'vocab'
+    :rtype: dict
+    '''
+    if pool_cache:
+        return load_pool(path)
+    columns = read_people_columnar(path)
+    return {'ids': np.array(columns['ids'], dtype=str), 'allele': donor_alleles(columns),
+            'vocab': columns['vocab']}
+
+
+def parse_recipients(payload) -> tuple:
+    '''
+    Recipient ids and typings of a /match request body
+
+    >>> parse_recipients({'recipients': [{'id': 'R1', 'alleles': ['A*01:01']}, ['B*08:01']]})
+    (['R1', '1'], [['A*01:01'], ['B*08:01']])
+    '''
+    if not isinstance(payload, dict) or not isinstance(payload.get('recipients'), list):
+        raise ValueError("Expected an object with a 'recipients' list")
+    ids, typings = [], []
+    for k, rec in enumerate(payload['recipients']):
+        if isinstance(rec, dict):
+            rid, alleles = rec.get('id', str(k)), rec.get('alleles')
+        else:
+            rid, alleles = str(k), rec
+        if not isinstance(alleles, list) or not all(isinstance(a, str) for a in alleles):
+            raise ValueError(f'Recipient {rid}: alleles must be a list of strings')
+        ids.append(str(rid))
+        typings.append([a.strip() for a in alleles if a.strip()])
+    return ids, typings
+
+
+def solve(edges: tuple) -> list:
+    '''Process pool task: sparse assignment of one request.'''
+    return sparse_assignment(*edges)[0]
+
+
+class MatchingService:
+    '''
+    Batches /match requests and runs them against the resident donor pool
+    '''
+
+    def __init__(self, pool: dict, min_accept: float = 60, workers: int = None,
+                 batch_window: float = 0.002, max_batch: int = 256,
+                 params: tuple = DEFAULT_PARAMS):
+        '''
+        :param pool: encoded donors, see load_donors
+        :param min_accept: default minimum accepted similarity percentage
+        :param workers: solver processes, None means CPU count, 0 solves in threads
+        :param batch_window: seconds to wait for more requests once one arrived
+        :param max_batch: most recipients scored in one batch
+        :param params: scoring parameters, see score_tables.scoring_params
+        '''
+        self.pool = pool
+        self.don_ids = pool['ids'].tolist()
+        self.min_accept = min_accept
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.params = params
+        # One scoring thread, so batches are scored in arrival order
+        self.scorer = ThreadPoolExecutor(max_workers=1)
+        if workers == 0:
+            self.solvers = ThreadPoolExecutor()
+        else:
+            self.solvers = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self.queue = None
+        self._tasks = set()
+
+    def close(self):
+        '''Shut the executors down.'''
+        self.scorer.shutdown()
+        self.solvers.shutdown()
+
+    async def submit(self, typings: list, min_accept: float) -> tuple:
+        '''
+        Queue one request and wait for (assignment, similarity rows)
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((typings, min_accept, future))
+        return await future
+
+    async def run_batches(self):
+        '''
+        Collects requests arriving within batch_window and scores them together
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.batch_window
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            try:
+                parts = await loop.run_in_executor(self.scorer, self._score, batch)
+            except Exception as e: # pylint: disable=broad-except
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), (sim, edges) in zip(batch, parts):
+                task = loop.create_task(self._solve(future, sim, edges))
+                # Keep a reference until done, the loop only holds weak ones
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    def _score(self, batch: list) -> list:
+        '''Scoring thread: one similarity build for the batch, CSR edges per request.'''
+        typings = [t for item in batch for t in item[0]]
+        if typings and self.don_ids:
+            sim = build_similarity_array(typings, self.pool, params=self.params)
+        else:
+            sim = np.zeros((len(typings), len(self.don_ids)))
+        parts, start = [], 0
+        for rec, min_accept, _ in batch:
+            rows = sim[start:start + len(rec)]
+            start += len(rec)
+            parts.append((rows, edges_from_array(rows, min_accept=int(min_accept))))
+        return parts
+
+    async def _solve(self, future, sim: np.ndarray, edges: tuple):
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.solvers, solve, edges)
+        except Exception as e: # pylint: disable=broad-except
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result((result, sim))
+
+    async def match(self, payload) -> dict:
+        '''
+        Answer of POST /match
+        '''
+        rec_ids, typings = parse_recipients(payload)
+        min_accept = float(payload.get('min_accept', self.min_accept))
+        if not typings:
+            return {'result': [], 'matches': []}
+        result, sim = await self.submit(typings, min_accept)
+        matches = []
+        for i, rid in enumerate(rec_ids):
+            j = result[i]
+            matches.append({'recipient': rid,
+                            'donor': self.don_ids[j] if j != -1 else None,
+                            'similarity': float(sim[i, j]) if j != -1 else None})
+        return {'result': result, 'matches': matches}
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> tuple:
+        '''
+        (status, payload) for one HTTP request
+        '''
+        if path == '/health':
+            return 200, {'status': 'ok', 'donors': len(self.don_ids)}
+        if path != '/match':
+            return 404, {'error': f'Unknown path: {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+        try:
+            return 200, await self.match(json.loads(body or b'null'))
+        except (ValueError, TypeError) as e:
+            return 400, {'error': str(e)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''
+        One client connection, HTTP/1.1 with keep-alive
+        '''
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    method, path, version = line.decode('latin-1').split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Malformed request'}, False)
+                    break
+                if length < 0:
+                    await self._respond(writer, 400, {'error': 'Negative Content-Length'}, False)
+                    break
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {'error': 'Body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = headers.get('connection', '').lower() != 'close' \
+                    and version == 'HTTP/1.1'
+                status, payload = await self.dispatch(method, path.split('?')[0], body)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: dict,
+                       keep_alive: bool):
+        data = json.dumps(payload).encode('utf-8')
+        writer.write((f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                      'Content-Type: application/json\r\n'
+                      f'Content-Length: {len(data)}\r\n'
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                      '\r\n').encode('latin-1') + data)
+        await writer.drain()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080, unix: str = None):
+        '''
+        Run the server until SIGTERM or SIGINT
+        '''
+        self.queue = asyncio.Queue()
+        batcher = asyncio.get_running_loop().create_task(self.run_batches())
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, path=unix)
+            where = f'unix:{unix}'
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            host, port = server.sockets[0].getsockname()[:2]
+            where = f'http://{host}:{port}'
+        print(f'Listening on {where} ({len(self.don_ids)} donors)', flush=True)
+        # SIGTERM/SIGINT stop serving, so main() can shut the solver processes down
+        stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                asyncio.get_running_loop().add_signal_handler(sig, stop.set)
+            except (NotImplementedError, AttributeError, RuntimeError):
+                pass
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            batcher.cancel()
+
+
+def main(argv=None):
+    '''
+    Load the donor pool and serve /match until SIGTERM or SIGINT
+
+    :param argv: command line arguments, sys.argv[1:] when None
+    :type argv: list
+    :return: exit status, 1 if the donor file does not exist
+    :rtype: int
+    '''
+    p = argparse.ArgumentParser(description='HLA matching service')
+    p.add_argument('donors', help='CSV file with donors')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8080, help='TCP port (0 picks a free one)')
+    p.add_argument('--unix', help='Serve on this Unix socket path instead of TCP')
+    p.add_argument('--min-accept', type=float, default=60.0, \
+                   help='Default minimum acceptance threshold in percent (default: 60)')
+    p.add_argument('--workers', type=int, default=None, \
+                   help='Solver processes (default: CPU count, 0 solves in threads)')
+    p.add_argument('--batch-window-ms', type=float, default=2.0, \
+                   help='How long to wait for concurrent requests to batch (default: 2)')
+    p.add_argument('--pool-cache', action='store_true', \
+                   help='Load donors from a memory-mapped compiled pool next to the CSV')
+    args = p.parse_args(argv)
+
+    if not os.path.exists(args.donors):
+        print(f'Donor file not found: {args.donors}', file=sys.stderr)
+        return 1
+    service = MatchingService(load_donors(args.donors, args.pool_cache),
+                              min_accept=args.min_accept, workers=args.workers,
+                              batch_window=args.batch_window_ms / 1000)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
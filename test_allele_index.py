@@ -0,0 +1,56 @@
+'''
+Top-k retrieval against a brute-force ranking of the full similarity build
+'''
+import random
+import numpy as np
+import pytest
+
+from allele_index import build_index, top_k
+from benchmarks.population import write_people
+from matrix_builder import build_similarity_array
+from pool_cache import load_pool
+from score_tables import DEFAULT_PARAMS, scoring_params
+
+# Few alleles per locus, so many donors tie
+ALLELES = {'A': ['A*01:01', 'A*01:02', 'A*01:01:02', 'A*02:01', 'A*02:05', 'A*03'],
+           'B': ['B*07:02', 'B*07:02:01', 'B*08:01', 'B*07:05', 'B*44'],
+           'DRB1': ['DRB1*15:01', 'DRB1*15:02', 'DRB1*04:01']}
+PARAMS = [DEFAULT_PARAMS,
+          # Partial matches worth more than a full match: similarities clamp at 1.0
+          scoring_params(full_match_points=1.0, two_field_points=2.5),
+          scoring_params(full_match_points=0.5, two_field_points=0.2)]
+
+
+def random_person(rng: random.Random) -> list:
+    return [rng.choice(names) for names in ALLELES.values() if rng.random() < 0.8]
+
+
+def brute_force(alleles: list, donors: list, k: int, params: tuple) -> list:
+    '''
+    Best k by similarity, ties by donor index
+    '''
+    sim = build_similarity_array([alleles], donors, params=params)[0]
+    order = np.lexsort((np.arange(len(donors)), -sim))[:k]
+    return [(int(j), float(sim[j])) for j in order]
+
+
+@pytest.mark.parametrize('params', PARAMS)
+def test_top_k_equals_brute_force(params):
+    rng = random.Random(7)
+    for _ in range(150):
+        donors = [random_person(rng) for _ in range(rng.randint(1, 40))]
+        alleles = random_person(rng)
+        k = rng.randint(1, 8)
+        assert top_k(build_index(donors), alleles, k, params) \
+            == brute_force(alleles, donors, k, params)
+
+
+def test_unseen_alleles_leave_pool_vocabulary_unchanged(tmp_path):
+    path = str(tmp_path / 'donors.csv')
+    donors = [['A*01:01', 'B*08:01'], ['A*02:01', 'B*07:02']]
+    write_people(path, ['D1', 'D2'], donors)
+    pool = load_pool(path)
+    alleles = ['A*01:99', 'B*08:77', 'DRB1*99:01']
+    assert top_k(build_index(pool), alleles, k=2) == brute_force(alleles, donors, 2, DEFAULT_PARAMS)
+    assert [len(names) for names in pool['vocab']['alleles']] == [2, 2]
+    assert pool['vocab']['names'] == ['A', 'B']
@@ -0,0 +1,36 @@
+'''
+End-to-end checks of the main.py command line on a generated pool
+'''
+import pytest
+from benchmarks.population import generate_population, write_people
+import main
+
+
+@pytest.fixture(name='pool')
+def fixture_pool(tmp_path):
+    '''
+    40 recipients x 80 donors where approx leaves a gap to the optimum
+    '''
+    recipients, donors = tmp_path / 'recipients.csv', tmp_path / 'donors.csv'
+    write_people(str(recipients), *generate_population(40, seed=1, prefix='R'), 'Recipient')
+    write_people(str(donors), *generate_population(80, seed=2))
+    return str(recipients), str(donors)
+
+
+def test_approx_without_verify_is_not_certified(pool, capsys):
+    assert main.main([*pool, '--engine', 'approx']) == 0
+    out = capsys.readouterr().out
+    assert 'Certificate' not in out
+    assert 'Opt. Gap' in out
+
+
+def test_sparse_without_verify_is_not_certified(pool, capsys):
+    assert main.main([*pool, '--engine', 'sparse']) == 0
+    assert 'Certificate' not in capsys.readouterr().out
+
+
+def test_verify_flags_approx_gap(pool, capsys):
+    assert main.main([*pool, '--engine', 'approx', '--verify']) == 3
+    assert 'NOT certified' in capsys.readouterr().out
+    assert main.main([*pool, '--engine', 'sparse', '--verify']) == 0
+    assert 'Certificate:' in capsys.readouterr().out
@@ -0,0 +1,112 @@
+'''
+Cost buffer pipeline against the list pipeline and an optimal reference solver
+'''
+import numpy as np
+import pytest
+
+from benchmarks.population import generate_population, write_people
+from certificate import buffer_cost_rows, verify
+from cost_buffer import COST_DTYPE, build_cost_buffer, match_buffer, similarity_to_cost
+from matching import INF, convert_similarity, remove_not_accepted
+from matrix_builder import build_similarity_matrix
+from pool_cache import load_pool
+from test_engines import CASES, optimal_cost, random_costs, total_cost
+
+THRESHOLDS = (0, 40, 60, 71, 100)
+
+
+def list_costs(sim: list, min_accept: int) -> list:
+    return remove_not_accepted(convert_similarity(sim), min_accept)
+
+
+def buffer_costs(sim, min_accept: int) -> list:
+    '''
+    similarity_to_cost with INF where not feasible, as nested lists
+    '''
+    sim = np.asarray(sim, dtype=np.float64)
+    cost = np.empty(sim.shape, dtype=COST_DTYPE)
+    feasible = np.empty(sim.shape, dtype=bool)
+    similarity_to_cost(sim, cost, feasible, min_accept)
+    return np.where(feasible, cost.astype(np.int64), INF).tolist()
+
+
+def boundary_values() -> list:
+    '''
+    Every hundredth and half hundredth, exactly and one ulp-ish away on both sides
+    '''
+    values = [0.29, 0.57, 0.58, 0.145, 0.285, 0.395, 0.715, 0.995, 1 / 3, 2 / 3]
+    for k in range(201):
+        for eps in (0.0, 1e-12, -1e-12, 1e-9, -1e-9, 1e-7, -1e-7):
+            values.append(min(1.0, max(0.0, k / 200 + eps)))
+    return values
+
+
+@pytest.mark.parametrize('min_accept', THRESHOLDS)
+def test_similarity_to_cost_rounds_like_convert_similarity(min_accept):
+    values = boundary_values()
+    assert buffer_costs([values], min_accept) == list_costs([values], min_accept)
+
+
+def test_similarity_to_cost_on_random_blocks():
+    rng = np.random.default_rng(4)
+    for decimals in (2, 3, 4, 8):
+        sim = rng.random((30, 40)).round(decimals).tolist()
+        for min_accept in THRESHOLDS:
+            assert buffer_costs(sim, min_accept) == list_costs(sim, min_accept)
+
+
+@pytest.mark.parametrize('block_cells', [1, 7, 1 << 21])
+def test_build_cost_buffer_equals_the_list_pipeline(tmp_path, block_cells):
+    path = str(tmp_path / 'donors.csv')
+    ids, donors = generate_population(50, seed=2)
+    write_people(path, ids, donors)
+    recipients = generate_population(20, seed=5, prefix='R')[1] + [['A*01:99', 'B*08:77']]
+    sim = build_similarity_matrix(recipients, donors)
+    for pool in (donors, load_pool(path)):
+        for min_accept in (40, 60, 80):
+            buffer = build_cost_buffer(recipients, pool, min_accept, block_cells=block_cells)
+            cost = np.where(buffer['feasible'], buffer['cost'].astype(np.int64), INF)
+            assert cost.tolist() == list_costs(sim, min_accept)
+        pairs = buffer['similarity']
+        assert [[pairs[i][j] for j in range(len(donors))] for i in range(len(pairs))] == sim
+
+
+def cost_buffer(arr: list) -> tuple:
+    '''
+    (cost, feasible) buffers holding thresholded list costs
+    '''
+    arr = np.asarray(arr)
+    feasible = arr < INF
+    return np.where(feasible, arr, 0).astype(COST_DTYPE), feasible
+
+
+@pytest.mark.parametrize('engine', ['jv', 'sparse'])
+@pytest.mark.parametrize('n,m,density,seed', CASES)
+def test_match_buffer_is_optimal(engine, n, m, density, seed):
+    arr = random_costs(n, m, density, seed)
+    cost, feasible = cost_buffer(arr)
+    result, u, v = match_buffer(cost, feasible, engine, duals=True)
+    assert total_cost(arr, result) == optimal_cost(arr)
+    report = verify(buffer_cost_rows(cost, feasible), result, u, v)
+    assert report['ok'], report['messages']
+    assert match_buffer(cost, feasible, engine) == result
+
+
+@pytest.mark.parametrize('n,m,density,seed', CASES)
+def test_match_buffer_approx_is_bounded_by_its_gap(n, m, density, seed):
+    arr = random_costs(n, m, density, seed)
+    cost, feasible = cost_buffer(arr)
+    gap = {}
+    result = match_buffer(cost, feasible, 'approx', gap=gap)
+    live = [i for i, row in enumerate(arr) if any(c < INF for c in row)]
+    if not live:
+        assert result == [-1] * n
+        return
+    assert gap['lower_bound'] <= optimal_cost(arr) - INF * (n - len(live)) + 1e-6
+    assert total_cost(arr, result) - INF * (n - len(live)) == pytest.approx(gap['cost'])
+
+
+def test_match_buffer_rejects_list_engines():
+    cost, feasible = cost_buffer([[10]])
+    with pytest.raises(ValueError):
+        match_buffer(cost, feasible, 'hungarian')
@@ -0,0 +1,99 @@
+'''
+Engines against an optimal reference solver on small random cost matrices
+'''
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+
+from certificate import verify
+from matching import INF, match
+from matching_approx import approx_assignment, assignment_gap
+from matching_sparse import edges_from_cost
+
+EXACT_ENGINES = ('jv', 'hungarian', 'numpy', 'sparse')
+# (recipients, donors, share of acceptable pairs, seed)
+CASES = [(n, m, density, seed) for n, m in ((1, 1), (3, 5), (6, 6), (8, 12), (15, 20))
+         for density in (0.3, 0.7, 1.0) for seed in range(3)]
+
+
+def random_costs(n: int, m: int, density: float, seed: int) -> list:
+    '''
+    Thresholded costs (0..40, INF where not accepted), as remove_not_accepted gives them
+    '''
+    rng = np.random.default_rng(seed)
+    cost = rng.integers(0, 41, size=(n, m))
+    cost[rng.random((n, m)) >= density] = INF
+    return cost.tolist()
+
+
+def optimal_cost(arr: list) -> int:
+    '''
+    Optimum of the model every engine solves: not accepted pairs are forbidden and
+    every recipient may stay unassigned at cost INF (a private dummy donor)
+    '''
+    n, m = len(arr), len(arr[0])
+    full = np.full((n, m + n), np.inf)
+    cost = np.asarray(arr, dtype=np.float64)
+    full[:, :m] = np.where(cost < INF, cost, np.inf)
+    full[np.arange(n), m + np.arange(n)] = INF
+    rows, cols = linear_sum_assignment(full)
+    return int(full[rows, cols].sum())
+
+
+def total_cost(arr: list, result: list) -> int:
+    '''
+    Cost of an engine result in the same model, columns must be distinct
+    '''
+    taken = [j for j in result if j != -1]
+    assert len(taken) == len(set(taken))
+    return sum(INF if j == -1 else arr[i][j] for i, j in enumerate(result))
+
+
+def solve(arr: list, engine: str, duals: bool = False):
+    '''
+    match(), skipping instances the reduction/shift loop gives up on
+    '''
+    try:
+        solved = match([row.copy() for row in arr], engine=engine, duals=duals)
+    except SystemExit:
+        pytest.skip(f'{engine} found no possible shift')
+    return solved
+
+
+@pytest.mark.parametrize('engine', EXACT_ENGINES)
+@pytest.mark.parametrize('n,m,density,seed', CASES)
+def test_exact_engines_reach_the_optimum(engine, n, m, density, seed):
+    arr = random_costs(n, m, density, seed)
+    assert total_cost(arr, solve(arr, engine)) == optimal_cost(arr)
+
+
+@pytest.mark.parametrize('n,m,density,seed', CASES)
+def test_approx_is_bounded_by_its_duals(n, m, density, seed):
+    arr = random_costs(n, m, density, seed)
+    result, u, v = solve(arr, 'approx', duals=True)
+    report = verify(arr, result, u, v)
+    assert report['dual'] == 0 and report['primal'] == 0
+    assert report['gap'] >= 0
+    assert report['lower_bound'] <= optimal_cost(arr) <= total_cost(arr, result)
+
+
+@pytest.mark.parametrize('n,m,density,seed', CASES)
+def test_approx_gap_report_matches_the_certificate(n, m, density, seed):
+    arr = random_costs(n, m, density, seed)
+    indptr, indices, costs, n_cols = edges_from_cost(arr)
+    result, u, v = approx_assignment(indptr, indices, costs, n_cols)
+    gap = assignment_gap(indptr, indices, costs, result, u, v)
+    report = verify(arr, result, u, v)
+    for key in ('cost', 'lower_bound', 'gap'):
+        assert isinstance(gap[key], float)
+        assert gap[key] == pytest.approx(report[key])
+
+
+@pytest.mark.parametrize('engine', EXACT_ENGINES)
+@pytest.mark.parametrize('n,m,density,seed', CASES)
+def test_verify_certifies_exact_engines(engine, n, m, density, seed):
+    arr = random_costs(n, m, density, seed)
+    result, u, v = solve(arr, engine, duals=True)
+    report = verify(arr, result, u, v)
+    assert report['ok'], report['messages']
+    assert report['gap'] == pytest.approx(0)
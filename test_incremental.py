@@ -0,0 +1,93 @@
+'''
+IncrementalMatcher and the threshold sweep against optimal cold solves
+'''
+import csv
+import random
+import numpy as np
+import pytest
+from benchmarks.population import generate_population, write_people
+from incremental import IncrementalMatcher
+from matching import convert_similarity, match, remove_not_accepted
+from matrix_builder import build_similarity_array
+from output import MATCHED, assignment_rows
+from test_engines import optimal_cost, total_cost
+import main
+
+
+def assert_optimal(matcher: IncrementalMatcher):
+    '''
+    Costs equal a build from scratch and the assignment reaches the optimum
+    '''
+    if matcher.recipients and matcher.donors:
+        sim = build_similarity_array(matcher.recipients, matcher.donors, params=matcher.params)
+        assert matcher.cost == remove_not_accepted(convert_similarity(sim.tolist()),
+                                                   matcher.min_accept)
+        assert total_cost(matcher.cost, matcher.result()) == optimal_cost(matcher.cost)
+
+
+def test_single_changes_keep_the_optimum():
+    rng = random.Random(3)
+    people = generate_population(120, seed=11)[1]
+    matcher = IncrementalMatcher(people[:6], people[6:16], min_accept=50)
+    assert_optimal(matcher)
+    pool = people[16:]
+    for _ in range(80):
+        n, m = len(matcher.recipients), len(matcher.donors)
+        ops = ['add_donor']
+        if n < m:
+            ops.append('add_recipient')
+        if n:
+            ops.append('remove_recipient')
+        if n < m and m > 1:
+            ops.append('remove_donor')
+        op = rng.choice(ops)
+        if op == 'add_recipient':
+            matcher.add_recipient(pool.pop())
+        elif op == 'add_donor':
+            matcher.add_donor(pool.pop())
+        elif op == 'remove_recipient':
+            matcher.remove_recipient(rng.randrange(n))
+        else:
+            matcher.remove_donor(rng.randrange(m))
+        assert_optimal(matcher)
+        if not pool:
+            break
+
+
+def test_tighten_keeps_the_optimum():
+    rng = np.random.default_rng(5)
+    for n, m in ((1, 1), (5, 8), (12, 12), (20, 35)):
+        sim = rng.uniform(0.3, 1.0, size=(n, m)).round(4).tolist()
+        matcher = IncrementalMatcher.from_similarity(sim, 40)
+        for threshold in (40, 55, 60, 70, 71, 85, 100):
+            matcher.tighten(threshold)
+            cost = remove_not_accepted(convert_similarity(sim), threshold)
+            assert matcher.cost == cost
+            assert total_cost(cost, matcher.result()) == optimal_cost(cost)
+
+
+def test_tighten_only_raises_the_threshold():
+    matcher = IncrementalMatcher.from_similarity([[0.9, 0.7]], 60)
+    with pytest.raises(ValueError):
+        matcher.tighten(50)
+
+
+def test_sweep_matches_cold_solves(tmp_path):
+    recipients, donors, out = (str(tmp_path / name) for name in
+                               ('recipients.csv', 'donors.csv', 'sweep.csv'))
+    rec_ids, recs = generate_population(30, seed=1, prefix='R')
+    don_ids, dons = generate_population(60, seed=2)
+    write_people(recipients, rec_ids, recs, 'Recipient')
+    write_people(donors, don_ids, dons)
+    assert main.main([recipients, donors, '--min-accept-sweep', '40:80:10',
+                      '--output', out]) == 0
+    with open(out, encoding='utf-8') as fh:
+        rows = list(csv.DictReader(fh))
+    assert [int(row['min_accept']) for row in rows] == [40, 50, 60, 70, 80]
+    sim = build_similarity_array(recs, dons).tolist()
+    for row in rows:
+        threshold = int(row['min_accept'])
+        cold = match(remove_not_accepted(convert_similarity(sim), threshold))
+        rows_cold = assignment_rows(rec_ids, don_ids, sim, cold, threshold)
+        assert int(row['matched']) == [status for *_, status in rows_cold].count(MATCHED)
+        assert int(row['recipients']) == len(rec_ids)
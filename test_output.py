@@ -0,0 +1,163 @@
+'''
+Streaming output sinks against the writers they replaced
+'''
+import csv
+import io
+import json
+import random
+import pytest
+import output
+from output import AssignmentCsvSink, JsonDocumentSink, MatrixCsvSink, MatrixHtmlSink, \
+    NdjsonSink, SparseHtmlSink, copy_json, write_outputs
+
+REC_IDS = ['R1', 'R,2', 'R"3', 'R4', 'R5', 'R6']
+DON_IDS = ['D1', 'D 2', 'D,3', 'D4']
+SIM = [[0.9, 0.1, 0.2, 0.3],
+       [0.5, 0.6, 0.7, 0.8],
+       [0.4, 0.6, 0.1, 0.2],
+       [0.2, 0.3, None, 0.7],
+       [0.5, 0.6, 0.6, 0.6],
+       [0.1, 0.2, 0.3, 0.4]]
+# Matched, matched, exactly at the threshold, None similarity, below it, short result
+RESULT = [0, 3, 1, 2, 0]
+MIN_ACCEPT = 60
+
+
+def accepted(i: int, sim, result, min_accept) -> int:
+    '''
+    Assigned column if its similarity reaches the threshold, else -1
+    '''
+    assigned = result[i] if i < len(result) else -1
+    if assigned != -1 and 0 <= assigned < len(sim[i]):
+        val = sim[i][assigned]
+        if val is not None and val >= min_accept / 100.0:
+            return assigned
+    return -1
+
+
+def reference_matrix_csv(rec_ids, don_ids, sim, result, min_accept) -> str:
+    '''
+    The matrix CSV as main.write_matrix_csv wrote it before the sinks
+    '''
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([''] + don_ids)
+    for i, rid in enumerate(rec_ids):
+        row = [''] * len(don_ids)
+        j = accepted(i, sim, result, min_accept)
+        if j != -1:
+            row[j] = f"{sim[i][j]:.6f}"
+        writer.writerow([rid] + row)
+    return buf.getvalue()
+
+
+def reference_assignment_csv(rec_ids, don_ids, sim, result, min_accept) -> str:
+    '''
+    main.generate_assignment_csv_string before the sinks
+    '''
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(['recipient', 'assigned_donor', 'similarity'])
+    for i, rid in enumerate(rec_ids):
+        j = accepted(i, sim, result, min_accept)
+        writer.writerow([rid, don_ids[j], f"{sim[i][j]:.6f}"] if j != -1 else [rid, '', ''])
+    return buf.getvalue()
+
+
+def reference_matrix_html(rec_ids, don_ids, sim, result, min_accept) -> str:
+    '''
+    main.write_matrix_html before the sinks
+    '''
+    out = [output.HTML_HEAD, '<h2>HLA Similarity Matrix</h2>', '<table>\n',
+           '<tr><th>Recipient / Donor</th>']
+    out += [f'<th>{d}</th>' for d in don_ids]
+    out.append('</tr>\n')
+    for i, rid in enumerate(rec_ids):
+        j = accepted(i, sim, result, min_accept)
+        row_class = '' if j != -1 else ' class="badrow"'
+        out.append(f'<tr{row_class}><th>{rid}</th>')
+        out += [f'<td class="good">{sim[i][k]:.4f}</td>' if k == j else '<td></td>'
+                for k in range(len(don_ids))]
+        out.append('</tr>\n')
+    out.append('</table>\n</body></html>')
+    return ''.join(out)
+
+
+def write(sink_class, *args) -> str:
+    buf = io.StringIO()
+    write_outputs(*args, [sink_class(stream=buf)])
+    return buf.getvalue()
+
+
+def document(*args) -> str:
+    sink = JsonDocumentSink(args[3])
+    write_outputs(*args, [sink])
+    buf = io.StringIO()
+    copy_json(sink, buf)
+    return buf.getvalue()
+
+
+def random_case(rng: random.Random) -> tuple:
+    n, m = rng.randint(0, 12), rng.randint(1, 12)
+    sim = [[rng.choice([None, round(rng.random(), rng.randint(1, 8))]) for _ in range(m)]
+           for _ in range(n)]
+    result = [rng.randrange(-1, m) for _ in range(rng.randint(0, n))]
+    return ([f'R{i}' for i in range(n)], [f'D{j}' for j in range(m)], sim, result,
+            rng.choice([0, 40, 60, 80, 100]))
+
+
+def cases() -> list:
+    rng = random.Random(3)
+    return [(REC_IDS, DON_IDS, SIM, RESULT, MIN_ACCEPT)] + [random_case(rng) for _ in range(60)]
+
+
+@pytest.mark.parametrize('sink_class, reference', [
+    (MatrixCsvSink, reference_matrix_csv),
+    (AssignmentCsvSink, reference_assignment_csv),
+    (MatrixHtmlSink, reference_matrix_html)])
+def test_sinks_write_what_the_baseline_writers_wrote(sink_class, reference):
+    for case in cases():
+        assert write(sink_class, *case) == reference(*case)
+
+
+def test_json_document_equals_json_dumps(monkeypatch):
+    # Tiny spools, so every section moves to disk while it is written
+    monkeypatch.setattr(output, 'SPOOL_SIZE', 16)
+    for case in cases():
+        expected = json.dumps({'result': case[3], 'csv_matrix': reference_matrix_csv(*case),
+                               'csv_assignment': reference_assignment_csv(*case)})
+        assert document(*case) == expected + '\n'
+
+
+def test_ndjson_has_one_record_per_recipient():
+    records = [json.loads(line) for line in
+               write(NdjsonSink, REC_IDS, DON_IDS, SIM, RESULT, MIN_ACCEPT).splitlines()]
+    assert records == [
+        {'recipient': 'R1', 'donor': 'D1', 'similarity': 0.9, 'status': 'matched'},
+        {'recipient': 'R,2', 'donor': 'D4', 'similarity': 0.8, 'status': 'matched'},
+        {'recipient': 'R"3', 'donor': 'D 2', 'similarity': 0.6, 'status': 'matched'},
+        {'recipient': 'R4', 'donor': None, 'similarity': None, 'status': 'below_threshold'},
+        {'recipient': 'R5', 'donor': None, 'similarity': 0.5, 'status': 'below_threshold'},
+        {'recipient': 'R6', 'donor': None, 'similarity': None, 'status': 'unmatched'}]
+
+
+def test_sparse_html_escapes_ids():
+    html = write(SparseHtmlSink, ['<R1>'], ['D&1'], [[0.9]], [0], MIN_ACCEPT)
+    assert '<th>&lt;R1&gt;</th><td>D&amp;1</td><td class="good">0.9000</td>' in html
+    assert html.startswith(output.HTML_HEAD) and html.endswith('</table>\n</body></html>')
+
+
+def test_one_pass_writes_every_file(tmp_path):
+    paths = {name: str(tmp_path / name) for name in ('m.csv', 'a.csv', 'm.html', 'r.ndjson')}
+    sinks = [MatrixCsvSink(paths['m.csv']), AssignmentCsvSink(paths['a.csv']),
+             MatrixHtmlSink(paths['m.html']), NdjsonSink(paths['r.ndjson'])]
+    case = (REC_IDS, DON_IDS, SIM, RESULT, MIN_ACCEPT)
+    write_outputs(*case, sinks)
+    written = {}
+    for name, path in paths.items():
+        with open(path, newline='', encoding='utf-8') as fh:
+            written[name] = fh.read()
+    assert written['m.csv'] == reference_matrix_csv(*case)
+    assert written['a.csv'] == reference_assignment_csv(*case)
+    assert written['m.html'] == reference_matrix_html(*case)
+    assert written['r.ndjson'] == write(NdjsonSink, *case)
@@ -0,0 +1,112 @@
+'''
+Representation and solver choices of the execution planner
+'''
+import numpy as np
+import pytest
+
+import planner
+from benchmarks.population import generate_population, write_people
+from cost_buffer import build_cost_buffer
+from planner import BASE_BYTES, MEMORY_FRACTION, MIN_TILE_BYTES, SPARSE_DENSITY, \
+    estimate_bytes, format_bytes, plan_run, sample_density
+from pool_cache import load_pool
+from tiled_builder import RAM_BUDGET
+
+GIB = 1 << 30
+
+
+def test_small_runs_are_solved_in_memory():
+    plan = plan_run(1000, 10000, 0.5, max_memory=GIB, cpus=4)
+    assert (plan['representation'], plan['engine'], plan['workers']) == ('ndarray', 'jv', 1)
+    assert plan['estimated_bytes'] == estimate_bytes('ndarray', 'jv', 1000, 10000, 5e6)
+    assert plan['estimated_bytes'] <= plan['memory_budget'] == GIB
+
+
+@pytest.mark.parametrize('density, engine', [(0.0, 'sparse'), (SPARSE_DENSITY, 'sparse'),
+                                             (SPARSE_DENSITY + 1e-9, 'jv'), (1.0, 'jv')])
+def test_engine_follows_the_density(density, engine):
+    assert plan_run(200, 3000, density, max_memory=GIB, cpus=1)['engine'] == engine
+
+
+def test_runs_that_do_not_fit_go_to_tiles():
+    n, m = 50000, 500000
+    budget = 8 * GIB
+    assert estimate_bytes('ndarray', 'jv', n, m, 0) > budget
+    plan = plan_run(n, m, 0.5, max_memory=budget, cpus=4)
+    assert (plan['representation'], plan['engine']) == ('memmap-tiles', 'jv')
+    assert MIN_TILE_BYTES <= plan['ram_budget'] <= RAM_BUDGET
+    assert plan['estimated_bytes'] <= budget
+    assert 'ndarray needs' in plan['reason']
+
+
+def test_tiles_drop_the_sparse_solver_when_edges_do_not_fit():
+    n, m, density = 50000, 500000, 0.04
+    budget = 8 * GIB
+    assert estimate_bytes('memmap-tiles', 'sparse', n, m, density * n * m, MIN_TILE_BYTES) \
+        > budget
+    plan = plan_run(n, m, density, max_memory=budget, cpus=4)
+    assert (plan['representation'], plan['engine']) == ('memmap-tiles', 'jv')
+    assert 'edges do not fit' in plan['reason']
+
+
+def test_tile_budget_shrinks_to_the_memory_left():
+    budget = BASE_BYTES + (100 << 20)
+    plan = plan_run(100000, 100000, 0.5, max_memory=budget, cpus=1)
+    assert plan['representation'] == 'memmap-tiles'
+    assert plan['ram_budget'] == 100 << 20
+    assert plan['estimated_bytes'] == budget
+
+
+@pytest.mark.parametrize('density, lists', [(0.5, 'dense-list'), (0.01, 'sparse-edges')])
+def test_list_options_plan_the_list_pipeline_when_it_fits(density, lists):
+    plan = plan_run(300, 2000, density, max_memory=GIB, cpus=6, list_options=True)
+    assert (plan['representation'], plan['workers']) == (lists, 6)
+    plan = plan_run(3000, 20000, density, max_memory=2 * GIB, cpus=6, list_options=True)
+    assert (plan['representation'], plan['workers']) == ('ndarray', 1)
+
+
+@pytest.mark.parametrize('representation', planner.REPRESENTATIONS)
+def test_a_fixed_representation_is_kept(representation):
+    plan = plan_run(100000, 100000, 0.5, max_memory=1 << 20, cpus=2,
+                    representation=representation)
+    assert plan['representation'] == representation
+    assert plan['estimated_bytes'] > plan['memory_budget']
+
+
+def test_memory_budget_defaults_to_a_fraction_of_available(monkeypatch):
+    monkeypatch.setattr(planner, 'available_memory', lambda: 10 * GIB)
+    assert plan_run(10, 10, 0.5, cpus=1)['memory_budget'] == int(10 * GIB * MEMORY_FRACTION)
+    monkeypatch.setattr(planner, 'available_memory', lambda: None)
+    plan = plan_run(10 ** 6, 10 ** 6, 0.5, cpus=1)
+    assert plan['memory_budget'] is None and plan['representation'] == 'ndarray'
+    assert plan['reason'].endswith('of unknown')
+
+
+def test_estimates_order_the_representations():
+    n, m, edges = 2000, 50000, 1e6
+    sizes = [estimate_bytes(r, 'jv', n, m, edges) for r in ('dense-list', 'sparse-edges',
+                                                             'ndarray')]
+    assert sizes == sorted(sizes, reverse=True)
+    assert estimate_bytes('memmap-tiles', 'jv', n, m, edges, 1 << 20) == BASE_BYTES + (1 << 20)
+    assert estimate_bytes('ndarray', 'sparse', n, m, edges) \
+        - estimate_bytes('ndarray', 'jv', n, m, edges) == edges * planner.EDGE_BYTES
+
+
+@pytest.mark.parametrize('size, text', [(0, '0 B'), (1023, '1023 B'), (1024, '1.0 KiB'),
+                                        (5 << 20, '5.0 MiB'), (3 << 29, '1.5 GiB'),
+                                        (1 << 50, '1024.0 TiB')])
+def test_format_bytes(size, text):
+    assert format_bytes(size) == text
+
+
+def test_full_sample_density_is_exact(tmp_path):
+    path = str(tmp_path / 'donors.csv')
+    ids, donors = generate_population(40, seed=2)
+    write_people(path, ids, donors)
+    recipients = generate_population(12, seed=5, prefix='R')[1]
+    for min_accept in (40, 60, 80):
+        exact = float(np.mean(build_cost_buffer(recipients, donors, min_accept)['feasible']))
+        assert sample_density(recipients, donors, min_accept) == exact
+        assert sample_density(recipients, load_pool(path), min_accept) == exact
+        assert 0.0 <= sample_density(recipients, donors, min_accept, rows=5, cols=7) <= 1.0
+    assert sample_density([], donors) == sample_density(recipients, []) == 0.0
@@ -0,0 +1,50 @@
+'''
+Checks of the compiled donor pool cache
+'''
+import json
+import os
+import pool_cache
+
+
+def write_csv(path, donors: dict):
+    with open(path, 'w', encoding='utf-8') as fh:
+        for donor_id, alleles in donors.items():
+            fh.write(','.join([donor_id, *alleles]) + '\n')
+
+
+def test_rebuild_removes_arrays_of_earlier_builds(tmp_path):
+    csv = str(tmp_path / 'donors.csv')
+    write_csv(csv, {'D1': ['A*01:01', 'B*08:01']})
+    first = pool_cache.load_pool(csv)
+    write_csv(csv, {'D2': ['A*02:01'], 'D3': ['A*03:01', 'B*07:02']})
+    second = pool_cache.load_pool(csv)
+    assert first['ids'].tolist() == ['D1']
+    assert second['ids'].tolist() == ['D2', 'D3']
+    with open(os.path.join(csv + '.pool', 'meta.json'), encoding='utf-8') as fh:
+        names = json.load(fh)['arrays']
+    assert sorted(n for n in os.listdir(csv + '.pool') if n.endswith('.npy')) \
+        == sorted(names.values())
+
+
+def test_load_retries_when_a_rebuild_swaps_the_arrays(tmp_path, monkeypatch):
+    csv = str(tmp_path / 'donors.csv')
+    write_csv(csv, {'D1': ['A*01:01', 'B*08:01']})
+    pool_cache.load_pool(csv)
+    is_fresh = pool_cache.is_fresh
+    rebuilt = []
+
+    def rebuild_concurrently(meta, csv_path, cache_dir):
+        # Another run rebuilds after this one read meta.json, before it maps the arrays
+        if not rebuilt:
+            rebuilt.append(True)
+            write_csv(csv_path, {'D2': ['A*02:01'], 'D3': ['A*03:01', 'B*07:02']})
+            pool_cache.build_pool(csv_path, cache_dir)
+            return True
+        return is_fresh(meta, csv_path, cache_dir)
+
+    monkeypatch.setattr(pool_cache, 'is_fresh', rebuild_concurrently)
+    pool = pool_cache.load_pool(csv)
+    assert rebuilt
+    assert pool['ids'].tolist() == ['D2', 'D3']
+    assert pool['vocab']['names'] == ['A', 'B']
+    assert pool['allele'].tolist() == [[0, -1], [1, 0]]
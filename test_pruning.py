@@ -0,0 +1,38 @@
+'''
+Upper-bound pruning against the full similarity build
+'''
+from benchmarks.population import generate_population, write_people
+from matching import convert_similarity, remove_not_accepted
+from matrix_builder import build_similarity_matrix
+from pool_cache import load_pool
+from pruning import build_similarity_pruned
+
+# Alleles no generated donor carries, in groups some donors share
+UNSEEN = [['A*01:99', 'B*08:77', 'C*07:98', 'DRB1*99:01'], ['A*02:777', 'B*44:99']]
+
+
+def costs(sim, min_accept: int = 60) -> list:
+    return remove_not_accepted(convert_similarity(sim), min_accept)
+
+
+def test_pruned_costs_equal_the_full_build(tmp_path):
+    path = str(tmp_path / 'donors.csv')
+    ids, donors = generate_population(80, seed=2)
+    write_people(path, ids, donors)
+    recipients = generate_population(25, seed=5, prefix='R')[1] + UNSEEN
+    full = build_similarity_matrix(recipients, donors)
+    for min_accept in (40, 60, 80):
+        sim, pruned = build_similarity_pruned(recipients, load_pool(path), min_accept)
+        assert costs(sim.tolist(), min_accept) == costs(full, min_accept)
+        assert pruned > 0 or min_accept == 40
+
+
+def test_unseen_alleles_leave_pool_vocabulary_unchanged(tmp_path):
+    path = str(tmp_path / 'donors.csv')
+    write_people(path, ['D1', 'D2'], [['A*01:01', 'B*08:01'], ['A*02:01', 'B*07:02']])
+    pool = load_pool(path)
+    before = [len(alleles) for alleles in pool['vocab']['alleles']]
+    build_similarity_pruned(UNSEEN, pool, min_accept=0)
+    assert before == [2, 2]
+    assert [len(alleles) for alleles in pool['vocab']['alleles']] == before
+    assert pool['vocab']['names'] == ['A', 'B']
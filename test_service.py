@@ -0,0 +1,65 @@
+'''
+Checks of the resident matching service through its request path
+'''
+import asyncio
+import json
+import pytest
+from benchmarks.population import generate_population, write_people
+from service import MatchingService, load_donors
+
+
+@pytest.fixture(name='service')
+def fixture_service(tmp_path):
+    '''
+    Service over 30 generated donors, solving in threads
+    '''
+    path = tmp_path / 'donors.csv'
+    write_people(str(path), *generate_population(30, seed=2))
+    service = MatchingService(load_donors(str(path)), workers=0)
+    yield service
+    service.close()
+
+
+def run(service: MatchingService, requests) -> list:
+    '''
+    Runs request coroutines with the batcher running, as serve() does
+    '''
+    async def main():
+        service.queue = asyncio.Queue()
+        batcher = asyncio.get_running_loop().create_task(service.run_batches())
+        try:
+            return [await request for request in requests()]
+        finally:
+            batcher.cancel()
+    return asyncio.run(main())
+
+
+def test_unseen_alleles_leave_pool_vocabulary_unchanged(service):
+    before = [len(alleles) for alleles in service.pool['vocab']['alleles']]
+    body = json.dumps({'recipients': [{'id': 'R1', 'alleles': ['A*99:98', 'B*99:99',
+                                                               'DRB1*01:01']}],
+                       'min_accept': 0}).encode('utf-8')
+    (status, payload), = run(service, lambda: [service.dispatch('POST', '/match', body)])
+    assert status == 200
+    assert payload['matches'][0]['recipient'] == 'R1'
+    assert payload['result'][0] != -1
+    assert [len(alleles) for alleles in service.pool['vocab']['alleles']] == before
+
+
+def test_negative_content_length_is_rejected(service):
+    async def request() -> bytes:
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST /match HTTP/1.1\r\nContent-Length: -5\r\n\r\n')
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    response, = run(service, lambda: [request()])
+    head, _, body = response.partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 400')
+    assert 'Negative Content-Length' in json.loads(body)['error']
@@ -0,0 +1,75 @@
+'''
+Tiled memory-mapped builds against the in-memory builds
+'''
+import os
+import numpy as np
+import pytest
+
+from benchmarks.population import generate_population, write_people
+from cost_buffer import build_cost_buffer, match_buffer
+from matrix_builder import build_similarity_array
+from pool_cache import load_pool
+from score_tables import DEFAULT_PARAMS, scoring_params
+from tiled_builder import CELL_BYTES, build_similarity_tiled, build_tiled_buffer, tiles
+
+# Budgets of one cell, a few cells (tiles split rows) and a few rows per tile
+BUDGETS = [CELL_BYTES, CELL_BYTES * 7, CELL_BYTES * 100]
+
+
+@pytest.fixture(name='populations', scope='module')
+def fixture_populations() -> tuple:
+    '''
+    Recipients with one unseen typing, and 45 donors
+    '''
+    recipients = generate_population(17, seed=5, prefix='R')[1] + [['A*01:99', 'B*08:77']]
+    return recipients, generate_population(45, seed=2)
+
+
+@pytest.mark.parametrize('n,m', [(1, 1), (3, 2), (7, 13), (20, 5)])
+@pytest.mark.parametrize('budget', BUDGETS)
+def test_tiles_cover_every_cell_once(n, m, budget):
+    seen = np.zeros((n, m), dtype=int)
+    for rows, cols in tiles(n, m, budget):
+        assert (rows.stop - rows.start) * (cols.stop - cols.start) * CELL_BYTES \
+            <= max(budget, CELL_BYTES)
+        seen[rows, cols] += 1
+    assert (seen == 1).all()
+
+
+@pytest.mark.parametrize('budget', BUDGETS)
+@pytest.mark.parametrize('params', [DEFAULT_PARAMS, scoring_params(full_match_points=1.0,
+                                                                   two_field_points=2.5)])
+def test_tiled_similarity_equals_the_array_build(tmp_path, populations, budget, params):
+    recipients, (ids, donors) = populations
+    path = str(tmp_path / 'donors.csv')
+    write_people(path, ids, donors)
+    tile_dir = tmp_path / 'tiles'
+    tile_dir.mkdir()
+    expected = build_similarity_array(recipients, donors, params=params)
+    for pool in (donors, load_pool(path)):
+        sim = build_similarity_tiled(recipients, pool, budget, str(tile_dir), params)
+        assert isinstance(sim, np.memmap)
+        assert np.array_equal(sim, expected)
+        # The backing file is anonymous
+        assert not os.listdir(tile_dir)
+
+
+@pytest.mark.parametrize('budget', BUDGETS)
+def test_tiled_buffer_equals_the_cost_buffer(tmp_path, populations, budget):
+    recipients, (_, donors) = populations
+    for min_accept in (40, 60, 80):
+        tiled = build_tiled_buffer(recipients, donors, min_accept, budget, str(tmp_path))
+        memory = build_cost_buffer(recipients, donors, min_accept)
+        assert np.array_equal(tiled['cost'], memory['cost'])
+        assert np.array_equal(tiled['feasible'], memory['feasible'])
+        for engine in ('jv', 'sparse'):
+            assert match_buffer(tiled['cost'], tiled['feasible'], engine) \
+                == match_buffer(memory['cost'], memory['feasible'], engine)
+
+
+def test_empty_populations(populations):
+    recipients, (_, donors) = populations
+    assert build_similarity_tiled([], donors).shape == (0, len(donors))
+    buffer = build_tiled_buffer(recipients, [], ram_budget=CELL_BYTES)
+    assert buffer['cost'].shape == buffer['feasible'].shape == (len(recipients), 0)
+    assert match_buffer(buffer['cost'], buffer['feasible']) == [-1] * len(recipients)
@@ -0,0 +1,135 @@
+"""Out-of-core similarity matrix in tiles backed by memory-mapped files.
+
+`build_similarity_matrix` returns Python lists and `build_cost_buffer` keeps
+3 bytes per pair in RAM; both stop working once the recipients x donors
+matrix outgrows physical memory. Here every stage works on one tile of
+recipients x donors at a time and writes it into a `numpy.memmap`:
+
+- `build_similarity_tiled`: float64 similarities, scored tile by tile
+- `cost_from_similarity`: uint16 costs and the bool feasibility mask,
+  converted tile by tile with cost_buffer.similarity_to_cost
+
+The files are anonymous temporaries (removed when the arrays are released),
+placed in `tile_dir` or the system temporary directory. The solvers of
+cost_buffer.match_buffer read the cost buffers row by row, and the writers of
+output.py only read the assigned cell of every row, so resident memory stays
+near the tile budget plus the O(N + M) solver state; the page cache does the
+rest. Values are identical to the in-memory pipelines.
+"""
+
+import tempfile
+
+import numpy as np
+
+from cost_buffer import COST_DTYPE, similarity_to_cost
+from matrix_builder import encode_populations, recipient_max_scores, score_encoded, \
+    normalize_scores
+from score_tables import DEFAULT_PARAMS
+
+# Default RAM budget of the tile temporaries, bytes
+RAM_BUDGET = 512 << 20
+# Bytes of temporaries per scored cell: score sums, table lookups, normalization
+CELL_BYTES = 48
+
+
+def tile_shape(n: int, m: int, ram_budget: int = RAM_BUDGET) -> tuple:
+    """Rows and columns of a tile that fits the budget, whole rows when possible.
+
+    >>> tile_shape(1000, 100, 48 * 1000), tile_shape(1000, 100000, 48 * 1000)
+    ((10, 100), (1, 1000))
+    """
+    cells = max(1, ram_budget // CELL_BYTES)
+    cols = max(1, min(m, cells))
+    return max(1, min(n, cells // cols)), cols
+
+
+def tiles(n: int, m: int, ram_budget: int = RAM_BUDGET):
+    """Yield (row slice, column slice) covering an (n, m) matrix row-major.
+
+    >>> [(r.start, r.stop, c.start, c.stop) for r, c in tiles(3, 2, 48 * 4)]
+    [(0, 2, 0, 2), (2, 3, 0, 2)]
+    """
+    rows, cols = tile_shape(n, m, ram_budget)
+    for r0 in range(0, n, rows):
+        for c0 in range(0, m, cols):
+            yield slice(r0, min(n, r0 + rows)), slice(c0, min(m, c0 + cols))
+
+
+def open_memmap(shape: tuple, dtype, tile_dir: str = None) -> np.ndarray:
+    """Writable (N, M) array in an anonymous temporary file.
+
+    The file has no name on POSIX systems (elsewhere it is deleted on
+    close), so nothing is left behind. Empty shapes get a plain array.
+    """
+    if not shape[0] or not shape[1]:
+        return np.zeros(shape, dtype=dtype)
+    with tempfile.TemporaryFile(dir=tile_dir) as fh:
+        # The mapping stays valid after the file object is closed
+        return np.memmap(fh, dtype=dtype, mode='w+', shape=shape)
+
+
+def build_similarity_tiled(recipients: list, donors, ram_budget: int = RAM_BUDGET,
+                           tile_dir: str = None, params: tuple = DEFAULT_PARAMS) -> np.ndarray:
+    """
+    Similarity matrix written tile by tile into a memory-mapped file.
+
+    Args:
+        recipients: List of lists of allele strings.
+        donors: List of lists of allele strings, or a pool_cache.load_pool pool.
+        ram_budget: Bytes of tile temporaries, see tile_shape.
+        tile_dir: Directory of the backing file (default: system temp dir).
+        params: Scoring parameters, see score_tables.scoring_params.
+
+    Returns:
+        np.ndarray: (N, M) float64 memmap, same values as build_similarity_array.
+    """
+    rec, don, vocab = encode_populations(recipients, donors)
+    n, m = len(recipients), len(don['allele'])
+    max_s = np.array(recipient_max_scores(recipients, params))[:, None]
+    sim = open_memmap((n, m), np.float64, tile_dir)
+    for rows, cols in tiles(n, m, ram_budget):
+        total = score_encoded({'locus': rec['locus'][rows], 'allele': rec['allele'][rows]},
+                              {'allele': don['allele'][cols]}, vocab, params)
+        sim[rows, cols] = normalize_scores(total, max_s[rows])
+    return sim
+
+
+def cost_from_similarity(sim: np.ndarray, min_accept: float = 60,
+                         ram_budget: int = RAM_BUDGET, tile_dir: str = None) -> tuple:
+    """
+    Cost buffer and feasibility mask of a (memory-mapped) similarity matrix.
+
+    Args:
+        sim: (N, M) float64 similarities.
+        min_accept: Minimum accepted similarity percentage.
+        ram_budget: Bytes of conversion temporaries per tile.
+        tile_dir: Directory of the backing files (default: system temp dir).
+
+    Returns:
+        tuple: (uint16 cost memmap, bool feasibility memmap), both (N, M).
+
+    >>> cost, feasible = cost_from_similarity(np.array([[0.5, 0.71], [0.6, 0.2]]), 60, 48)
+    >>> cost.tolist(), feasible.tolist()
+    ([[50, 28], [40, 80]], [[False, True], [True, False]])
+    """
+    cost = open_memmap(sim.shape, COST_DTYPE, tile_dir)
+    feasible = open_memmap(sim.shape, bool, tile_dir)
+    for rows, cols in tiles(*sim.shape, ram_budget):
+        similarity_to_cost(np.asarray(sim[rows, cols]), cost[rows, cols], feasible[rows, cols],
+                           min_accept)
+    return cost, feasible
+
+
+def build_tiled_buffer(recipients: list, donors, min_accept: float = 60,
+                       ram_budget: int = RAM_BUDGET, tile_dir: str = None,
+                       params: tuple = DEFAULT_PARAMS) -> dict:
+    """
+    cost_buffer.build_cost_buffer with every matrix in a memory-mapped file.
+
+    Returns:
+        dict: ``'cost'``, ``'feasible'`` and ``'similarity'`` (the float64
+        memmap), ready for cost_buffer.match_buffer and the output writers.
+    """
+    sim = build_similarity_tiled(recipients, donors, ram_budget, tile_dir, params)
+    cost, feasible = cost_from_similarity(sim, min_accept, ram_budget, tile_dir)
+    return {'cost': cost, 'feasible': feasible, 'similarity': sim}